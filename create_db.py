@@ -1,23 +1,291 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import event
-from sqlalchemy.engine import Engine
-from datetime import datetime
-
-from src.models import populate_db
-from src.models import app, db
-from src.models import Category
-
-@event.listens_for(Engine, "connect")
-def set_sqlite_pragma(dbapi_connection, connection_record):
-    cursor = dbapi_connection.cursor()
-    cursor.execute("PRAGMA foreign_keys=ON")
-    cursor.close()
+import argparse
+import os
+import random
+import sys
+from datetime import date, datetime, time, timedelta
+from flask import current_app
+from sqlalchemy import inspect, select, text
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from app import create_app
+from models import populate_db, rebuild_daily_totals, apply_to_daily_totals, find_overlapping_logs
+from models import db
+from models import User, Category, Activity, Log, TimeReport, ApiKey
+
+# Covering index that keeps every column of the log table in (user_id,
+# start_time) order, so SQLite can answer the list, export and report
+# queries from the index alone as if the table were clustered by user and
+# time. Indexes made by older versions lacked comments and are replaced.
+LOG_CLUSTER_INDEX = (
+    "CREATE INDEX ix_log_user_start_cluster ON log "
+    "(user_id, start_time, rid, end_time, activity_category, activity_name, comments)"
+)
+
+# Activities of the synthetic dataset with their share of the time spent in
+# their category
+SYNTHETIC_ACTIVITIES = {
+    "Work": [("Coding", 40), ("Meetings", 20), ("Code review", 12), ("Email", 10), ("Planning", 10), ("Support", 8)],
+    "Learning": [("Courses", 50), ("Reading", 50)],
+    "Exercise": [("Gym", 40), ("Running", 35), ("Yoga", 25)],
+    "Personal": [("Errands", 60), ("Appointments", 40)],
+}
+SYNTHETIC_COMMENTS = ["Sprint work", "Follow-up", "Customer call", "Refactoring", "Team sync", "Reviewed PRs"]
+
+
+def _pick(rng, choices):
+    names, weights = zip(*choices)
+    return rng.choices(names, weights)[0]
+
+def _minutes(rng, low, high):
+    """ A random duration in quarter hours """
+    return timedelta(minutes=rng.randrange(low, high + 1, 15))
+
+def synthetic_day(rng, day, profile):
+    """
+    Yields the (category, activity, start, end) logs of one user on one day.
+    Weekdays are work days that start around the user's usual hour, with a
+    lunch break, short gaps between blocks and now and then a log that
+    overlaps the previous one, as when a user logs something twice. Some
+    weekdays are skipped like holidays, and evenings and weekends get
+    exercise or personal time.
+    """
+    weekday = day.weekday() < 5
+    if weekday and rng.random() < 0.06:
+        return
+    if weekday or rng.random() < 0.08:
+        current = datetime.combine(day, time(profile["start_hour"])) + _minutes(rng, 0, 90)
+        worked = timedelta()
+        target = _minutes(rng, 390, 510) if weekday else _minutes(rng, 60, 180)
+        lunch_done = not weekday
+        while worked < target:
+            if rng.random() < profile["learning"]:
+                category = "Learning"
+            else:
+                category = "Work"
+            length = min(_minutes(rng, 30, 150), target - worked + timedelta(minutes=15))
+            if rng.random() < 0.02:
+                current -= _minutes(rng, 15, 30)
+            yield category, _pick(rng, SYNTHETIC_ACTIVITIES[category]), current, current + length
+            worked += length
+            current += length
+            if not lunch_done and current.hour >= 11:
+                current += _minutes(rng, 30, 60)
+                lunch_done = True
+            elif rng.random() < 0.15:
+                current += _minutes(rng, 15, 45)
+    if rng.random() < profile["exercise"]:
+        start = datetime.combine(day, time(17, 30)) + _minutes(rng, 0, 120)
+        yield "Exercise", _pick(rng, SYNTHETIC_ACTIVITIES["Exercise"]), start, start + _minutes(rng, 30, 90)
+    if rng.random() < 0.1:
+        start = datetime.combine(day, time(10 if not weekday else 16)) + _minutes(rng, 0, 60)
+        yield "Personal", _pick(rng, SYNTHETIC_ACTIVITIES["Personal"]), start, start + _minutes(rng, 15, 60)
+
+def generate_db(users=100, days=365, seed=1, start=date(2023, 1, 2), chunk_size=10000):
+    """
+    Replaces the data of the database with a synthetic dataset: users that
+    log realistic work days for the given number of days from start, and a
+    report for every week. Rows are written with bulk Core inserts, chunk by
+    chunk, and the daily rollup is updated along with each chunk. The same
+    arguments always produce the same rows with the same ids. Returns the
+    number of logs written.
+    """
+    rng = random.Random(seed)
+    db.drop_all()
+    db.create_all()
+
+    db.session.execute(Category.__table__.insert(), [
+        {"name": category, "description": "{} activities".format(category)}
+        for category in SYNTHETIC_ACTIVITIES
+    ])
+    db.session.execute(Activity.__table__.insert(), [
+        {"category_name": category, "name": name, "description": None}
+        for category, activities in SYNTHETIC_ACTIVITIES.items() for name, _ in activities
+    ])
+    usernames = ["user{:05d}".format(number) for number in range(1, users + 1)]
+    # Every synthetic user has the password "password". Hashing it once keeps
+    # generation fast; the shared salt does not matter for made-up accounts
+    password = current_app.extensions["passwords"].hash("password")
+    db.session.execute(User.__table__.insert(), [
+        {"username": username, "password": password} for username in usernames
+    ])
+    # Reports go in chunks of whole users, chunk_size reports or fewer each
+    weeks = (days + 6) // 7
+    users_per_chunk = max(1, chunk_size // max(1, weeks))
+    for first in range(0, len(usernames), users_per_chunk):
+        db.session.execute(TimeReport.__table__.insert(), [
+            {
+                "user_id": username,
+                "start_time": datetime.combine(start + timedelta(weeks=week), time()),
+                "end_time": datetime.combine(start + timedelta(weeks=week + 1), time()),
+            }
+            for username in usernames[first:first + users_per_chunk] for week in range(weeks)
+        ])
+    db.session.commit()
+
+    written = 0
+    rows = []
+    for username in usernames:
+        profile = {
+            "start_hour": rng.choice([7, 8, 8, 8, 9, 9]),
+            "learning": rng.uniform(0.0, 0.15),
+            "exercise": rng.uniform(0.1, 0.6),
+        }
+        for offset in range(days):
+            for category, activity, start_time, end_time in synthetic_day(rng, start + timedelta(days=offset), profile):
+                rows.append({
+                    "user_id": username,
+                    "activity_category": category,
+                    "activity_name": activity,
+                    "start_time": start_time,
+                    "end_time": end_time,
+                    "comments": rng.choice(SYNTHETIC_COMMENTS) if rng.random() < 0.2 else None,
+                })
+            # Checked after every day, so one user's long history never
+            # builds more than a chunk and a day of rows
+            if len(rows) >= chunk_size:
+                written += _write_logs(rows)
+                rows = []
+    written += _write_logs(rows)
+
+    db.session.execute(text("ANALYZE"))
+    db.session.commit()
+    return written
+
+def _write_logs(rows):
+    if not rows:
+        return 0
+    db.session.execute(Log.__table__.insert(), rows)
+    apply_to_daily_totals(db.session.connection(), rows)
+    db.session.commit()
+    return len(rows)
+
+def hash_plaintext_passwords():
+    """
+    Replaces the passwords that older versions stored in plain text with
+    scrypt hashes. Returns the number of users updated.
+    """
+    passwords = current_app.extensions["passwords"]
+    plain = db.session.execute(
+        select(User.username, User.password).where(User.password.not_like("scrypt$%"))
+    ).all()
+    for username, password in plain:
+        db.session.execute(
+            User.__table__.update().where(User.username == username),
+            {"password": passwords.hash(password)},
+        )
+    db.session.commit()
+    return len(plain)
+
+def _index_names():
+    """
+    Names of the indexes in the database, read from sqlite_master: reflection
+    skips expression indexes, so checkfirst would try to create them again.
+    """
+    return set(db.session.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+
+def upgrade_db(cluster_logs=False):
+    """
+    Brings an existing database up to date with the models. Missing tables
+    are created by create_all, but indexes on tables that already exist are
+    not, so they are created here one by one, and neither are new columns.
+    A newly added rollup table, or one made under the old unique key, is
+    filled from the existing logs, and so is a newly added longest_log
+    column of the users. Plain text passwords are hashed.
+    """
+    has_rollup = inspect(db.engine).has_table("daily_total")
+    has_longest_log = "longest_log" in {column["name"] for column in inspect(db.engine).get_columns("user")}
+    if not has_longest_log:
+        db.session.execute(text("ALTER TABLE user ADD COLUMN longest_log FLOAT NOT NULL DEFAULT 0"))
+        db.session.commit()
+    # The old unique key of the rollup let activity-less rows pile up, so
+    # those rollups are emptied here and rebuilt under the new key below
+    stale_rollup = "ix_daily_total_key" in _index_names()
+    if stale_rollup:
+        db.session.execute(text("DROP INDEX ix_daily_total_key"))
+        db.session.execute(text("DELETE FROM daily_total"))
+        db.session.commit()
+    db.create_all()
+    # Read after create_all, which also makes the indexes of the tables it
+    # creates
+    indexes = _index_names()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(bind=db.engine)
+    if cluster_logs:
+        db.session.execute(text("DROP INDEX IF EXISTS ix_log_user_start_cluster"))
+        db.session.execute(text(LOG_CLUSTER_INDEX))
+        db.session.commit()
+    if not has_rollup or stale_rollup or not has_longest_log:
+        rebuild_daily_totals()
+    hash_plaintext_passwords()
+    db.session.execute(text("ANALYZE"))
+    db.session.commit()
+
+def create_admin_key():
+    """
+    Stores a new admin API key and returns it. Only its hash is kept, so
+    the key cannot be shown again later.
+    """
+    key = ApiKey.generate()
+    db.session.add(ApiKey(key=ApiKey.key_hash(key), admin=True))
+    db.session.commit()
+    return key
 
     
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create or upgrade the HourLogger database")
+    parser.add_argument("--database", help="SQLite file to use instead of the database of the API")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("create", help="Create the tables and populate them with sample data (default)")
+    upgrade_parser = subparsers.add_parser("upgrade", help="Add missing tables and indexes to an existing database")
+    upgrade_parser.add_argument(
+        "--cluster-logs", action="store_true",
+        help="Also store logs in a covering index clustered by user and start time"
+    )
+    subparsers.add_parser("rebuild-rollup", help="Recompute the daily rollup of logged time from the logs")
+    overlaps_parser = subparsers.add_parser(
+        "find-overlaps", help="List the logs that overlap an earlier log of the same user"
+    )
+    overlaps_parser.add_argument("--limit", type=int, help="stop after this many overlaps")
+    subparsers.add_parser("create-admin-key", help="Create an API key that can access every resource")
+    generate_parser = subparsers.add_parser(
+        "generate", help="Replace the data with a seeded synthetic dataset of realistic logs"
+    )
+    generate_parser.add_argument("--users", type=int, default=100)
+    generate_parser.add_argument("--days", type=int, default=365)
+    generate_parser.add_argument("--seed", type=int, default=1)
+    generate_parser.add_argument("--start", type=date.fromisoformat, default=date(2023, 1, 2),
+                                 help="first day of the logs (YYYY-MM-DD)")
+    generate_parser.add_argument("--chunk-size", type=int, default=10000, help="logs per bulk insert")
+    args = parser.parse_args()
+
+    config = {}
+    if args.database:
+        config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.abspath(args.database)
+    app = create_app(config)
     with app.app_context():
-        db.create_all()
-        populate_db()
-        
-    print("Database tables created and populated successfully.")
+        if args.command == "upgrade":
+            upgrade_db(cluster_logs=args.cluster_logs)
+            print("Database upgraded successfully.")
+        elif args.command == "find-overlaps":
+            found = 0
+            print("user_id,log_id,overlaps_log_id")
+            for user_id, rid, overlapped in find_overlapping_logs():
+                print("{},{},{}".format(user_id, rid, overlapped))
+                found += 1
+                if found == args.limit:
+                    break
+            print("Found {} overlapping logs.".format(found), file=sys.stderr)
+        elif args.command == "generate":
+            count = generate_db(args.users, args.days, args.seed, args.start, args.chunk_size)
+            print("Generated {} logs for {} users.".format(count, args.users))
+        elif args.command == "create-admin-key":
+            print(create_admin_key())
+        elif args.command == "rebuild-rollup":
+            rebuild_daily_totals()
+            print("Daily rollup rebuilt successfully.")
+        else:
+            db.create_all()
+            populate_db()
+            print("Database tables created and populated successfully.")
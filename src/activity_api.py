@@ -1,11 +1,16 @@
-import json
 from flask import Response, request, url_for
-from flask_restful import Resource, reqparse
+from flask_restful import Resource
 from models import db, Activity, Category
-from utils import HourLoggerBuilder, create_error_response
+from utils import HourLoggerBuilder, create_error_response, create_response
+from caching import cached, invalidate
+from auth import require_admin, require_key
+from rendering import url_template
+from validation import ValidationError, validate
 from constants import *
 
 class ActivityListResource(Resource):
+    @require_key
+    @cached("activities:{category}")
     def get(self, category):
         """Retrieve all activities for a given category."""
         body = HourLoggerBuilder()
@@ -16,17 +21,21 @@ class ActivityListResource(Resource):
         body["items"] = []
         
         activities = Activity.query.filter_by(category_name=category).all()
+        activity_url = url_template("activityresource")
         for activity in activities:
-            item = HourLoggerBuilder()
-            item.add_control("self", url_for("activityresource", name=activity.name, category=category))
-            item.add_control("profile", ACTIVITY_PROFILE)
-            item["name"] = activity.name
-            item["category"] = category
-            item["description"] = activity.description
-            body["items"].append(item)
+            body["items"].append({
+                "@controls": {
+                    "self": {"href": activity_url.build(name=activity.name, category=category)},
+                    "profile": {"href": ACTIVITY_PROFILE},
+                },
+                "name": activity.name,
+                "category": category,
+                "description": activity.description,
+            })
             
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        return create_response(body)
 
+    @require_admin
     def post(self, category):
         """Create a new activity under the specified category."""
         if not request.json:
@@ -35,10 +44,10 @@ class ActivityListResource(Resource):
                 "Requests must be JSON"
             )
         
-        parser = reqparse.RequestParser()
-        parser.add_argument("name", required=True, help="Activity name is required")
-        parser.add_argument("description", required=False)
-        data = parser.parse_args()
+        try:
+            data = validate(Activity, request.json)
+        except ValidationError as exc:
+            return {"message": exc.errors}, 400
 
         # Validate that the category exists (using the category in the URL)
         category_obj = Category.query.filter_by(name=category).first()
@@ -53,6 +62,7 @@ class ActivityListResource(Resource):
         db.session.add(activity)
 
         try:
+            invalidate(f"activities:{category}")
             db.session.commit()
         except Exception as e:
             db.session.rollback()
@@ -64,6 +74,8 @@ class ActivityListResource(Resource):
 
 
 class ActivityResource(Resource):
+    @require_key
+    @cached("activities:{category}", "activity:{category}/{name}")
     def get(self, name, category):
         """Retrieve a single activity."""
         activity = Activity.query.filter_by(name=name, category_name=category).first()
@@ -82,8 +94,9 @@ class ActivityResource(Resource):
         body["category"] = activity.category_name
         body["description"] = activity.description
         
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        return create_response(body)
 
+    @require_admin
     def put(self, name, category):
         """Update an activity."""
         if not request.json:
@@ -96,14 +109,17 @@ class ActivityResource(Resource):
         if not activity:
             return {"error": "Activity not found"}, 404
 
-        parser = reqparse.RequestParser()
-        parser.add_argument("description", required=False)
-        data = parser.parse_args()
+        try:
+            data = validate(Activity, request.json, required=[])
+        except ValidationError as exc:
+            return {"message": exc.errors}, 400
 
-        activity.description = data["description"] or activity.description
+        activity.description = data.get("description") or activity.description
+        invalidate(f"activities:{category}", f"activity:{category}/{name}")
         db.session.commit()
         return {"message": "Activity updated"}, 200
 
+    @require_admin
     def delete(self, name, category):
         """Delete an activity."""
         activity = Activity.query.filter_by(name=name, category_name=category).first()
@@ -111,5 +127,6 @@ class ActivityResource(Resource):
             return {"error": "Activity not found"}, 404
 
         db.session.delete(activity)
+        invalidate(f"activities:{category}", f"activity:{category}/{name}", "log-activities")
         db.session.commit()
         return {"message": "Activity deleted"}, 200
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HOUR = 3600
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+# 1970-01-01 was a Thursday: epoch day d is weekday (d + 3) % 7 and falls in
+# week (d + 3) // 7, counted from Monday 1969-12-29
+EPOCH_WEEKDAY = 3
+EPOCH = datetime(1970, 1, 1)
+# Category of the logs whose activity has been deleted
+UNCATEGORIZED = "uncategorized"
+
+
+def week_start(week):
+    """Returns the date of the Monday that starts the given epoch week."""
+    return (EPOCH + timedelta(days=week * 7 - EPOCH_WEEKDAY)).date()
+
+def week_of(seconds):
+    """Returns the epoch week of a time in epoch seconds."""
+    return (seconds // 86400 + EPOCH_WEEKDAY) // 7
+
+def week_count(lo, hi):
+    """Returns the number of weeks the window [lo, hi) touches."""
+    return week_of(hi - 1) - week_of(lo) + 1 if hi > lo else 0
+
+def _python_time_use(starts, ends, categories, lo, hi):
+    """
+    Reference implementation: walks every interval hour by hour in plain
+    Python. Used when NumPy is not installed, and to check the NumPy one.
+    """
+    names = sorted(set(categories))
+    row = {name: index for index, name in enumerate(names)}
+    first_week = week_of(lo)
+    weeks = week_count(lo, hi)
+    heatmap = [[0] * 24 for _ in WEEKDAYS]
+    trends = [[0] * weeks for _ in names]
+    for start, end, category in zip(starts, ends, categories):
+        start, end = max(start, lo), min(end, hi)
+        while start < end:
+            edge = min(end, (start // HOUR + 1) * HOUR)
+            day = start // 86400
+            heatmap[(day + EPOCH_WEEKDAY) % 7][start // HOUR % 24] += edge - start
+            trends[row[category]][week_of(start) - first_week] += edge - start
+            start = edge
+    return heatmap, names, trends
+
+def _numpy_time_use(starts, ends, categories, lo, hi):
+    """
+    Splits all intervals at the hour edges at once: every interval is
+    repeated once per hour it touches and clipped to that hour, and the
+    pieces are summed into the weekday x hour and category x week matrices
+    with bincount.
+    """
+    starts = np.maximum(np.asarray(starts, dtype=np.int64), lo)
+    ends = np.minimum(np.asarray(ends, dtype=np.int64), hi)
+    names, rows = np.unique(np.asarray(categories, dtype=object), return_inverse=True)
+    keep = ends > starts
+    starts, ends, rows = starts[keep], ends[keep], rows[keep]
+
+    first = starts // HOUR
+    counts = (ends - 1) // HOUR - first + 1
+    owner = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    hours = first[owner] + offsets
+    seconds = np.minimum(ends[owner], (hours + 1) * HOUR) - np.maximum(starts[owner], hours * HOUR)
+
+    days = hours // 24
+    cells = (days + EPOCH_WEEKDAY) % 7 * 24 + hours % 24
+    heatmap = np.bincount(cells, weights=seconds, minlength=7 * 24).reshape(7, 24)
+    first_week = week_of(lo)
+    weeks = week_count(lo, hi)
+    cells = rows[owner] * weeks + (days + EPOCH_WEEKDAY) // 7 - first_week
+    trends = np.bincount(cells, weights=seconds, minlength=len(names) * weeks).reshape(len(names), weeks)
+    return (
+        np.rint(heatmap).astype(np.int64).tolist(),
+        names.tolist(),
+        np.rint(trends).astype(np.int64).tolist(),
+    )
+
+ENGINES = {"python": _python_time_use}
+if np is not None:
+    ENGINES["numpy"] = _numpy_time_use
+
+_time_use = _python_time_use
+
+
+def set_engine(name="auto"):
+    """
+    Selects the implementation of time_use. "auto" picks NumPy when it is
+    installed and falls back to plain Python otherwise. Asking for an engine
+    that is not available raises ValueError.
+    """
+    global _time_use
+    if name == "auto":
+        name = "numpy" if "numpy" in ENGINES else "python"
+    if name not in ENGINES:
+        raise ValueError("Analytics engine {} is not available".format(name))
+    _time_use = ENGINES[name]
+    return name
+
+def time_use(starts, ends, categories, lo, hi):
+    """
+    Sums the time of the intervals [starts[i], ends[i]) in epoch seconds,
+    clipped to the window [lo, hi), by weekday and hour of day and by
+    category and week. Returns the 7 x 24 heatmap, the sorted category
+    names and a dense category x week matrix whose first column is the week
+    of lo, all in seconds. Missing categories count as UNCATEGORIZED.
+    """
+    if None in categories:
+        categories = [UNCATEGORIZED if category is None else category for category in categories]
+    return _time_use(starts, ends, categories, lo, hi)
@@ -0,0 +1,98 @@
+from datetime import timedelta
+from flask import request, url_for
+from flask_restful import Resource
+from sqlalchemy import Integer, cast, func, select
+from models import db, earliest_reaching_start, Log, User
+from utils import HourLoggerBuilder, create_error_response, create_response
+from caching import cached
+from auth import require_user
+from validation import parse_datetime
+from analytics import EPOCH, UNCATEGORIZED, WEEKDAYS, time_use, week_count, week_of, week_start
+from constants import *
+
+
+def _epoch(column):
+    """SQL expression for a timestamp column in whole epoch seconds."""
+    return cast(func.strftime("%s", column), Integer)
+
+def _window(username, args):
+    """
+    Reads the optional from and to bounds of an analytics request. Returns
+    them as datetimes (None when not given) and the SQL criteria selecting
+    the user's logs that overlap the window. Raises ValueError for bad bounds.
+    """
+    try:
+        start = parse_datetime(args["from"]) if args.get("from") else None
+        end = parse_datetime(args["to"]) if args.get("to") else None
+    except ValueError as exc:
+        raise ValueError("from and to must be ISO 8601 timestamps (YYYY-MM-DDTHH:MM:SS)") from exc
+    if start and end and start >= end:
+        raise ValueError("from must be before to")
+    criteria = []
+    if start:
+        criteria.append(Log.start_time >= earliest_reaching_start(username, start))
+        criteria.append(Log.end_time > start)
+    if end:
+        criteria.append(Log.start_time < end)
+    if args.get("category"):
+        criteria.append(Log.activity_category == args["category"])
+    return start, end, criteria
+
+def _seconds(moment):
+    return int((moment - EPOCH).total_seconds())
+
+
+class AnalyticsResource(Resource):
+    @require_user()
+    @cached("logs:{username}", "log-activities")
+    def get(self, username):
+        """
+        Time use of a user as a weekday x hour-of-day heatmap and a category
+        x week trend matrix, both dense and in seconds. The logs are read as
+        three plain columns with one query and bucketed by analytics.time_use.
+        """
+        try:
+            start, end, criteria = _window(username, request.args)
+        except ValueError as exc:
+            return create_error_response(400, "Invalid window", str(exc))
+
+        rows = db.session.execute(
+            select(
+                _epoch(Log.start_time), _epoch(Log.end_time), func.coalesce(Log.activity_category, UNCATEGORIZED)
+            ).where(
+                Log.user_id == username, *criteria
+            )
+        ).all()
+        if not rows and not db.session.get(User, username):
+            return {"error": "User not found"}, 404
+        starts, ends, categories = (list(column) for column in zip(*rows)) if rows else ([], [], [])
+
+        hi = _seconds(end) if end else max(ends, default=_seconds(start) if start else 0)
+        lo = _seconds(start) if start else min(starts, default=hi)
+        heatmap, names, trends = time_use(starts, ends, categories, lo, hi)
+        first_week = week_of(lo)
+        weeks = week_count(lo, hi)
+        totals = [sum(row[week] for row in trends) for week in range(weeks)]
+
+        body = HourLoggerBuilder()
+        body.add_namespace("hlog", LINK_RELATIONS_URL)
+        body.add_control("self", url_for("analyticsresource", username=username))
+        body.add_control("user", url_for("userresource", username=username))
+        body.add_control("hlog:logs", url_for("loglistresource", username=username))
+        body["user_id"] = username
+        body["from"] = (EPOCH + timedelta(seconds=lo)).isoformat()
+        body["to"] = (EPOCH + timedelta(seconds=hi)).isoformat()
+        body["unit"] = "seconds"
+        body["heatmap"] = {
+            "weekdays": list(WEEKDAYS),
+            "hours": list(range(24)),
+            "seconds": heatmap,
+        }
+        body["trends"] = {
+            "weeks": [week_start(first_week + week).isoformat() for week in range(weeks)],
+            "categories": names,
+            "seconds": trends,
+            "total": totals,
+            "change": [0] + [after - before for before, after in zip(totals, totals[1:])],
+        }
+        return create_response(body)
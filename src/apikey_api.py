@@ -0,0 +1,81 @@
+from flask import current_app, request, url_for
+from flask_restful import Resource
+from models import db, ApiKey, User
+from utils import HourLoggerBuilder, create_error_response, create_response
+from auth import authorize, require_user
+from passwords import HasherBusy
+from constants import *
+
+
+class ApiKeyListResource(Resource):
+    @require_user()
+    def get(self, username):
+        """List the API keys of a user. The keys themselves are never shown again."""
+        body = HourLoggerBuilder()
+        body.add_namespace("hlog", LINK_RELATIONS_URL)
+        body.add_control("self", url_for("apikeylistresource", username=username))
+        body.add_control("user", url_for("userresource", username=username))
+        body["items"] = []
+        keys = ApiKey.query.filter_by(user_id=username).order_by(ApiKey.id).all()
+        for key in keys:
+            body["items"].append({
+                "@controls": {
+                    "hlog:revoke-key": {"href": url_for("apikeyresource", kid=key.id), "method": "DELETE"},
+                },
+                "id": key.id,
+                "created": key.created.isoformat(),
+            })
+        return create_response(body)
+
+    def post(self, username):
+        """
+        Create an API key for a user, i.e. log in. The request needs the
+        user's password in the body, or a key of the user or an admin key.
+        The response is the only place the new key is shown.
+        """
+        data = request.get_json(silent=True) or {}
+        user = User.query.filter_by(username=username).first()
+        if "password" in data:
+            passwords = current_app.extensions["passwords"]
+            password = str(data["password"])
+            try:
+                matches, outdated = passwords.verify(password, user.password if user else None)
+                if matches and outdated:
+                    # Logging in is the only time the password is known, so
+                    # hashes made with older cost settings are upgraded here
+                    user.password = passwords.hash(password)
+            except HasherBusy as exc:
+                response = create_error_response(503, "Too many logins", str(exc))
+                response.headers["Retry-After"] = "1"
+                return response
+            if not matches:
+                return {"error": "Invalid username or password"}, 401
+        else:
+            authorize(username)
+            if user is None:
+                return {"error": "User not found"}, 404
+
+        key = ApiKey.generate()
+        api_key = ApiKey(key=ApiKey.key_hash(key), user_id=username)
+        db.session.add(api_key)
+        db.session.flush()
+        body = {"id": api_key.id, "key": key, "user_id": username, "created": api_key.created.isoformat()}
+        db.session.commit()
+        # The new key is known to be valid, so its first use costs no lookup
+        current_app.extensions["api_keys"].put(ApiKey.key_hash(key), username, False)
+        return body, 201, {"Location": url_for("apikeyresource", kid=body["id"])}
+
+
+class ApiKeyResource(Resource):
+    @require_user(ApiKey)
+    def delete(self, kid):
+        """Revoke an API key. It stops working at once in this worker process."""
+        api_key = ApiKey.query.get(kid)
+        if not api_key:
+            return {"error": "API key not found"}, 404
+
+        key_hash = api_key.key
+        db.session.delete(api_key)
+        db.session.commit()
+        current_app.extensions["api_keys"].discard(key_hash)
+        return {"message": "API key revoked"}, 200
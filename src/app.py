@@ -1,47 +1,167 @@
+import time
+_import_started = time.perf_counter()
+
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_restful import Api
 from models import db
+from caching import cache
+from validation import compile_validators
+from encoding import set_encoder
+from analytics import set_engine
+from storage import DEFAULT_SQLITE_PRAGMAS, engine_options, init_storage
+from metrics import init_metrics
+from compression import init_compression
+from jobs import init_jobs
+from auth import init_auth
+from passwords import init_passwords
+from utils import create_response
 from activity_api import ActivityResource, ActivityListResource
 from category_api import CategoryResource, CategoryListResource
 from user_api import UserResource, UserListResource
 from log_api import LogResource, LogListResource
-from report_api import ReportResource, ReportListResource
+from report_api import ReportResource, ReportListResource, ReportJobResource
+from analytics_api import AnalyticsResource
+from apikey_api import ApiKeyResource, ApiKeyListResource
 from constants import *
 
-app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///test.db"
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# Seconds spent importing the app and its dependencies. A prefork server that
+# imports the app before forking (e.g. gunicorn --preload) pays this once.
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+DEFAULT_CONFIG = {
+    "SQLALCHEMY_DATABASE_URI": "sqlite:///test.db",
+    "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+    # Connection pool of each worker process, see storage.engine_options
+    "DB_POOL_SIZE": 5,
+    "DB_MAX_OVERFLOW": 10,
+    "DB_POOL_TIMEOUT": 30,
+    # Response cache of each worker process. Cached bodies are keyed on the
+    # cache scope versions in the database, so with several workers one that
+    # missed a write still never serves a stale body. Any Flask-Caching
+    # backend works here, e.g. "RedisCache" to share the bodies themselves
+    "CACHE_TYPE": "caching.LRUCache",
+    "CACHE_THRESHOLD": 1000,
+    "CACHE_DEFAULT_TIMEOUT": 300,
+    # Bulk log uploads: most logs accepted in one request, and whether an invalid
+    # log rejects the whole batch ("atomic") or only itself ("partial")
+    "LOG_BATCH_LIMIT": 1000,
+    "LOG_BATCH_MODE": "atomic",
+    # Logs overlapping the user's other logs are created ("allow"), created and
+    # reported back ("flag") or refused with 409 ("reject")
+    "LOG_OVERLAP_MODE": "allow",
+    # JSON encoder for response bodies: "auto" uses orjson if it is installed
+    "JSON_ENCODER": "auto",
+    # Requests need an API key in the Hourlogger-Api-Key header, see auth.py.
+    # Verified keys are cached for API_KEY_CACHE_TTL seconds, which is also
+    # how long a key revoked in another worker process keeps working
+    "API_KEYS_REQUIRED": True,
+    "API_KEY_CACHE_SIZE": 1024,
+    "API_KEY_CACHE_TTL": 60,
+    # scrypt cost of new password hashes. Hashes made with other settings are
+    # upgraded when their user logs in. Hashing runs on PASSWORD_HASH_WORKERS
+    # threads with at most PASSWORD_HASH_LIMIT hashes pending
+    "PASSWORD_SCRYPT_N": 2 ** 14,
+    "PASSWORD_SCRYPT_R": 8,
+    "PASSWORD_SCRYPT_P": 1,
+    "PASSWORD_HASH_WORKERS": 2,
+    "PASSWORD_HASH_LIMIT": 32,
+    # Heatmap and trend computation: "auto" uses NumPy if it is installed
+    "ANALYTICS_ENGINE": "auto",
+    # PRAGMAs applied to every SQLite connection, see storage.py
+    "SQLITE_PRAGMAS": DEFAULT_SQLITE_PRAGMAS,
+    # Reports requested with Prefer: respond-async are computed on a pool of
+    # REPORT_JOB_WORKERS threads; at most REPORT_JOB_LIMIT jobs may be pending
+    # and the last REPORT_JOB_HISTORY finished ones can still be polled
+    "REPORT_JOB_WORKERS": 2,
+    "REPORT_JOB_LIMIT": 100,
+    "REPORT_JOB_HISTORY": 1000,
+    # Per-route latency, SQL and response size metrics served at /metrics
+    "METRICS_ENABLED": True,
+    # Text bodies of COMPRESS_MIN_SIZE bytes or more are gzip or deflate
+    # compressed at COMPRESS_LEVEL (1-9) when Accept-Encoding allows it
+    "COMPRESS_ENABLED": True,
+    "COMPRESS_LEVEL": 6,
+    "COMPRESS_MIN_SIZE": 1024,
+}
+
+
+def create_app(config=None):
+    """
+    Creates the API app. config overrides the keys of DEFAULT_CONFIG and any
+    other Flask or extension setting. The database engine is created here
+    but connects lazily, in the process that serves the requests. The time
+    taken is kept in app.extensions["startup_timings"] with IMPORT_SECONDS.
+    """
+    started = time.perf_counter()
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
+    app.config["SQLITE_PRAGMAS"] = dict(app.config["SQLITE_PRAGMAS"])
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
+
+    db.init_app(app)
+    init_storage(app, db)
+    init_metrics(app, db)
+    init_compression(app)
+    cache.init_app(app)
+    init_jobs(app)
+    init_auth(app)
+    init_passwords(app)
+
+    @app.route(LINK_RELATIONS_URL)
+    def send_link_relations():
+        return "link relations"
+
+    @app.route("/profiles/<profile>/")
+    def send_profile(profile):
+        return "you requested {} profile".format(profile)
+
+    api = Api(app)
+
+    @api.representation("application/json")
+    def output_json(data, code, headers=None):
+        """Encode the plain dict responses of the resources like every other body."""
+        return create_response(data, code, mimetype="application/json", headers=headers)
+
+    # Registering API resources
+    api.add_resource(CategoryListResource, "/categories/")
+    api.add_resource(CategoryResource, "/categories/<string:name>")
 
-db.init_app(app)
+    api.add_resource(ActivityListResource, "/categories/<string:category>/activities/")
+    api.add_resource(ActivityResource, "/categories/<string:category>/activities/<string:name>")
 
-@app.route(LINK_RELATIONS_URL)
-def send_link_relations():
-    return "link relations"
+    api.add_resource(UserListResource, "/users/")
+    api.add_resource(UserResource, "/users/<string:username>")
 
-@app.route("/profiles/<profile>/")
-def send_profile(profile):
-    return "you requested {} profile".format(profile)
+    api.add_resource(LogListResource, "/users/<string:username>/logs/")
+    api.add_resource(LogResource, "/logs/<int:rid>")
 
-api = Api(app)
+    api.add_resource(ReportListResource, "/users/<string:username>/reports/")
+    api.add_resource(ReportResource, "/reports/<int:rid>")
+    api.add_resource(ReportJobResource, "/jobs/<string:job_id>")
 
-# Registering API resources
-api.add_resource(CategoryListResource, "/categories/")
-api.add_resource(CategoryResource, "/categories/<string:name>")
+    api.add_resource(AnalyticsResource, "/users/<string:username>/analytics/")
 
-api.add_resource(ActivityListResource, "/categories/<string:category>/activities/")
-api.add_resource(ActivityResource, "/categories/<string:category>/activities/<string:name>")
+    api.add_resource(ApiKeyListResource, "/users/<string:username>/keys/")
+    api.add_resource(ApiKeyResource, "/keys/<int:kid>")
 
-api.add_resource(UserListResource, "/users/")
-api.add_resource(UserResource, "/users/<string:username>")
+    compile_validators()
+    set_encoder(app.config["JSON_ENCODER"])
+    set_engine(app.config["ANALYTICS_ENGINE"])
 
-api.add_resource(LogListResource, "/users/<string:username>/logs/")
-api.add_resource(LogResource, "/logs/<int:rid>")
+    app.extensions["startup_timings"] = timings = {
+        "import_seconds": IMPORT_SECONDS,
+        "startup_seconds": time.perf_counter() - started,
+    }
+    app.logger.info(
+        "App started in %.1f ms (imports %.1f ms)",
+        timings["startup_seconds"] * 1e3, timings["import_seconds"] * 1e3,
+    )
+    return app
 
-api.add_resource(ReportListResource, "/users/<string:username>/reports/")
-api.add_resource(ReportResource, "/reports/<int:rid>")
 
 if __name__ == "__main__":
+    app = create_app()
     with app.app_context():
         db.create_all()
     app.run(debug=True)
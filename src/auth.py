@@ -0,0 +1,148 @@
+import secrets
+import threading
+from collections import OrderedDict
+from functools import wraps
+from time import monotonic
+
+from flask import current_app, request
+from sqlalchemy import select
+from werkzeug.exceptions import Forbidden, Unauthorized
+
+from models import db, ApiKey
+from constants import *
+
+
+class KeyCache:
+    """
+    Bounded cache of recently verified API keys by key hash, holding the
+    user and admin flag of each key. An entry expires ttl seconds after the
+    key was verified, which bounds how long a key revoked by another worker
+    process keeps working in this one; keys revoked in this process are
+    discarded straight away.
+    """
+
+    def __init__(self, size=1024, ttl=60):
+        self.size = size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key_hash):
+        with self._lock:
+            entry = self._items.get(key_hash)
+            if entry is None:
+                return None
+            expires, identity = entry
+            if expires <= monotonic():
+                del self._items[key_hash]
+                return None
+            self._items.move_to_end(key_hash)
+            return identity
+
+    def put(self, key_hash, user_id, admin):
+        with self._lock:
+            self._items[key_hash] = (monotonic() + self.ttl, (user_id, admin))
+            self._items.move_to_end(key_hash)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def discard(self, *key_hashes):
+        with self._lock:
+            for key_hash in key_hashes:
+                self._items.pop(key_hash, None)
+
+    def discard_user(self, user_id):
+        """Drops every cached key of a user, e.g. when the user is deleted."""
+        with self._lock:
+            for key_hash, (expires, identity) in list(self._items.items()):
+                if identity[0] == user_id:
+                    del self._items[key_hash]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+def init_auth(app):
+    """
+    Sets up the verified key cache of the app in app.extensions["api_keys"],
+    sized by API_KEY_CACHE_SIZE and API_KEY_CACHE_TTL.
+    """
+    app.extensions["api_keys"] = KeyCache(app.config["API_KEY_CACHE_SIZE"], app.config["API_KEY_CACHE_TTL"])
+
+def authenticate():
+    """
+    Verifies the API key of the current request and returns its (user_id,
+    admin) pair. A key found in the verified key cache costs no query.
+    Raises Unauthorized when the request has no key and Forbidden when the
+    key is unknown.
+    """
+    key = request.headers.get(API_KEY_HEADER, "").strip()
+    if not key:
+        raise Unauthorized("Requests need an API key in the {} header".format(API_KEY_HEADER))
+    key_hash = ApiKey.key_hash(key)
+    keys = current_app.extensions["api_keys"]
+    identity = keys.get(key_hash)
+    if identity is None:
+        row = db.session.execute(
+            select(ApiKey.key, ApiKey.user_id, ApiKey.admin).where(ApiKey.key == key_hash)
+        ).first()
+        if row is None or not secrets.compare_digest(row.key, key_hash):
+            raise Forbidden("Invalid API key")
+        identity = (row.user_id, row.admin)
+        keys.put(key_hash, *identity)
+    return identity
+
+def authorize(user_id):
+    """
+    Checks that the request carries the key of the given user or an admin
+    key. Does nothing when API_KEYS_REQUIRED is off.
+    """
+    if not current_app.config["API_KEYS_REQUIRED"]:
+        return
+    key_user, admin = authenticate()
+    if not admin and key_user != user_id:
+        raise Forbidden("The API key does not grant access to this user")
+
+def require_key(func):
+    """Resource method decorator: any valid API key is accepted."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if current_app.config["API_KEYS_REQUIRED"]:
+            authenticate()
+        return func(*args, **kwargs)
+    return wrapper
+
+def require_admin(func):
+    """Resource method decorator: only admin keys are accepted."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if current_app.config["API_KEYS_REQUIRED"] and not authenticate()[1]:
+            raise Forbidden("An admin API key is required")
+        return func(*args, **kwargs)
+    return wrapper
+
+def require_user(model=None):
+    """
+    Resource method decorator for resources that belong to a user: the key
+    of that user or an admin key is accepted. The user is the username view
+    argument, or the user_id of the model instance the view argument is the
+    primary key of. When that instance does not exist any valid key gets
+    through, and the method answers with its usual 404. Loading the
+    instance with Session.get lets the method get it again without a query.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, **kwargs):
+            if current_app.config["API_KEYS_REQUIRED"]:
+                if model is None:
+                    authorize(kwargs["username"])
+                else:
+                    instance = db.session.get(model, next(iter(kwargs.values())))
+                    if instance is None:
+                        authenticate()
+                    else:
+                        authorize(instance.user_id)
+            return func(self, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,65 @@
+"""
+Benchmark of the analytics heatmap and trend computation: every available
+engine buckets the same synthetic multi-year log history, and its result
+is checked against the pure-Python reference.
+
+Run from the src/ directory:
+    python benchmarks/bench_analytics.py [--logs 20000] [--years 5] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from analytics import ENGINES, _python_time_use
+
+START = 1_577_836_800  # 2020-01-01
+
+
+def make_intervals(count, years, seed=1):
+    rng = random.Random(seed)
+    span = int(years * 365 * 86400)
+    starts = sorted(START + rng.randrange(span) for _ in range(count))
+    ends = [start + rng.randrange(60, 24 * 3600) for start in starts]
+    categories = [rng.choice(("Work", "Exercise", "Study", "Chores")) for _ in range(count)]
+    return starts, ends, categories
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - began)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--logs", type=int, default=20000)
+    parser.add_argument("--years", type=float, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    starts, ends, categories = make_intervals(args.logs, args.years)
+    lo, hi = starts[0], ends[-1]
+    expected = _python_time_use(starts, ends, categories, lo, hi)
+
+    print("logs: {}  years: {}  weeks: {}".format(args.logs, args.years, len(expected[2][0])))
+    mismatches = []
+    for name, engine in sorted(ENGINES.items()):
+        took = best_of(lambda: engine(starts, ends, categories, lo, hi), args.repeat)
+        matches = engine(starts, ends, categories, lo, hi) == expected
+        if not matches:
+            mismatches.append(name)
+        print("  {:8} {:9.3f} ms  {:7.2f} us/log  {}".format(
+            name, took * 1e3, took / args.logs * 1e6, "matches" if matches else "MISMATCH"
+        ))
+    if "numpy" not in ENGINES:
+        print("  numpy is not installed")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
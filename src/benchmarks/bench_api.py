@@ -0,0 +1,476 @@
+"""
+End-to-end benchmark of every route of the API. Seeds a database of the
+given size, then measures latency percentiles and throughput of each route
+through the Flask test client and through a real threaded server. Results
+are written as JSON, and a previous result file can be given as a baseline
+to fail the run when a route got slower than the threshold allows. Cached
+GET routes are measured twice: as they are, where most requests are served
+from the response cache, and as "(cold)" with the cache cleared before
+every request.
+
+Run from the src/ directory:
+    python benchmarks/bench_api.py [--users 20] [--logs 500] [--requests 200]
+        [--mode both] [--output results.json] [--baseline old.json --threshold 0.25]
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from werkzeug.serving import WSGIRequestHandler, make_server
+from app import create_app
+from constants import *
+from caching import cache
+from models import db, ApiKey, User, Category, Activity, Log, TimeReport, rebuild_daily_totals
+
+SEED_START = datetime(2024, 1, 1, 8, 0)
+# Gates compare these statistics of each route against the baseline
+GATED_STATS = ("p50_ms", "p95_ms")
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """ Keeps the access log of the benchmark server out of the results """
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class Scenario:
+    """
+    One route and method to benchmark. request(i, ids) returns the path and
+    JSON body of the i-th request; prepare(app, count), when given, creates
+    the rows the requests consume (e.g. logs to delete) before timing starts.
+    headers are sent along with the API key, statuses in expect are not
+    counted as errors and cold clears the response cache before each request.
+    """
+
+    def __init__(self, name, method, request, prepare=None, headers=None, expect=(), cold=False):
+        self.name = name
+        self.method = method
+        self.request = request
+        self.prepare = prepare
+        self.headers = headers or {}
+        self.expect = expect
+        self.cold = cold
+
+    def failed(self, status):
+        return status >= 400 and status not in self.expect
+
+
+def cold(scenario):
+    """ The same requests as scenario, each one against an empty response cache """
+    return Scenario(scenario.name + " (cold)", scenario.method, scenario.request, scenario.prepare,
+                    scenario.headers, scenario.expect, cold=True)
+
+
+# Every request is sent with this admin key, which seed stores, so the
+# measurements include the API key check
+ADMIN_KEY = "hl_benchmark-admin-key"
+
+def seed(app, args):
+    """
+    Fills the database with bulk Core inserts: users, categories with their
+    activities, back-to-back logs for every user and weekly reports.
+    """
+    rng = random.Random(args.seed)
+    activities = [
+        ("category{}".format(c), "activity{}".format(a))
+        for c in range(args.categories) for a in range(args.activities)
+    ]
+    with app.app_context():
+        db.create_all()
+        db.session.execute(User.__table__.insert(), [
+            {"username": "user{}".format(u), "password": "1234"} for u in range(args.users)
+        ])
+        db.session.execute(ApiKey.__table__.insert(), [{"key": ApiKey.key_hash(ADMIN_KEY), "admin": True}])
+        db.session.execute(Category.__table__.insert(), [
+            {"name": "category{}".format(c), "description": "Benchmark category"}
+            for c in range(args.categories)
+        ])
+        db.session.execute(Activity.__table__.insert(), [
+            {"category_name": category, "name": name, "description": "Benchmark activity"}
+            for category, name in activities
+        ])
+        for u in range(args.users):
+            start = SEED_START
+            rows = []
+            for _ in range(args.logs):
+                category, name = rng.choice(activities)
+                length = timedelta(minutes=rng.randrange(30, 180, 15))
+                rows.append({
+                    "user_id": "user{}".format(u),
+                    "activity_category": category,
+                    "activity_name": name,
+                    "start_time": start,
+                    "end_time": start + length,
+                    "comments": "Benchmark log",
+                })
+                start += length + timedelta(minutes=rng.randrange(0, 120, 15))
+            db.session.execute(Log.__table__.insert(), rows)
+            db.session.execute(TimeReport.__table__.insert(), [{
+                "user_id": "user{}".format(u),
+                "start_time": SEED_START + timedelta(weeks=w),
+                "end_time": SEED_START + timedelta(weeks=w + 1),
+            } for w in range(args.reports)])
+        db.session.commit()
+        rebuild_daily_totals()
+
+def _insert_rows(table, rows, key="rid"):
+    result = db.session.execute(table.insert().returning(table.c[key], sort_by_parameter_order=True), rows)
+    ids = [rid for rid, in result]
+    db.session.commit()
+    return ids
+
+def prepare_logs(app, count):
+    with app.app_context():
+        return _insert_rows(Log.__table__, [{
+            "user_id": "user0",
+            "activity_category": "category0",
+            "activity_name": "activity0",
+            "start_time": datetime(2040, 1, 1) + timedelta(hours=i),
+            "end_time": datetime(2040, 1, 1) + timedelta(hours=i, minutes=30),
+        } for i in range(count)])
+
+def prepare_reports(app, count):
+    with app.app_context():
+        return _insert_rows(TimeReport.__table__, [{
+            "user_id": "user0",
+            "start_time": datetime(2040, 1, 1) + timedelta(days=i),
+            "end_time": datetime(2040, 1, 2) + timedelta(days=i),
+        } for i in range(count)])
+
+def prepare_users(app, count, tag):
+    with app.app_context():
+        names = ["{}-gone{}".format(tag, i) for i in range(count)]
+        db.session.execute(User.__table__.insert(), [{"username": name, "password": "1234"} for name in names])
+        db.session.commit()
+        return names
+
+def prepare_categories(app, count, tag):
+    with app.app_context():
+        names = ["{}-gone{}".format(tag, i) for i in range(count)]
+        db.session.execute(Category.__table__.insert(), [{"name": name} for name in names])
+        db.session.commit()
+        return names
+
+def prepare_activities(app, count, tag):
+    with app.app_context():
+        names = ["{}-gone{}".format(tag, i) for i in range(count)]
+        db.session.execute(Activity.__table__.insert(), [
+            {"category_name": "category0", "name": name} for name in names
+        ])
+        db.session.commit()
+        return names
+
+def prepare_keys(app, count, tag):
+    with app.app_context():
+        return _insert_rows(ApiKey.__table__, [{
+            "key": ApiKey.key_hash("hl_{}-gone{}".format(tag, i)),
+            "user_id": "user0",
+            "admin": False,
+            "created": datetime.now(),
+        } for i in range(count)], key="id")
+
+def prepare_jobs(app, count, tag):
+    """ Submits count background report jobs, one per day of a year of its own """
+    client = app.test_client()
+    year = 2050 if tag == "client" else 2060
+    ids = []
+    for i in range(count):
+        start = datetime(year, 1, 1) + timedelta(days=i)
+        response = client.post("/users/user0/reports/?async=true", headers={API_KEY_HEADER: ADMIN_KEY}, json={
+            "start_time": start.isoformat(), "end_time": (start + timedelta(days=1)).isoformat()
+        })
+        ids.append(response.json["id"])
+    return ids
+
+def clear_cache(app):
+    with app.app_context():
+        cache.clear()
+
+def scenarios(args, tag):
+    """
+    The requests of every route in app.py. tag keeps the rows created by
+    one mode apart from those of the other.
+    """
+    users = args.users
+    categories = args.categories
+    logs = args.users * args.logs
+    reports = args.users * args.reports
+
+    def user(i):
+        return "user{}".format(i % users)
+
+    def category(i):
+        return "category{}".format(i % categories)
+
+    def activity(i):
+        return "activity{}".format(i % args.activities)
+
+    def new_log(i):
+        start = datetime(2035, 1, 1) + timedelta(hours=i)
+        return {
+            "activity_category": category(i),
+            "activity_name": activity(i),
+            "start_time": start.isoformat(),
+            "end_time": (start + timedelta(minutes=45)).isoformat(),
+        }
+
+    def new_job(i):
+        start = datetime(2036 if tag == "client" else 2037, 1, 1) + timedelta(days=i)
+        return {"start_time": start.isoformat(), "end_time": (start + timedelta(days=1)).isoformat()}
+
+    cached_gets = [
+        Scenario("GET /categories/", "GET", lambda i, ids: ("/categories/", None)),
+        Scenario("GET /categories/<name>", "GET", lambda i, ids: ("/categories/" + category(i), None)),
+        Scenario("GET /categories/<category>/activities/", "GET",
+                 lambda i, ids: ("/categories/{}/activities/".format(category(i)), None)),
+        Scenario("GET /categories/<category>/activities/<name>", "GET",
+                 lambda i, ids: ("/categories/{}/activities/{}".format(category(i), activity(i)), None)),
+        Scenario("GET /users/", "GET", lambda i, ids: ("/users/", None)),
+        Scenario("GET /users/<username>", "GET", lambda i, ids: ("/users/" + user(i), None)),
+        Scenario("GET /users/<username>/logs/", "GET",
+                 lambda i, ids: ("/users/{}/logs/".format(user(i)), None)),
+        Scenario("GET /users/<username>/logs/ compact", "GET",
+                 lambda i, ids: ("/users/{}/logs/?view=compact".format(user(i)), None)),
+        Scenario("GET /logs/<rid>", "GET", lambda i, ids: ("/logs/{}".format(i % logs + 1), None)),
+        Scenario("GET /users/<username>/reports/", "GET",
+                 lambda i, ids: ("/users/{}/reports/".format(user(i)), None)),
+        Scenario("GET /reports/<rid>", "GET", lambda i, ids: ("/reports/{}".format(i % reports + 1), None)),
+        Scenario("GET /users/<username>/analytics/", "GET",
+                 lambda i, ids: ("/users/{}/analytics/".format(user(i)), None)),
+    ]
+
+    return [
+        Scenario("GET " + LINK_RELATIONS_URL, "GET", lambda i, ids: (LINK_RELATIONS_URL, None)),
+        Scenario("GET /profiles/<profile>/", "GET", lambda i, ids: ("/profiles/log/", None)),
+        Scenario("GET /metrics", "GET", lambda i, ids: ("/metrics", None)),
+        *cached_gets,
+        *[cold(scenario) for scenario in cached_gets],
+        # Streamed exports are never cached
+        Scenario("GET /users/<username>/logs/ ndjson", "GET",
+                 lambda i, ids: ("/users/{}/logs/".format(user(i)), None), headers={"Accept": NDJSON}),
+        Scenario("GET /users/<username>/logs/ csv", "GET",
+                 lambda i, ids: ("/users/{}/logs/".format(user(i)), None), headers={"Accept": CSV}),
+        Scenario("GET /users/<username>/keys/", "GET",
+                 lambda i, ids: ("/users/{}/keys/".format(user(i)), None)),
+        Scenario("POST /categories/", "POST",
+                 lambda i, ids: ("/categories/", {"name": "{}-category{}".format(tag, i)})),
+        Scenario("PUT /categories/<name>", "PUT",
+                 lambda i, ids: ("/categories/" + category(i), {"description": "Edited {}".format(i)})),
+        Scenario("POST /categories/<category>/activities/", "POST",
+                 lambda i, ids: ("/categories/{}/activities/".format(category(i)), {"name": "{}-activity{}".format(tag, i)})),
+        Scenario("PUT /categories/<category>/activities/<name>", "PUT",
+                 lambda i, ids: ("/categories/{}/activities/{}".format(category(i), activity(i)), {"description": "Edited {}".format(i)})),
+        Scenario("POST /users/", "POST",
+                 lambda i, ids: ("/users/", {"username": "{}-user{}".format(tag, i), "password": "1234"})),
+        Scenario("PUT /users/<username>", "PUT",
+                 lambda i, ids: ("/users/" + user(i), {"password": "abcd"})),
+        Scenario("POST /users/<username>/keys/", "POST",
+                 lambda i, ids: ("/users/{}/keys/".format(user(i)), {})),
+        # Logging in checks the password that PUT /users/<username> set
+        Scenario("POST /users/<username>/keys/ password", "POST",
+                 lambda i, ids: ("/users/{}/keys/".format(user(i)), {"password": "abcd"})),
+        Scenario("POST /users/<username>/logs/", "POST",
+                 lambda i, ids: ("/users/{}/logs/".format(user(i)), new_log(i))),
+        Scenario("POST /users/<username>/reports/", "POST",
+                 lambda i, ids: ("/users/{}/reports/".format(user(i)), {
+                     "start_time": "2024-01-01T00:00:00", "end_time": "2024-02-01T00:00:00"
+                 })),
+        Scenario("POST /users/<username>/reports/ async", "POST",
+                 lambda i, ids: ("/users/{}/reports/".format(user(i)), new_job(i)),
+                 headers={"Prefer": "respond-async"}),
+        Scenario("GET /jobs/<job_id>", "GET",
+                 lambda i, ids: ("/jobs/" + ids[i], None), lambda app, count: prepare_jobs(app, count, tag)),
+        # Most jobs have finished by the time they are cancelled, which is a 409
+        Scenario("DELETE /jobs/<job_id>", "DELETE",
+                 lambda i, ids: ("/jobs/" + ids[i], None), lambda app, count: prepare_jobs(app, count, tag + "-cancel"),
+                 expect=(409,)),
+        Scenario("DELETE /logs/<rid>", "DELETE",
+                 lambda i, ids: ("/logs/{}".format(ids[i]), None), prepare_logs),
+        Scenario("DELETE /reports/<rid>", "DELETE",
+                 lambda i, ids: ("/reports/{}".format(ids[i]), None), prepare_reports),
+        Scenario("DELETE /keys/<kid>", "DELETE",
+                 lambda i, ids: ("/keys/{}".format(ids[i]), None), lambda app, count: prepare_keys(app, count, tag)),
+        Scenario("DELETE /categories/<category>/activities/<name>", "DELETE",
+                 lambda i, ids: ("/categories/category0/activities/" + ids[i], None),
+                 lambda app, count: prepare_activities(app, count, tag)),
+        Scenario("DELETE /categories/<name>", "DELETE",
+                 lambda i, ids: ("/categories/" + ids[i], None), lambda app, count: prepare_categories(app, count, tag)),
+        Scenario("DELETE /users/<username>", "DELETE",
+                 lambda i, ids: ("/users/" + ids[i], None), lambda app, count: prepare_users(app, count, tag)),
+    ]
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def summarize(latencies, elapsed, errors):
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "mean_ms": sum(ordered) / len(ordered) * 1e3,
+        "p50_ms": percentile(ordered, 0.50) * 1e3,
+        "p95_ms": percentile(ordered, 0.95) * 1e3,
+        "p99_ms": percentile(ordered, 0.99) * 1e3,
+        "max_ms": ordered[-1] * 1e3,
+        "throughput_rps": len(ordered) / elapsed,
+    }
+
+def run_client(app, scenario, count, ids):
+    client = app.test_client()
+    headers = dict(scenario.headers, **{API_KEY_HEADER: ADMIN_KEY})
+    latencies = []
+    errors = 0
+    began = time.perf_counter()
+    for i in range(count):
+        path, body = scenario.request(i, ids)
+        if scenario.cold:
+            clear_cache(app)
+        started = time.perf_counter()
+        response = client.open(path, method=scenario.method, json=body, headers=headers)
+        latencies.append(time.perf_counter() - started)
+        errors += scenario.failed(response.status_code)
+        response.close()
+    return summarize(latencies, time.perf_counter() - began, errors)
+
+def run_server(app, address, scenario, count, ids, concurrency):
+    def send(i):
+        path, body = scenario.request(i, ids)
+        headers = dict(scenario.headers, **{API_KEY_HEADER: ADMIN_KEY})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        connection = http.client.HTTPConnection(*address)
+        if scenario.cold:
+            clear_cache(app)
+        started = time.perf_counter()
+        connection.request(scenario.method, path, body=payload, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        took = time.perf_counter() - started
+        connection.close()
+        return took, scenario.failed(response.status)
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(send, range(count)))
+    elapsed = time.perf_counter() - began
+    return summarize([took for took, _ in outcomes], elapsed, sum(failed for _, failed in outcomes))
+
+def run_mode(app, args, mode):
+    results = {}
+    server = None
+    if mode == "server":
+        server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        for scenario in scenarios(args, mode):
+            ids = scenario.prepare(app, args.requests) if scenario.prepare else None
+            if mode == "server":
+                address = ("127.0.0.1", server.server_port)
+                results[scenario.name] = run_server(app, address, scenario, args.requests, ids, args.concurrency)
+            else:
+                results[scenario.name] = run_client(app, scenario, args.requests, ids)
+            print("{:7} {:56} p50 {:7.2f} ms  p95 {:7.2f} ms  {:8.1f} req/s{}".format(
+                mode, scenario.name, results[scenario.name]["p50_ms"], results[scenario.name]["p95_ms"],
+                results[scenario.name]["throughput_rps"],
+                "  ({} errors)".format(results[scenario.name]["errors"]) if results[scenario.name]["errors"] else ""
+            ))
+    finally:
+        if server is not None:
+            server.shutdown()
+    return results
+
+def regressions(results, baseline, threshold):
+    """
+    Lists the gated statistics that are more than threshold (a fraction)
+    above the same statistic of the baseline run.
+    """
+    found = []
+    for mode, routes in results["results"].items():
+        for route, stats in routes.items():
+            before = baseline.get("results", {}).get(mode, {}).get(route)
+            if not before:
+                continue
+            for stat in GATED_STATS:
+                if stats[stat] > before[stat] * (1 + threshold):
+                    found.append("{} {} {}: {:.2f} ms -> {:.2f} ms".format(
+                        mode, route, stat, before[stat], stats[stat]
+                    ))
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--categories", type=int, default=5)
+    parser.add_argument("--activities", type=int, default=5, help="activities per category")
+    parser.add_argument("--logs", type=int, default=500, help="logs per user")
+    parser.add_argument("--reports", type=int, default=20, help="weekly reports per user")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=4, help="client threads against the server")
+    parser.add_argument("--mode", choices=("client", "server", "both"), default="both")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown against the baseline, as a fraction")
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        # Every job of the async report route may still be pending at once
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + path,
+            "REPORT_JOB_LIMIT": max(args.requests * 2, 100),
+        })
+        seed(app, args)
+        modes = ("client", "server") if args.mode == "both" else (args.mode,)
+        results = {
+            "meta": {
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "sizes": {
+                    "users": args.users, "categories": args.categories,
+                    "activities": args.activities, "logs": args.logs, "reports": args.reports,
+                },
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+            },
+            "results": {mode: run_mode(app, args, mode) for mode in modes},
+        }
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(results, handle, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        found = regressions(results, baseline, args.threshold)
+        if found:
+            print("Slower than the baseline by more than {:.0%}:".format(args.threshold))
+            for line in found:
+                print("  " + line)
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark of request latency during a burst of signups. A threaded server
+takes concurrent POST /users/ requests, each of which hashes a password
+with scrypt, while a probe thread keeps timing GET /categories/. Every
+size of the password hashing pool given is measured on a fresh database.
+
+Run from the src/ directory:
+    python benchmarks/bench_passwords.py [--signups 200] [--concurrency 16] [--workers 1,2,8]
+"""
+import argparse
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from werkzeug.serving import make_server
+from app import create_app
+from models import db, Category
+
+sys.path.insert(0, os.path.dirname(__file__))
+from bench_api import QuietRequestHandler, summarize
+
+
+def request(address, method, path, body=None):
+    connection = http.client.HTTPConnection(*address)
+    started = time.perf_counter()
+    connection.request(method, path, body=json.dumps(body) if body else None,
+                       headers={"Content-Type": "application/json"} if body else {})
+    response = connection.getresponse()
+    response.read()
+    took = time.perf_counter() - started
+    connection.close()
+    return took, response.status
+
+def probe(address, stop):
+    latencies = []
+    while not stop.is_set():
+        took, _ = request(address, "GET", "/categories/")
+        latencies.append(took)
+        time.sleep(0.005)
+    return latencies
+
+def probe_for(address, seconds):
+    stop = threading.Event()
+    threading.Timer(seconds, stop.set).start()
+    return probe(address, stop)
+
+def run(args, workers):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + path,
+            # Only the cost of hashing is of interest here
+            "API_KEYS_REQUIRED": False,
+            "PASSWORD_HASH_WORKERS": workers,
+            "PASSWORD_HASH_LIMIT": args.limit,
+        })
+        with app.app_context():
+            db.create_all()
+            db.session.add(Category(name="Work", description="Benchmark category"))
+            db.session.commit()
+        server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        address = ("127.0.0.1", server.server_port)
+        try:
+            idle = probe_for(address, 0.5)
+            stop = threading.Event()
+            with ThreadPoolExecutor(max_workers=1) as prober:
+                probing = prober.submit(probe, address, stop)
+                began = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                    outcomes = list(pool.map(lambda i: request(
+                        address, "POST", "/users/", {"username": "user{}".format(i), "password": "bench-password"}
+                    ), range(args.signups)))
+                elapsed = time.perf_counter() - began
+                stop.set()
+                busy = probing.result()
+        finally:
+            server.shutdown()
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    signups = summarize([took for took, _ in outcomes], elapsed, sum(status >= 400 for _, status in outcomes))
+    signups["rejected"] = sum(status == 503 for _, status in outcomes)
+    return signups, summarize(idle, 0.5, 0), summarize(busy, elapsed, 0)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--signups", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads sending signups")
+    parser.add_argument("--workers", default="1,2,8", help="comma separated hashing pool sizes to compare")
+    parser.add_argument("--limit", type=int, default=32, help="most hashes pending before 503")
+    args = parser.parse_args()
+
+    print("signups: {}  concurrency: {}  pending limit: {}".format(args.signups, args.concurrency, args.limit))
+    for workers in (int(value) for value in args.workers.split(",")):
+        signups, idle, busy = run(args, workers)
+        print("workers {:3}  signup p50 {:7.1f} ms  p95 {:7.1f} ms  {:6.1f}/s  503s {:4}  "
+              "GET p50 {:6.2f} ms -> {:6.2f} ms  p95 {:6.2f} ms -> {:6.2f} ms".format(
+                  workers, signups["p50_ms"], signups["p95_ms"], signups["throughput_rps"], signups["rejected"],
+                  idle["p50_ms"], busy["p50_ms"], idle["p95_ms"], busy["p95_ms"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark of rendering a log list of 10k items, comparing the previous
+url_for / HourLoggerBuilder rendering against the precomputed templates of
+render_log_items. Both must produce identical JSON.
+
+Run from the src/ directory:
+    python benchmarks/bench_rendering.py [--items 10000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from flask import url_for
+from app import create_app
+from constants import *
+from log_api import render_log_items
+from utils import HourLoggerBuilder
+
+
+def legacy_log_items(logs, username):
+    """ The item loop of LogListResource.get before the rendering layer """
+    items = []
+    for log in logs:
+        item = HourLoggerBuilder()
+        item.add_control("self", url_for("logresource", rid=log.rid))
+        item.add_control("profile", LOG_PROFILE)
+        item.add_control("user", url_for("userresource", username=username))
+        item.add_control("activity", url_for("activityresource", category=log.activity_category, name=log.activity_name))
+        item["id"] = log.rid
+        item["user_id"] = log.user_id
+        item["activity_name"] = log.activity_name
+        item["start_time"] = log.start_time.isoformat()
+        item["end_time"] = log.end_time.isoformat()
+        item["comments"] = log.comments
+        items.append(item)
+    return items
+
+def make_logs(count):
+    start = datetime(2024, 1, 1, 8, 0)
+    return [
+        SimpleNamespace(
+            rid=rid,
+            user_id="bench_user",
+            activity_category="Work",
+            activity_name="Coding" if rid % 3 else "Meeting",
+            start_time=start + timedelta(hours=rid),
+            end_time=start + timedelta(hours=rid, minutes=45),
+            comments="Log number {}".format(rid),
+        )
+        for rid in range(1, count + 1)
+    ]
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - began)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    logs = make_logs(args.items)
+    app = create_app()
+    with app.test_request_context():
+        legacy = json.dumps(legacy_log_items(logs, "bench_user"))
+        current = json.dumps(render_log_items(logs, "bench_user"))
+        assert legacy == current, "rendered output differs"
+
+        before = best_of(lambda: legacy_log_items(logs, "bench_user"), args.repeat)
+        after = best_of(lambda: render_log_items(logs, "bench_user"), args.repeat)
+
+    print("items: {}".format(args.items))
+    print("before: {:8.2f} us/item ({:.3f} s)".format(before / args.items * 1e6, before))
+    print("after:  {:8.2f} us/item ({:.3f} s)".format(after / args.items * 1e6, after))
+    print("speedup: {:.1f}x".format(before / after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark of encoding the bodies of the log, report and user lists with
+every available JSON encoder.
+
+Run from the src/ directory:
+    python benchmarks/bench_serialization.py [--items 10000] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app import create_app
+from constants import *
+from encoding import ENCODERS
+from log_api import render_log_items
+from rendering import build_url
+from utils import HourLoggerBuilder
+
+sys.path.insert(0, os.path.dirname(__file__))
+from bench_rendering import make_logs
+
+
+def log_list(count):
+    body = HourLoggerBuilder()
+    body.add_namespace("hlog", LINK_RELATIONS_URL)
+    body.add_control("self", build_url("loglistresource", username="bench_user"))
+    body.add_control_add_log("bench_user")
+    body["items"] = render_log_items(make_logs(count), "bench_user")
+    return body
+
+def report_list(count):
+    body = HourLoggerBuilder()
+    body.add_namespace("hlog", LINK_RELATIONS_URL)
+    body.add_control("self", build_url("reportlistresource", username="bench_user"))
+    body.add_control_add_report("bench_user")
+    start = datetime(2024, 1, 1)
+    totals = {
+        "seconds": 27000,
+        "hours": 7.5,
+        "categories": [{"category": "Work", "seconds": 27000, "hours": 7.5}],
+        "activities": [
+            {"category": "Work", "activity": "Coding", "seconds": 18000, "hours": 5.0},
+            {"category": "Work", "activity": "Meeting", "seconds": 9000, "hours": 2.5},
+        ],
+    }
+    body["items"] = [{
+        "@controls": {
+            "self": {"href": build_url("reportresource", rid=rid)},
+            "profile": {"href": LOG_PROFILE},
+            "user": {"href": build_url("userresource", username="bench_user")},
+        },
+        "id": rid,
+        "user_id": "bench_user",
+        "start_time": (start + timedelta(weeks=rid)).isoformat(),
+        "end_time": (start + timedelta(weeks=rid + 1)).isoformat(),
+        "totals": totals,
+    } for rid in range(1, count + 1)]
+    return body
+
+def user_list(count):
+    body = HourLoggerBuilder()
+    body.add_namespace("hlog", LINK_RELATIONS_URL)
+    body.add_control("self", build_url("userlistresource"))
+    body.add_control_add_user()
+    body["items"] = [{
+        "@controls": {
+            "self": {"href": build_url("userresource", username=username)},
+            "profile": {"href": USER_PROFILE},
+            "categories-all": {"href": build_url("categorylistresource")},
+            "logs-by": {"href": build_url("loglistresource", username=username)},
+            "reports-by": {"href": build_url("reportlistresource", username=username)},
+        },
+        "username": username,
+    } for username in ("user{}".format(i) for i in range(count))]
+    return body
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - began)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.test_request_context():
+        bodies = {
+            "logs": log_list(args.items),
+            "reports": report_list(args.items),
+            "users": user_list(args.items),
+        }
+
+    print("items per list: {}".format(args.items))
+    for name, body in bodies.items():
+        print("{}:".format(name))
+        for encoder, dumps in sorted(ENCODERS.items()):
+            took = best_of(lambda: dumps(body), args.repeat)
+            print("  {:8} {:8.3f} ms  {:7.2f} us/item  {:9d} bytes".format(
+                encoder, took * 1e3, took / args.items * 1e6, len(dumps(body))
+            ))
+
+
+if __name__ == "__main__":
+    main()
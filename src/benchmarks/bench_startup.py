@@ -0,0 +1,43 @@
+"""
+Benchmark of the cold start of a worker: each run starts a fresh interpreter
+that imports the app and calls create_app, and reports the import and
+startup times the factory records.
+
+Run from the src/ directory:
+    python benchmarks/bench_startup.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+PROBE = (
+    "import json\n"
+    "from app import create_app\n"
+    "app = create_app()\n"
+    "print(json.dumps(app.extensions['startup_timings']))\n"
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    timings = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE], cwd=SRC, check=True, capture_output=True, text=True
+        ).stdout
+        timings.append(json.loads(output.strip().splitlines()[-1]))
+
+    for key in ("import_seconds", "startup_seconds"):
+        values = sorted(timing[key] * 1e3 for timing in timings)
+        print("{:16} min {:7.1f} ms  median {:7.1f} ms".format(key, values[0], values[len(values) // 2]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark of concurrent read/write throughput on a file database, with the
+storage profile of storage.py and with a plain default SQLite connection.
+Reader threads page through a user's logs while writer threads insert logs,
+each in its own transaction.
+
+Run from the src/ directory:
+    python benchmarks/bench_storage.py [--readers 4] [--writers 2] [--seconds 5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.exc import OperationalError
+from models import db, User, Category, Activity, Log
+from storage import DEFAULT_SQLITE_PRAGMAS, apply_pragmas
+
+log_table = Log.__table__
+
+
+def make_engine(path, pragmas):
+    engine = create_engine("sqlite:///" + path, pool_size=16, max_overflow=0)
+    if pragmas:
+        @event.listens_for(engine, "connect")
+        def set_storage_profile(dbapi_connection, connection_record):
+            apply_pragmas(dbapi_connection, pragmas)
+    return engine
+
+def seed(engine, logs):
+    db.metadata.create_all(engine)
+    start = datetime(2024, 1, 1, 8, 0)
+    with engine.begin() as connection:
+        connection.execute(User.__table__.insert(), [{"username": "bench_user", "password": "1234"}])
+        connection.execute(Category.__table__.insert(), [{"name": "Work"}])
+        connection.execute(Activity.__table__.insert(), [{"name": "Coding", "category_name": "Work"}])
+        connection.execute(log_table.insert(), [{
+            "user_id": "bench_user",
+            "activity_category": "Work",
+            "activity_name": "Coding",
+            "start_time": start + timedelta(hours=i),
+            "end_time": start + timedelta(hours=i, minutes=45),
+        } for i in range(logs)])
+
+def reader(engine, stop, counts):
+    query = (
+        select(log_table)
+        .where(log_table.c.user_id == "bench_user")
+        .order_by(log_table.c.start_time.desc(), log_table.c.rid.desc())
+        .limit(100)
+    )
+    while not stop.is_set():
+        try:
+            with engine.connect() as connection:
+                connection.execute(query).fetchall()
+            counts["reads"] += 1
+        except OperationalError:
+            counts["errors"] += 1
+
+def writer(engine, stop, counts, offset):
+    start = datetime(2030, 1, 1) + timedelta(days=offset * 1000)
+    i = 0
+    while not stop.is_set():
+        i += 1
+        try:
+            with engine.begin() as connection:
+                connection.execute(log_table.insert().values(
+                    user_id="bench_user",
+                    activity_category="Work",
+                    activity_name="Coding",
+                    start_time=start + timedelta(hours=i),
+                    end_time=start + timedelta(hours=i, minutes=30),
+                ))
+            counts["writes"] += 1
+        except OperationalError:
+            counts["errors"] += 1
+
+def run(pragmas, args):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    engine = make_engine(path, pragmas)
+    try:
+        seed(engine, args.logs)
+        stop = threading.Event()
+        counts = {"reads": 0, "writes": 0, "errors": 0}
+        threads = [threading.Thread(target=reader, args=(engine, stop, counts)) for _ in range(args.readers)]
+        threads += [threading.Thread(target=writer, args=(engine, stop, counts, n)) for n in range(args.writers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return counts
+    finally:
+        engine.dispose()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--logs", type=int, default=10000)
+    args = parser.parse_args()
+
+    print("readers: {}, writers: {}, {} s each".format(args.readers, args.writers, args.seconds))
+    for name, pragmas in (("default", {}), ("profile", DEFAULT_SQLITE_PRAGMAS)):
+        counts = run(pragmas, args)
+        print("{:8} {:9.1f} reads/s  {:8.1f} writes/s  {:5d} errors".format(
+            name, counts["reads"] / args.seconds, counts["writes"] / args.seconds, counts["errors"]
+        ))
+
+
+if __name__ == "__main__":
+    main()
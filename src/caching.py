@@ -0,0 +1,173 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from time import monotonic
+
+from flask import Response, request
+from flask_caching import Cache
+from flask_caching.backends.base import BaseCache
+from sqlalchemy.dialects.sqlite import insert
+
+from models import db, CacheScope
+
+cache = Cache()
+
+# Hit and miss counters of the response cache. Plain integer increments are
+# good enough here, a lost update under contention only skews the numbers.
+stats = {"hits": 0, "misses": 0, "not_modified": 0}
+
+
+class LRUCache(BaseCache):
+    """
+    In-process cache backend that evicts the least recently used entry once
+    it holds more than threshold entries. Unlike SimpleCache, which prunes
+    arbitrary entries when it gets full, this keeps the hot list and report
+    pages around. Selected with CACHE_TYPE = "caching.LRUCache". Every worker
+    process has its own; entries stay correct across workers because each is
+    checked against the scope versions in the database before it is served.
+    """
+
+    def __init__(self, threshold=500, default_timeout=300):
+        super().__init__(default_timeout=default_timeout)
+        self._threshold = threshold
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(threshold=config["CACHE_THRESHOLD"])
+        return cls(*args, **kwargs)
+
+    def _expires(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return monotonic() + timeout if timeout > 0 else None
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires <= monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._items[key] = (self._expires(timeout), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self._threshold:
+                self._items.popitem(last=False)
+        return True
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            if key in self._items:
+                return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            return self._items.pop(key, None) is not None
+
+    def has(self, key):
+        return self.get(key) is not None
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+        return True
+
+
+def _current_tokens(scopes):
+    """
+    Returns the current version of each scope, read from the database in
+    the request's transaction, so that it matches the data the handler reads.
+    """
+    tokens = dict.fromkeys(scopes, 0)
+    tokens.update(db.session.execute(
+        db.select(CacheScope.scope, CacheScope.version).where(CacheScope.scope.in_(scopes))
+    ).all())
+    return tokens
+
+def invalidate(*scopes):
+    """
+    Marks every cached response that depends on any of the given scopes as
+    stale by bumping their versions. Call it before the write is committed,
+    so the bump commits or rolls back with it. Scopes are strings such as
+    "logs:<username>" or "report:<rid>"; see the cached decorators on the
+    resources for what each one covers.
+    """
+    if scopes:
+        db.session.execute(
+            insert(CacheScope.__table__).on_conflict_do_update(
+                index_elements=[CacheScope.scope],
+                set_={"version": CacheScope.version + 1}
+            ),
+            [{"scope": scope, "version": 1} for scope in set(scopes)]
+        )
+
+def _variant():
+    """
+    Identifies the requested representation. Resources negotiate the media
+    type from the Accept header, so it is part of every key and ETag.
+    """
+    return request.full_path + "|" + request.headers.get("Accept", "")
+
+def _etag(tokens):
+    """
+    Strong ETag of the current request's representation. It changes whenever
+    any scope the response depends on is invalidated, so it can be computed
+    without running the handler.
+    """
+    raw = _variant() + "|" + "|".join("{}={}".format(scope, tokens[scope]) for scope in sorted(tokens))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+def cached(*scopes):
+    """
+    Caches successful responses of a resource GET method under the request
+    path, query string and Accept header; streamed responses are not stored.
+    Scopes are format strings filled in from the view arguments, e.g.
+    "logs:{username}". A cached response is served only while none of its
+    scopes have been invalidated since it was stored.
+
+    Responses also carry an ETag derived from the scope versions. A request
+    whose If-None-Match matches it gets 304 Not Modified straight away, after
+    the one query that reads the versions and without a body being built.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            deps = [scope.format(**kwargs) for scope in scopes]
+            tokens = _current_tokens(deps)
+            etag = _etag(tokens)
+            # Weak comparison: a compressed response carries the weak form of the ETag
+            if request.if_none_match.contains_weak(etag):
+                stats["not_modified"] += 1
+                response = Response(status=304)
+                response.set_etag(etag)
+                response.vary.add("Accept")
+                return response
+
+            key = "view:" + _variant()
+            entry = cache.get(key)
+            if entry is not None and entry[0] == tokens:
+                stats["hits"] += 1
+                data, status, mimetype = entry[1]
+                response = Response(data, status, mimetype=mimetype)
+                response.set_etag(etag)
+                response.vary.add("Accept")
+                return response
+            stats["misses"] += 1
+            response = func(self, *args, **kwargs)
+            if isinstance(response, Response) and response.status_code == 200:
+                if not response.is_streamed:
+                    cache.set(key, (tokens, (response.get_data(), 200, response.mimetype)))
+                response.set_etag(etag)
+                response.vary.add("Accept")
+            return response
+        return wrapper
+    return decorator
@@ -1,11 +1,16 @@
-import json
-from flask import Response, request, url_for
-from flask_restful import Resource, reqparse
+from flask import request, url_for
+from flask_restful import Resource
 from models import db, Category
-from utils import HourLoggerBuilder, create_error_response
+from utils import HourLoggerBuilder, create_error_response, create_response
+from caching import cached, invalidate
+from auth import require_admin, require_key
+from rendering import url_template
+from validation import ValidationError, validate
 from constants import *
 
 class CategoryListResource(Resource):
+    @require_key
+    @cached("categories")
     def get(self):
         """Retrieve all categories."""
         body = HourLoggerBuilder()
@@ -15,17 +20,22 @@ class CategoryListResource(Resource):
         body.add_control_add_category()
         body["items"] = []
         categories = Category.query.all()
+        category_url = url_template("categoryresource")
+        activities_url = url_template("activitylistresource")
         for category in categories:
-            item = HourLoggerBuilder()
-            item.add_control("self", url_for("categoryresource", name=category.name))
-            item.add_control("profile", CATEGORY_PROFILE)
-            item.add_control("activities-in", url_for("activitylistresource", category=category.name))
-            item["name"] = category.name
-            item["description"] = category.description
-            body["items"].append(item)
+            body["items"].append({
+                "@controls": {
+                    "self": {"href": category_url.build(name=category.name)},
+                    "profile": {"href": CATEGORY_PROFILE},
+                    "activities-in": {"href": activities_url.build(category=category.name)},
+                },
+                "name": category.name,
+                "description": category.description,
+            })
             
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        return create_response(body)
 
+    @require_admin
     def post(self):
         """Create a new category."""
         if not request.json:
@@ -34,15 +44,16 @@ class CategoryListResource(Resource):
                 "Requests must be JSON"
             )
         
-        parser = reqparse.RequestParser()
-        parser.add_argument("name", required=True, help="Category name is required")
-        parser.add_argument("description", required=False)
-        data = parser.parse_args()
+        try:
+            data = validate(Category, request.json)
+        except ValidationError as exc:
+            return {"message": exc.errors}, 400
 
-        category = Category(name=data["name"], description=data["description"])
+        category = Category(name=data["name"], description=data.get("description"))
         db.session.add(category)
 
         try:
+            invalidate("categories")
             db.session.commit()
             return {"message": "Category created successfully"}, 201
         except:
@@ -51,6 +62,8 @@ class CategoryListResource(Resource):
 
 
 class CategoryResource(Resource):
+    @require_key
+    @cached("category:{name}")
     def get(self, name):
         """Retrieve a single category."""
         category = Category.query.filter_by(name=name).first()
@@ -69,8 +82,9 @@ class CategoryResource(Resource):
         body["name"] = category.name
         body["description"] = category.description
         
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        return create_response(body)
 
+    @require_admin
     def put(self, name):
         """Update a category's description."""
         if not request.json:
@@ -83,14 +97,17 @@ class CategoryResource(Resource):
         if not category:
             return {"error": "Category not found"}, 404
 
-        parser = reqparse.RequestParser()
-        parser.add_argument("description", required=False)
-        data = parser.parse_args()
+        try:
+            data = validate(Category, request.json, required=[])
+        except ValidationError as exc:
+            return {"message": exc.errors}, 400
 
-        category.description = data["description"] or category.description
+        category.description = data.get("description") or category.description
+        invalidate("categories", f"category:{name}")
         db.session.commit()
         return {"message": "Category updated"}, 200
 
+    @require_admin
     def delete(self, name):
         """Delete a category."""
         category = Category.query.filter_by(name=name).first()
@@ -98,5 +115,7 @@ class CategoryResource(Resource):
             return {"error": "Category not found"}, 404
 
         db.session.delete(category)
+        # Deleting the category also deletes its activities, which unlinks them from logs
+        invalidate("categories", f"category:{name}", f"activities:{name}", "log-activities")
         db.session.commit()
         return {"message": "Category deleted"}, 200
@@ -0,0 +1,86 @@
+import zlib
+
+from flask import request
+
+# Content codings offered, by preference, with the zlib window bits that
+# produce each: gzip adds the gzip header, deflate is the zlib format
+ENCODINGS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+COMPRESSIBLE = ("application/json", "application/vnd.mason+json", "application/x-ndjson", "text/")
+
+
+def _compressible(response, min_size):
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return False
+    if response.direct_passthrough or "Content-Encoding" in response.headers:
+        return False
+    if not (response.mimetype or "").startswith(COMPRESSIBLE):
+        return False
+    # Streamed bodies have no length up front and are always compressed
+    return response.is_streamed or (response.calculate_content_length() or 0) >= min_size
+
+def _compress_stream(chunks, compressor, sizes):
+    """
+    Compresses a streamed body chunk by chunk. Every chunk is flushed, so
+    the client gets each part of an export as soon as it is produced.
+    sizes[0] counts the uncompressed bytes.
+    """
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            sizes[0] += len(chunk)
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+def compress_response(response, level=6, min_size=1024):
+    """
+    Compresses a response with the best coding of the request's
+    Accept-Encoding that the API offers, if the body is of a text type and
+    at least min_size bytes long. The uncompressed size is left in
+    response.uncompressed_bytes for the metrics; for streamed bodies it is
+    a one-item list that counts up while the body is sent.
+    """
+    if not _compressible(response, min_size):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(list(ENCODINGS))
+    if encoding is None:
+        return response
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, ENCODINGS[encoding])
+    if response.is_streamed:
+        sizes = [0]
+        response.response = _compress_stream(response.response, compressor, sizes)
+        response.uncompressed_bytes = sizes
+    else:
+        body = response.get_data()
+        response.set_data(compressor.compress(body) + compressor.flush())
+        response.uncompressed_bytes = len(body)
+    response.headers["Content-Encoding"] = encoding
+    # The compressed body is a different representation of the same
+    # resource, so a strong ETag becomes weak
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+def init_compression(app):
+    """
+    Compresses the responses of the app as negotiated with Accept-Encoding,
+    at level COMPRESS_LEVEL and from COMPRESS_MIN_SIZE bytes up. Set
+    COMPRESS_ENABLED to False to leave it out. Registered after the metrics,
+    so that they see the compressed response.
+    """
+    if not app.config["COMPRESS_ENABLED"]:
+        return
+    level = app.config["COMPRESS_LEVEL"]
+    min_size = app.config["COMPRESS_MIN_SIZE"]
+
+    @app.after_request
+    def compress(response):
+        return compress_response(response, level, min_size)
@@ -1,8 +1,17 @@
 MASON = "application/vnd.mason+json"
+NDJSON = "application/x-ndjson"
+CSV = "text/csv"
 LINK_RELATIONS_URL = "/hourlogger/link-relations/"
 ERROR_PROFILE = "/profiles/error/"
 CATEGORY_PROFILE = "/profiles/category/"
 ACTIVITY_PROFILE = "/profiles/activity/"
 USER_PROFILE = "/profiles/user/"
 LOG_PROFILE  = "/profiles/log/"
-REPORT_PROFILE = "/profiles/report/"
\ No newline at end of file
+REPORT_PROFILE = "/profiles/report/"
+JOB_PROFILE = "/profiles/job/"
+API_KEY_PROFILE = "/profiles/api-key/"
+COMPACT_PROFILE = "/profiles/compact/"
+API_KEY_HEADER = "Hourlogger-Api-Key"
+LOG_PAGE_SIZE = 100
+LOG_PAGE_MAX = 1000
+EXPORT_CHUNK_SIZE = 1000
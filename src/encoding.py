@@ -0,0 +1,42 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj).encode("utf-8")
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj)
+
+ENCODERS = {"stdlib": _stdlib_dumps}
+if orjson is not None:
+    ENCODERS["orjson"] = _orjson_dumps
+
+_dumps = _stdlib_dumps
+
+
+def set_encoder(name="auto"):
+    """
+    Selects the JSON encoder used for every response body. "auto" picks
+    orjson when it is installed and falls back to the standard library
+    otherwise. Asking for an encoder that is not available raises
+    ValueError, so a misconfigured deployment fails at startup.
+    """
+    global _dumps
+    if name == "auto":
+        name = "orjson" if "orjson" in ENCODERS else "stdlib"
+    if name not in ENCODERS:
+        raise ValueError("JSON encoder {} is not available".format(name))
+    _dumps = ENCODERS[name]
+    return name
+
+def dumps(obj):
+    """
+    Encodes obj as UTF-8 JSON bytes with the selected encoder. Returning
+    bytes lets the response use the buffer as is, without a str copy.
+    """
+    return _dumps(obj)
@@ -0,0 +1,159 @@
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+
+class JobCancelled(Exception):
+    """
+    Raised by a job function that saw its cancel_requested flag and gave up.
+    """
+
+
+class QueueFull(Exception):
+    """
+    Raised by JobQueue.submit when the queue already holds its limit of
+    active jobs.
+    """
+
+
+class Job:
+    """
+    A unit of background work. key identifies the work for deduplication,
+    result is whatever the job function returned once the job is done.
+    """
+
+    __slots__ = ("id", "key", "state", "result", "error", "created", "finished",
+                 "cancel_requested", "future")
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.created = datetime.now()
+        self.finished = None
+        self.cancel_requested = False
+        self.future = None
+
+    @property
+    def active(self):
+        return self.state in ACTIVE_STATES
+
+
+class JobQueue:
+    """
+    Runs jobs on a bounded thread pool of this process. At most limit jobs
+    may be queued or running at once, and submitting the key of an active
+    job returns that job instead of queueing the same work again. The last
+    history finished jobs are kept so that clients can still poll them.
+    """
+
+    def __init__(self, workers=2, limit=100, history=1000):
+        self.workers = workers
+        self.limit = limit
+        self.history = history
+        self._jobs = OrderedDict()
+        self._active = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, key, func, *args):
+        """
+        Queues func(job, *args) unless a job with the same key is active.
+        Returns (job, created). Raises QueueFull when the queue is full.
+        """
+        with self._lock:
+            job = self._active.get(key)
+            if job is not None:
+                return job, False
+            if len(self._active) >= self.limit:
+                raise QueueFull("{} jobs are already pending".format(len(self._active)))
+            job = Job(key)
+            self._jobs[job.id] = job
+            self._active[key] = job
+            # Created on first use, so a prefork worker starts its own threads
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="job")
+            job.future = self._executor.submit(self._run, job, func, args)
+        return job, True
+
+    def _run(self, job, func, args):
+        with self._lock:
+            if job.state != QUEUED:
+                return
+            job.state = RUNNING
+        try:
+            result = func(job, *args)
+        except JobCancelled:
+            self._finish(job, CANCELLED)
+        except Exception as exc:
+            self._finish(job, FAILED, error=str(exc))
+        else:
+            self._finish(job, DONE, result=result)
+
+    def _finish(self, job, state, result=None, error=None):
+        with self._lock:
+            job.state = state
+            job.result = result
+            job.error = error
+            job.finished = datetime.now()
+            if self._active.get(job.key) is job:
+                del self._active[job.key]
+            finished = [old for old in self._jobs.values() if not old.active]
+            for old in finished[:max(0, len(finished) - self.history)]:
+                del self._jobs[old.id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancels a job. A queued job is cancelled at once; a running one is
+        asked to stop and ends up cancelled if it checks in time. Returns
+        the job, or None if there is no such job.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if job.active:
+            job.cancel_requested = True
+            if job.future.cancel():
+                self._finish(job, CANCELLED)
+        return job
+
+    def counts(self):
+        """Returns the number of known jobs in each state."""
+        with self._lock:
+            counts = dict.fromkeys((QUEUED, RUNNING, DONE, FAILED, CANCELLED), 0)
+            for job in self._jobs.values():
+                counts[job.state] += 1
+        return counts
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def init_jobs(app):
+    """
+    Sets up the background job queue of the app in app.extensions["jobs"],
+    sized by REPORT_JOB_WORKERS, REPORT_JOB_LIMIT and REPORT_JOB_HISTORY.
+    """
+    app.extensions["jobs"] = JobQueue(
+        workers=app.config["REPORT_JOB_WORKERS"],
+        limit=app.config["REPORT_JOB_LIMIT"],
+        history=app.config["REPORT_JOB_HISTORY"],
+    )
@@ -1,84 +1,523 @@
+import csv
+import io
 import json
-from datetime import datetime
-from flask import Response, request, url_for
-from flask_restful import Resource, reqparse
-from models import db, Log, User
-from utils import HourLoggerBuilder, create_error_response
+from bisect import bisect_left
+from datetime import timedelta
+from flask import Response, current_app, request, stream_with_context, url_for
+from flask_restful import Resource
+from sqlalchemy import select, tuple_
+from models import db, Activity, Log, TimeReport, User, apply_to_daily_totals
+from encoding import dumps
+from utils import (
+    HourLoggerBuilder, create_compact_response, create_error_response, create_response, decode_cursor,
+    encode_cursor, wants_compact,
+)
+from caching import cached, invalidate
+from auth import require_user
+from rendering import build_url, url_template
+from validation import ValidationError, parse_datetime, validate
 from constants import *
 
 
+def _invalidate_logs(user_id, start_time, end_time, rids=()):
+    """
+    Invalidates the cached responses that created or deleted logs show up
+    in: the given logs themselves, the user's log list and the reports whose
+    window overlaps the time between start_time and end_time, together with
+    the report list that carries their totals. New logs have no cached
+    responses yet, so only deleted ones need their rids passed.
+    """
+    scopes = [f"logs:{user_id}"] + [f"log:{rid}" for rid in rids]
+    reports = db.session.query(TimeReport.rid).filter(
+        TimeReport.user_id == user_id,
+        TimeReport.start_time < end_time,
+        TimeReport.end_time > start_time,
+    ).all()
+    if reports:
+        scopes.append(f"reports:{user_id}")
+        scopes += [f"report:{rid}" for rid, in reports]
+    invalidate(*scopes)
+
+def _validate_log_item(item):
+    """
+    Validates one log against the Log schema and the time rules. Returns the
+    column values of the log, or raises ValidationError for schema errors
+    and ValueError when the times are out of order.
+    """
+    item = validate(Log, item)
+    start_time = item["start_time"]
+    end_time = item["end_time"]
+    if start_time >= end_time:
+        raise ValueError("Start time must be before end time")
+    return {
+        "activity_category": item["activity_category"],
+        "activity_name": item["activity_name"],
+        "start_time": start_time,
+        "end_time": end_time,
+        "comments": item.get("comments"),
+    }
+
+def _missing_activities(rows):
+    """
+    Returns the (activity_category, activity_name) pairs of the given log
+    rows that name no existing activity, found with one query. The foreign
+    key would reject those logs only when they are inserted.
+    """
+    pairs = {(row["activity_category"], row["activity_name"]) for row in rows}
+    if not pairs:
+        return set()
+    found = db.session.execute(
+        select(Activity.category_name, Activity.name).where(
+            tuple_(Activity.category_name, Activity.name).in_(pairs)
+        )
+    ).all()
+    return pairs - {tuple(row) for row in found}
+
+def _find_overlaps(user, intervals):
+    """
+    Returns, for each (start_time, end_time) in intervals, the ids of the
+    user's existing logs that overlap it. No log of the user is longer than
+    its longest_log, so every candidate starts less than that before the
+    earliest interval: one range probe on the (user_id, start_time) index
+    fetches them all, and each interval is then checked by bisecting the
+    sorted start times.
+    """
+    if not intervals:
+        return []
+    longest = timedelta(seconds=user.longest_log)
+    window_start = min(start for start, _ in intervals) - longest
+    window_end = max(end for _, end in intervals)
+    rows = db.session.execute(
+        select(Log.start_time, Log.end_time, Log.rid).where(
+            Log.user_id == user.username,
+            Log.start_time >= window_start,
+            Log.start_time < window_end,
+        ).order_by(Log.start_time, Log.rid)
+    ).all()
+    starts = [row.start_time for row in rows]
+    overlaps = []
+    for start, end in intervals:
+        first = bisect_left(starts, start - longest)
+        last = bisect_left(starts, end)
+        overlaps.append([row.rid for row in rows[first:last] if row.end_time > start])
+    return overlaps
+
+def _overlap_mode():
+    """
+    Returns how overlapping logs are handled, from the overlap query
+    parameter or the LOG_OVERLAP_MODE setting: "allow", "flag" or "reject".
+    """
+    mode = request.args.get("overlap", current_app.config["LOG_OVERLAP_MODE"])
+    if mode not in ("allow", "flag", "reject"):
+        raise ValueError("Overlap mode must be allow, flag or reject")
+    return mode
+
+def _log_filters(args):
+    """
+    Reads the filters of a log list request: from and to bound the start
+    time (from inclusive, to exclusive) and category and activity select
+    the activity. Returns the filters that were given, to carry them over
+    to other links, and the SQL criteria that apply them. Raises ValueError
+    for timestamps that are not ISO 8601.
+    """
+    filters = {name: args[name] for name in ("from", "to", "category", "activity") if args.get(name)}
+    criteria = []
+    try:
+        if "from" in filters:
+            criteria.append(Log.start_time >= parse_datetime(filters["from"]))
+        if "to" in filters:
+            criteria.append(Log.start_time < parse_datetime(filters["to"]))
+    except ValueError as exc:
+        raise ValueError("from and to must be ISO 8601 timestamps (YYYY-MM-DDTHH:MM:SS)") from exc
+    if "category" in filters:
+        criteria.append(Log.activity_category == filters["category"])
+    if "activity" in filters:
+        criteria.append(Log.activity_name == filters["activity"])
+    return filters, criteria
+
+# Columns that tell the logs of a batch apart, to match inserted ids to rows
+BATCH_KEY_COLUMNS = ("start_time", "end_time", "activity_category", "activity_name", "comments")
+
+EXPORT_COLUMNS = ("id", "user_id", "activity_category", "activity_name", "start_time", "end_time", "comments")
+
+def _export_logs(username, mimetype, criteria=()):
+    """
+    Generator that streams all logs of a user, narrowed down by the given
+    filter criteria, as NDJSON or CSV. Rows are read as plain tuples,
+    EXPORT_CHUNK_SIZE at a time, and every chunk is sent as soon as it has
+    been encoded, so memory use does not grow with the size of the history.
+    """
+    stmt = select(
+        Log.rid, Log.user_id, Log.activity_category, Log.activity_name,
+        Log.start_time, Log.end_time, Log.comments
+    ).where(
+        Log.user_id == username, *criteria
+    ).order_by(
+        Log.start_time, Log.rid
+    ).execution_options(stream_results=True, yield_per=EXPORT_CHUNK_SIZE)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if mimetype == CSV:
+        writer.writerow(EXPORT_COLUMNS)
+        yield buffer.getvalue()
+
+    for rows in db.session.execute(stmt).partitions():
+        values = [
+            (rid, user_id, category, activity, start_time.isoformat(), end_time.isoformat(), comments)
+            for rid, user_id, category, activity, start_time, end_time, comments in rows
+        ]
+        if mimetype == CSV:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(values)
+            yield buffer.getvalue()
+        else:
+            yield b"".join(dumps(dict(zip(EXPORT_COLUMNS, row))) + b"\n" for row in values)
+
+
+def render_log_items(logs, username):
+    """
+    Renders the items of a log list. URLs come from precomputed templates and
+    every item is a plain dict literal, which keeps the per-item cost down
+    to the attribute reads and one string build per URL.
+    """
+    log_url = url_template("logresource")
+    activity_url = url_template("activityresource")
+    user_href = build_url("userresource", username=username)
+    items = []
+    for log in logs:
+        controls = {
+            "self": {"href": log_url.build(rid=log.rid)},
+            "profile": {"href": LOG_PROFILE},
+            "user": {"href": user_href},
+        }
+        # Logs whose activity has been deleted have nothing to link to
+        if log.activity_name is not None:
+            controls["activity"] = {"href": activity_url.build(
+                category=log.activity_category, name=log.activity_name
+            )}
+        items.append({
+            "@controls": controls,
+            "id": log.rid,
+            "user_id": log.user_id,
+            "activity_name": log.activity_name,
+            "start_time": log.start_time.isoformat(),
+            "end_time": log.end_time.isoformat(),
+            "comments": log.comments,
+        })
+    return items
+
 
 class LogListResource(Resource):
+    @require_user()
+    @cached("logs:{username}", "log-activities")
     def get(self, username):
-        """Retrieve all logs for a specific user."""
+        """
+        Retrieve one page of logs for a specific user. Logs are ordered by
+        (start_time, rid) and paged with a keyset cursor, so fetching any page
+        costs the same regardless of how many logs the user has. Clients that
+        accept NDJSON or CSV get the whole history streamed instead, and
+        ?view=compact gives the page as plain rows. The from, to, category
+        and activity filters apply to all of them.
+        """
+        try:
+            filters, criteria = _log_filters(request.args)
+        except ValueError as exc:
+            return create_error_response(400, "Invalid filter", str(exc))
+
+        mimetype = request.accept_mimetypes.best_match([MASON, NDJSON, CSV], default=MASON)
+        if mimetype in (NDJSON, CSV):
+            response = Response(
+                stream_with_context(_export_logs(username, mimetype, criteria)), 200, mimetype=mimetype
+            )
+            if mimetype == CSV:
+                response.headers["Content-Disposition"] = "attachment; filename={}-logs.csv".format(username)
+            return response
+
+        try:
+            limit = int(request.args.get("limit", LOG_PAGE_SIZE))
+        except ValueError:
+            return create_error_response(
+                400, "Invalid limit",
+                "Limit must be an integer"
+            )
+        if not 1 <= limit <= LOG_PAGE_MAX:
+            return create_error_response(
+                400, "Invalid limit",
+                "Limit must be between 1 and {}".format(LOG_PAGE_MAX)
+            )
+
+        direction, key = "next", None
+        cursor = request.args.get("cursor")
+        if cursor:
+            try:
+                direction, key = decode_cursor(cursor)
+            except ValueError:
+                return create_error_response(
+                    400, "Invalid cursor",
+                    "Cursor is malformed"
+                )
+
+        compact = wants_compact()
+        query = Log.query.filter(Log.user_id == username, *criteria)
+        if compact:
+            # Plain rows skip building an ORM object per log
+            query = query.with_entities(
+                Log.rid, Log.user_id, Log.activity_category, Log.activity_name,
+                Log.start_time, Log.end_time, Log.comments
+            )
+        position = tuple_(Log.start_time, Log.rid)
+        if direction == "prev":
+            if key is not None:
+                query = query.filter(position < key)
+            query = query.order_by(Log.start_time.desc(), Log.rid.desc())
+        else:
+            if key is not None:
+                query = query.filter(position > key)
+            query = query.order_by(Log.start_time, Log.rid)
+
+        # Fetch one extra row to find out whether there is more to page to
+        logs = query.limit(limit + 1).all()
+        has_more = len(logs) > limit
+        logs = logs[:limit]
+        if direction == "prev":
+            logs.reverse()
+            has_prev, has_next = has_more, key is not None
+        else:
+            has_prev, has_next = key is not None, has_more
+
+        if "view" in request.args:
+            filters["view"] = request.args["view"]
+        pages = {}
+        if logs and has_next:
+            last = logs[-1]
+            pages["next"] = url_for(
+                "loglistresource", username=username, limit=limit,
+                cursor=encode_cursor("next", last.start_time, last.rid), **filters
+            )
+        if logs and has_prev:
+            first = logs[0]
+            pages["prev"] = url_for(
+                "loglistresource", username=username, limit=limit,
+                cursor=encode_cursor("prev", first.start_time, first.rid), **filters
+            )
+        # Built from the parameters that were read, never from request.args
+        # as a whole, which could also carry url_for's own arguments
+        current = dict(filters)
+        if "limit" in request.args:
+            current["limit"] = limit
+        if cursor:
+            current["cursor"] = cursor
+        self_href = url_for("loglistresource", username=username, **current)
+        if compact:
+            return create_compact_response(self_href, EXPORT_COLUMNS, [
+                [log.rid, log.user_id, log.activity_category, log.activity_name,
+                 log.start_time.isoformat(), log.end_time.isoformat(), log.comments]
+                for log in logs
+            ], **pages)
+
         body = HourLoggerBuilder()
         body.add_namespace("hlog", LINK_RELATIONS_URL)
-        body.add_control("self", url_for("loglistresource", username=username))
+        body.add_control("self", self_href)
         body.add_control("categories-all", url_for("categorylistresource"))
         body.add_control_add_log(username)
-        body["items"] = []
-        
-        logs = Log.query.filter_by(user_id=username).all()
-        for log in logs:
-            item = HourLoggerBuilder()
-            item.add_control("self", url_for("logresource", rid=log.rid))
-            item.add_control("profile", LOG_PROFILE)
-            item.add_control("user", url_for("userresource", username=username))
-            item.add_control("activity", url_for("activityresource", category=log.activity_category, name=log.activity_name))
-            item["id"] = log.rid,
-            item["user_id"] = log.user_id,
-            item["activity_name"] = log.activity_name
-            item["start_time"] = log.start_time.isoformat()
-            item["end_time"] = log.end_time.isoformat()
-            item["comments"] = log.comments
-            
-            body["items"].append(item)
-            
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        body.add_control_filter_logs(username)
+        for rel, href in pages.items():
+            body.add_control(rel, href)
+        body["items"] = render_log_items(logs, username)
+        return create_response(body)
 
+    @require_user()
     def post(self, username):
-        """Create a new log entry for the specified user."""
+        """
+        Create a new log entry for the specified user. A JSON array, or an
+        NDJSON body with one log per line, creates a batch of logs instead.
+        """
+        if request.mimetype == NDJSON:
+            try:
+                items = [
+                    json.loads(line)
+                    for line in request.get_data(as_text=True).splitlines()
+                    if line.strip()
+                ]
+            except ValueError:
+                return create_error_response(
+                    400, "Malformed NDJSON",
+                    "Every line must be one JSON object"
+                )
+            return self._post_batch(username, items)
+
+        # Lists come first: an empty batch is falsy but still JSON
+        if isinstance(request.json, list):
+            return self._post_batch(username, request.json)
         if not request.json:
             return create_error_response(
                 415, "Unsupported media type",
                 "Requests must be JSON"
             )
             
-        parser = reqparse.RequestParser()
-        parser.add_argument("activity_category", required=True, help="Activity category is required")
-        parser.add_argument("activity_name", required=True, help="Activity name is required")
-        parser.add_argument("start_time", required=True, help="Start time is required")
-        parser.add_argument("end_time", required=True, help="End time is required")
-        parser.add_argument("comments", required=False)
-        data = parser.parse_args()
+        try:
+            overlap_mode = _overlap_mode()
+        except ValueError as exc:
+            return create_error_response(400, "Invalid overlap mode", str(exc))
+        try:
+            data = _validate_log_item(request.json)
+        except ValidationError as exc:
+            return {"message": exc.errors}, 400
+        except ValueError as exc:
+            return {"error": str(exc)}, 400
 
         user = User.query.filter_by(username=username).first()
         if not user:
             return {"error": "User does not exist"}, 404
+        if _missing_activities([data]):
+            return {"error": "Activity does not exist"}, 404
 
-        try:
-            start_time = datetime.fromisoformat(data["start_time"])
-            end_time = datetime.fromisoformat(data["end_time"])
-        except ValueError:
-            return {"error": "Invalid date format. Use ISO 8601 format (YYYY-MM-DDTHH:MM:SS)"}, 400
-
-        if start_time >= end_time:
-            return {"error": "Start time must be before end time"}, 400
-
-        log = Log(
-            user_id=username,
-            activity_category=data["activity_category"],
-            activity_name=data["activity_name"],
-            start_time=start_time,
-            end_time=end_time,
-            comments=data.get("comments"),
-        )
+        overlaps = []
+        if overlap_mode != "allow":
+            overlaps, = _find_overlaps(user, [(data["start_time"], data["end_time"])])
+            if overlaps and overlap_mode == "reject":
+                return {"error": "Log overlaps existing logs", "overlaps": overlaps}, 409
+
+        log = Log(user_id=username, **data)
         db.session.add(log)
+        _invalidate_logs(username, log.start_time, log.end_time)
         db.session.commit()
+        if overlaps:
+            return {"message": "Log created successfully", "overlaps": overlaps}, 201
         return {"message": "Log created successfully"}, 201
 
+    def _post_batch(self, username, items):
+        """
+        Validates a batch of logs in one pass and inserts the valid ones with
+        a single multi-row statement in one transaction. In atomic mode any
+        invalid log rejects the whole batch, in partial mode the valid logs
+        are created and the invalid ones are reported back.
+        """
+        if not items:
+            return create_error_response(
+                400, "Empty batch",
+                "A batch must contain at least one log"
+            )
+        batch_limit = current_app.config["LOG_BATCH_LIMIT"]
+        if len(items) > batch_limit:
+            return create_error_response(
+                413, "Batch too large",
+                "A batch can contain at most {} logs".format(batch_limit)
+            )
+        mode = request.args.get("mode", current_app.config["LOG_BATCH_MODE"])
+        if mode not in ("atomic", "partial"):
+            return create_error_response(
+                400, "Invalid mode",
+                "Mode must be either atomic or partial"
+            )
+        try:
+            overlap_mode = _overlap_mode()
+        except ValueError as exc:
+            return create_error_response(400, "Invalid overlap mode", str(exc))
+
+        user = User.query.filter_by(username=username).first()
+        if not user:
+            return {"error": "User does not exist"}, 404
+
+        results = []
+        rows = []
+        for index, item in enumerate(items):
+            try:
+                row = _validate_log_item(item)
+            except ValueError as exc:
+                results.append({"index": index, "status": 400, "error": str(exc)})
+                continue
+            row["user_id"] = username
+            rows.append(row)
+            results.append({"index": index, "status": 201, "row": row})
+
+        missing = _missing_activities(rows)
+        if missing:
+            for result in results:
+                row = result.get("row")
+                if row and (row["activity_category"], row["activity_name"]) in missing:
+                    result["status"] = 404
+                    result["error"] = "Activity does not exist"
+            rows = [result["row"] for result in results if result["status"] == 201]
+
+        if overlap_mode != "allow":
+            self._check_batch_overlaps(user, results, overlap_mode)
+            rows = [result["row"] for result in results if result["status"] == 201]
+        for result in results:
+            result.pop("row", None)
+
+        if mode == "atomic" and len(rows) < len(items):
+            for result in results:
+                if result["status"] == 201:
+                    result["status"] = 424
+            return {"created": 0, "results": results}, 400
+
+        if rows:
+            table = Log.__table__
+            # Ordered RETURNING makes SQLAlchemy send one INSERT per row on
+            # SQLite. Unordered RETURNING keeps the batch in one statement,
+            # so the ids are matched to the rows by the values returned with
+            # them instead; identical rows are interchangeable.
+            columns = [table.c[name] for name in BATCH_KEY_COLUMNS]
+            stmt = table.insert().returning(table.c.rid, *columns)
+            created = {}
+            for rid, *values in db.session.execute(stmt, rows):
+                created.setdefault(tuple(values), []).append(rid)
+            for rids in created.values():
+                rids.sort(reverse=True)
+            rids = [created[tuple(row[name] for name in BATCH_KEY_COLUMNS)].pop() for row in rows]
+            apply_to_daily_totals(db.session.connection(), rows)
+            _invalidate_logs(
+                username,
+                min(row["start_time"] for row in rows),
+                max(row["end_time"] for row in rows)
+            )
+            db.session.commit()
+
+            created = iter(rids)
+            for result in results:
+                if result["status"] == 201:
+                    result["id"] = next(created)
+                    result["href"] = url_for("logresource", rid=result["id"])
+
+        status = 201 if len(rows) == len(items) else 200
+        return {"created": len(rows), "results": results}, status
+
+    @staticmethod
+    def _check_batch_overlaps(user, results, overlap_mode):
+        """
+        Finds the valid logs of a batch that overlap the user's existing logs
+        or each other. Their results get the ids of the overlapping logs and
+        the indexes of the overlapping batch items; in reject mode they
+        become 409 errors instead of being created.
+        """
+        valid = [result for result in results if result["status"] == 201]
+        existing = _find_overlaps(user, [(r["row"]["start_time"], r["row"]["end_time"]) for r in valid])
+        in_batch = {result["index"]: [] for result in valid}
+        ordered = sorted(valid, key=lambda r: r["row"]["start_time"])
+        for position, result in enumerate(ordered):
+            for other in ordered[position + 1:]:
+                if other["row"]["start_time"] >= result["row"]["end_time"]:
+                    break
+                in_batch[result["index"]].append(other["index"])
+                in_batch[other["index"]].append(result["index"])
+
+        for result, overlaps in zip(valid, existing):
+            items = sorted(in_batch[result["index"]])
+            if not overlaps and not items:
+                continue
+            if overlap_mode == "reject":
+                result["status"] = 409
+                result["error"] = "Log overlaps existing logs or other logs of the batch"
+            result["overlaps"] = overlaps
+            result["overlapping_items"] = items
+
 
 class LogResource(Resource):
+    @require_user(Log)
+    @cached("log:{rid}", "log-activities")
     def get(self, rid):
         """Retrieve a specific log entry."""
         log = Log.query.get(rid)
@@ -91,19 +530,24 @@ class LogResource(Resource):
         body.add_control("profile", LOG_PROFILE)
         body.add_control("collection", url_for("loglistresource", username=log.user_id))
         body.add_control("user", url_for("userresource", username=log.user_id))
-        body.add_control("activity", url_for("activityresource", category=log.activity_category, name=log.activity_name))
+        # Logs whose activity has been deleted have nothing to link to
+        if log.activity_name is not None:
+            body.add_control("activity", url_for(
+                "activityresource", category=log.activity_category, name=log.activity_name
+            ))
         body.add_control_delete_log(rid)
             
         
-        body["id"] = log.rid,
-        body["user_id"] = log.user_id,
+        body["id"] = log.rid
+        body["user_id"] = log.user_id
         body["activity_name"] = log.activity_name
         body["start_time"] = log.start_time.isoformat()
         body["end_time"] = log.end_time.isoformat()
         body["comments"] = log.comments
         
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        return create_response(body)
 
+    @require_user(Log)
     def delete(self, rid):
         """Delete a log entry."""
         log = Log.query.get(rid)
@@ -111,5 +555,6 @@ class LogResource(Resource):
             return {"error": "Log not found"}, 404
 
         db.session.delete(log)
+        _invalidate_logs(log.user_id, log.start_time, log.end_time, [rid])
         db.session.commit()
         return {"message": "Log deleted"}, 200
@@ -0,0 +1,235 @@
+import threading
+import weakref
+from bisect import bisect_left
+from time import perf_counter
+
+from flask import Response, request
+from sqlalchemy import event
+
+import caching
+
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+PROMETHEUS_TEXT = "text/plain; version=0.0.4; charset=utf-8"
+
+# Every thread records into its own shard, so recording never takes a lock
+# or contends with another thread. The lock only guards the live shards and
+# the totals of threads that have ended: a server that starts a thread per
+# request would otherwise keep one shard per request forever. /metrics adds
+# them up when scraped.
+_local = threading.local()
+_shards = {}
+_retired = {}
+_shards_lock = threading.RLock()
+
+
+class RouteStats:
+    """
+    Counters of one method and route in one thread's shard.
+    """
+
+    __slots__ = ("requests", "statuses", "buckets", "seconds", "sql_statements", "sql_seconds",
+                 "response_bytes", "uncompressed_bytes")
+
+    def __init__(self):
+        self.requests = 0
+        self.statuses = {}
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.seconds = 0.0
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.response_bytes = 0
+        self.uncompressed_bytes = 0
+
+    def add(self, other):
+        self.requests += other.requests
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        self.buckets = [mine + theirs for mine, theirs in zip(self.buckets, other.buckets)]
+        self.seconds += other.seconds
+        self.sql_statements += other.sql_statements
+        self.sql_seconds += other.sql_seconds
+        self.response_bytes += other.response_bytes
+        self.uncompressed_bytes += other.uncompressed_bytes
+
+
+class _ThreadToken:
+    """
+    Kept only in a thread's local storage, so it is freed when the thread
+    ends, which folds the thread's shard into the retired totals.
+    """
+
+    __slots__ = ("__weakref__",)
+
+
+def _fold(totals, shard):
+    # dict.copy is atomic, so a thread adding a route does not break this
+    for key, stats in shard.copy().items():
+        if key not in totals:
+            totals[key] = RouteStats()
+        totals[key].add(stats)
+
+def _retire(shard_id):
+    with _shards_lock:
+        _fold(_retired, _shards.pop(shard_id))
+
+def _shard():
+    shard = getattr(_local, "routes", None)
+    if shard is None:
+        shard = _local.routes = {}
+        _local.sql_statements = 0
+        _local.sql_seconds = 0.0
+        _local.token = _ThreadToken()
+        with _shards_lock:
+            _shards[id(shard)] = shard
+        weakref.finalize(_local.token, _retire, id(shard))
+    return shard
+
+# The start time is kept on the execution context, which is dropped with the
+# statement, so a statement that fails before after_cursor_execute leaves
+# nothing behind on the pooled connection
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_started = perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "metrics_started", None)
+    _shard()
+    _local.sql_statements += 1
+    if started is not None:
+        _local.sql_seconds += perf_counter() - started
+
+def _start_request():
+    _shard()
+    _local.sql_statements = 0
+    _local.sql_seconds = 0.0
+    _local.request_started = perf_counter()
+
+def _record_request(response):
+    started = getattr(_local, "request_started", None)
+    if started is None:
+        return response
+    _local.request_started = None
+    seconds = perf_counter() - started
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    shard = _shard()
+    stats = shard.get((request.method, route))
+    if stats is None:
+        stats = shard[(request.method, route)] = RouteStats()
+    stats.requests += 1
+    stats.statuses[response.status_code] = stats.statuses.get(response.status_code, 0) + 1
+    stats.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+    stats.seconds += seconds
+    stats.sql_statements += _local.sql_statements
+    stats.sql_seconds += _local.sql_seconds
+    if response.is_streamed:
+        response.response = _count_stream(response.response, stats, response)
+    else:
+        sent = response.calculate_content_length() or 0
+        stats.response_bytes += sent
+        stats.uncompressed_bytes += getattr(response, "uncompressed_bytes", sent)
+    return response
+
+def _count_stream(chunks, stats, response):
+    """
+    Counts the bytes of a streamed body as it is sent, in the thread that
+    sends it, and adds them to the route's stats when the body ends.
+    """
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+        stats.response_bytes += sent
+        uncompressed = getattr(response, "uncompressed_bytes", None)
+        stats.uncompressed_bytes += uncompressed[0] if uncompressed else sent
+
+def snapshot():
+    """
+    Adds up the shards of all live threads and the totals of the threads
+    that have ended. Returns {(method, route): RouteStats}.
+    """
+    totals = {}
+    with _shards_lock:
+        _fold(totals, _retired)
+        for shard in list(_shards.values()):
+            _fold(totals, shard)
+    return totals
+
+def _labels(**labels):
+    return ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                    for name, value in labels.items())
+
+def render(app):
+    """
+    Renders the metrics in the Prometheus text exposition format.
+    """
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append("# HELP {} {}".format(name, help_text))
+        lines.append("# TYPE {} {}".format(name, kind))
+        for suffix, labels, value in samples:
+            lines.append("{}{}{{{}}} {}".format(name, suffix, labels, value))
+
+    totals = sorted(snapshot().items())
+    metric("hourlogger_requests_total", "counter", "Requests handled, by route and status", [
+        ("", _labels(method=method, route=route, status=status), count)
+        for (method, route), stats in totals for status, count in sorted(stats.statuses.items())
+    ])
+    samples = []
+    for (method, route), stats in totals:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), stats.buckets):
+            cumulative += count
+            samples.append(("_bucket", _labels(method=method, route=route, le=bound), cumulative))
+        samples.append(("_sum", _labels(method=method, route=route), repr(stats.seconds)))
+        samples.append(("_count", _labels(method=method, route=route), stats.requests))
+    metric("hourlogger_request_duration_seconds", "histogram", "Request latency", samples)
+    metric("hourlogger_sql_statements_total", "counter", "SQL statements executed by requests", [
+        ("", _labels(method=method, route=route), stats.sql_statements) for (method, route), stats in totals
+    ])
+    metric("hourlogger_sql_duration_seconds_total", "counter", "Time spent executing SQL statements", [
+        ("", _labels(method=method, route=route), repr(stats.sql_seconds)) for (method, route), stats in totals
+    ])
+    metric("hourlogger_response_bytes_total", "counter", "Response body bytes sent, after compression", [
+        ("", _labels(method=method, route=route), stats.response_bytes) for (method, route), stats in totals
+    ])
+    metric("hourlogger_response_uncompressed_bytes_total", "counter", "Response body bytes before compression", [
+        ("", _labels(method=method, route=route), stats.uncompressed_bytes) for (method, route), stats in totals
+    ])
+    metric("hourlogger_cache_requests_total", "counter", "Response cache lookups by outcome", [
+        ("", _labels(outcome=outcome), count) for outcome, count in sorted(caching.stats.items())
+    ])
+    jobs = app.extensions.get("jobs")
+    if jobs is not None:
+        metric("hourlogger_report_jobs", "gauge", "Report jobs of this process by state", [
+            ("", _labels(state=state), count) for state, count in sorted(jobs.counts().items())
+        ])
+    metric("hourlogger_startup_seconds", "gauge", "Time taken to import and to create the app", [
+        ("", _labels(phase=phase.replace("_seconds", "")), repr(seconds))
+        for phase, seconds in sorted(app.extensions.get("startup_timings", {}).items())
+    ])
+    return "\n".join(lines) + "\n"
+
+def init_metrics(app, db):
+    """
+    Records the latency, SQL statement count and time, and response size of
+    every request by method and route, and serves them at /metrics. Set
+    METRICS_ENABLED to False to leave it out.
+    """
+    if not app.config.get("METRICS_ENABLED", True):
+        return
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    app.before_request(_start_request)
+    app.after_request(_record_request)
+
+    @app.route("/metrics")
+    def send_metrics():
+        return Response(render(app), content_type=PROMETHEUS_TEXT)
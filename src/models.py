@@ -1,21 +1,28 @@
-from flask import Flask
+import hashlib
+import secrets
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import ForeignKeyConstraint
-from datetime import datetime
+from sqlalchemy import ForeignKeyConstraint, event
+from sqlalchemy.dialects.sqlite import insert
+from datetime import datetime, time, timedelta
 
-app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///test.db"
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
-db = SQLAlchemy(app)
+# Bound to an app by create_app in app.py
+db = SQLAlchemy()
 
 
 class User(db.Model):
     username = db.Column(db.String(32), primary_key=True, unique=True, nullable=False)
-    password = db.Column(db.String(32), nullable=False)
+    # scrypt hash of the password, see passwords.py
+    password = db.Column(db.String(255), nullable=False)
+    # Length in seconds of the user's longest log so far, kept up to date
+    # with the daily rollup. It never shrinks, so it stays an upper bound
+    # after deletes, and bounds how far back a log reaching a moment can start
+    longest_log = db.Column(db.Float, nullable=False, default=0, server_default="0")
     
     logs = db.relationship("Log", back_populates="user")
     time_reports = db.relationship("TimeReport", back_populates="user", passive_deletes=True)
+    daily_totals = db.relationship("DailyTotal", back_populates="user", passive_deletes=True)
+    api_keys = db.relationship("ApiKey", back_populates="user", passive_deletes=True)
     
     @staticmethod
     def get_schema():
@@ -51,6 +58,10 @@ class Category(db.Model):
             "description": "name of the category",
             "type": "string"
         }
+        props["description"] = {
+            "description": "Descriptive string for the category, can be null",
+            "type": ["string", "null"]
+        }
         return schema
 
 class Activity(db.Model):
@@ -58,8 +69,15 @@ class Activity(db.Model):
     category_name = db.Column(db.String(32), db.ForeignKey("category.name", ondelete="CASCADE"), primary_key=True, nullable=False)
     description = db.Column(db.String(128), nullable=True)
     
+    __table_args__ = (
+        db.Index("ix_activity_category_name", "category_name"),
+    )
+    
     category = db.relationship("Category", back_populates="activities")
     logs = db.relationship("Log", back_populates="activity")
+    # Folded into the rollup's activity-less rows before the activity goes,
+    # see _fold_daily_totals
+    daily_totals = db.relationship("DailyTotal", back_populates="activity", passive_deletes=True)
     
     @staticmethod
     def get_schema():
@@ -72,9 +90,9 @@ class Activity(db.Model):
             "description": "Name of the activity",
             "type": "string"
         }
-        props["Description"] = {
+        props["description"] = {
             "description": "Descriptive string for the activity, can be null",
-            "type": "string"
+            "type": ["string", "null"]
         }
         return schema
 
@@ -91,7 +109,10 @@ class Log(db.Model):
             ['activity_name', 'activity_category'],
             ['activity.name', 'activity.category_name'],
             ondelete="SET NULL"
-        ), {}
+        ),
+        db.Index("ix_log_user_start", "user_id", "start_time", "rid"),
+        db.Index("ix_log_activity", "activity_category", "activity_name"),
+        {}
     )
     
     user = db.relationship("User", back_populates="logs")
@@ -114,15 +135,17 @@ class Log(db.Model):
         }
         props["start_time"] = {
             "description": "Start time of the activity",
-            "type": "date-time"
+            "type": "string",
+            "format": "date-time"
         }
         props["end_time"] = {
             "description": "End time of the activity",
-            "type": "date-time"
+            "type": "string",
+            "format": "date-time"
         }
         props["comments"] = {
             "description": "Optional comments for the log",
-            "type": "string"
+            "type": ["string", "null"]
         }
         return schema
 
@@ -131,6 +154,9 @@ class TimeReport(db.Model):
     user_id = db.Column(db.String(32), db.ForeignKey("user.username", ondelete="CASCADE"), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
     end_time = db.Column(db.DateTime, nullable=False)
+    __table_args__ = (
+        db.Index("ix_time_report_user_start", "user_id", "start_time", "rid"),
+    )
     
     user = db.relationship("User", back_populates="time_reports")
     
@@ -138,23 +164,251 @@ class TimeReport(db.Model):
     def get_schema():
         schema = {
             "type": "object",
-            "required": ["activity_category", "activity_name", "start_time", "end_time"]
+            "required": ["start_time", "end_time"]
         }
         props = schema["properties"] = {}
         props["start_time"] = {
-            "description": "Start time of the activity",
-            "type": "date-time"
+            "description": "Start of the report window",
+            "type": "string",
+            "format": "date-time"
         }
         props["end_time"] = {
-            "description": "End time of the activity",
-            "type": "date-time"
+            "description": "End of the report window",
+            "type": "string",
+            "format": "date-time"
         }
         return schema
     
+class DailyTotal(db.Model):
+    """
+    Rollup of logged time per user, day and activity. Kept up to date by the
+    Log mapper events below so that reports can sum at most one row per day
+    and activity instead of reading every log in their window.
+    """
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.String(32), db.ForeignKey("user.username", ondelete="CASCADE"), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    activity_category = db.Column(db.String(32), nullable=True)
+    activity_name = db.Column(db.String(32), nullable=True)
+    seconds = db.Column(db.Float, nullable=False, default=0)
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ['activity_name', 'activity_category'],
+            ['activity.name', 'activity.category_name'],
+            ondelete="SET NULL"
+        ),
+        {}
+    )
+    
+    user = db.relationship("User", back_populates="daily_totals")
+    activity = db.relationship("Activity", back_populates="daily_totals")
+
+# The upsert key of the rollup. NULLs never match in a unique index, so the
+# activity columns are coalesced; otherwise the time of logs whose activity
+# has been deleted would get a new row on every change instead of one per
+# day. The '' is a literal so that the conflict target matches the index.
+DAILY_TOTAL_KEY = (
+    DailyTotal.user_id,
+    DailyTotal.day,
+    db.func.coalesce(DailyTotal.activity_category, db.literal_column("''")),
+    db.func.coalesce(DailyTotal.activity_name, db.literal_column("''")),
+)
+db.Index("ix_daily_total_slot", *DAILY_TOTAL_KEY, unique=True)
+
+class ApiKey(db.Model):
+    """
+    API key of a user, or an admin key when admin is set. Only the SHA-256
+    hash of the key is stored; the key itself is shown once, when created.
+    """
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    key = db.Column(db.String(64), unique=True, nullable=False)
+    user_id = db.Column(db.String(32), db.ForeignKey("user.username", ondelete="CASCADE"), nullable=True)
+    admin = db.Column(db.Boolean, nullable=False, default=False)
+    created = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    user = db.relationship("User", back_populates="api_keys")
+
+    @staticmethod
+    def key_hash(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @staticmethod
+    def generate():
+        """Returns a new random key. Keys have 256 bits of entropy, so a plain hash is enough."""
+        return "hl_" + secrets.token_urlsafe(32)
+
+class CacheScope(db.Model):
+    """
+    Version of a response cache scope, see caching.py. Kept in the database
+    and bumped in the transaction of each write, so that every worker
+    process sees a change as soon as it is committed. A scope without a row
+    is at version 0.
+    """
+    scope = db.Column(db.String(128), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+def split_by_day(start_time, end_time):
+    """
+    Splits a time interval at every midnight it crosses. Yields
+    (day, seconds) pairs for each day the interval touches.
+    """
+    current = start_time
+    while current < end_time:
+        next_midnight = datetime.combine(current.date() + timedelta(days=1), time())
+        segment_end = min(end_time, next_midnight)
+        yield current.date(), (segment_end - current).total_seconds()
+        current = segment_end
+
+def apply_to_daily_totals(connection, logs, sign=1):
+    """
+    Adds (sign=1) or removes (sign=-1) the time of the given logs to the
+    daily rollup using the given connection, so the change becomes part of
+    whatever transaction the connection is in. Added logs also raise the
+    longest_log of their user. Logs are mappings or objects with the Log
+    column names.
+    """
+    deltas = {}
+    longest = {}
+    for log in logs:
+        if not isinstance(log, dict):
+            log = {c: getattr(log, c) for c in ("user_id", "activity_category", "activity_name", "start_time", "end_time")}
+        if log["user_id"] is None:
+            continue
+        length = (log["end_time"] - log["start_time"]).total_seconds()
+        longest[log["user_id"]] = max(longest.get(log["user_id"], 0), length)
+        for day, seconds in split_by_day(log["start_time"], log["end_time"]):
+            key = (log["user_id"], day, log["activity_category"], log["activity_name"])
+            deltas[key] = deltas.get(key, 0) + sign * seconds
+    if not deltas:
+        return
+
+    if sign > 0:
+        connection.execute(
+            User.__table__.update()
+            .where(User.username == db.bindparam("b_user"))
+            .values(longest_log=db.func.max(User.longest_log, db.bindparam("b_seconds"))),
+            [{"b_user": user_id, "b_seconds": seconds} for user_id, seconds in longest.items()]
+        )
+    stmt = insert(DailyTotal.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=DAILY_TOTAL_KEY,
+        set_={"seconds": DailyTotal.__table__.c.seconds + stmt.excluded.seconds}
+    )
+    connection.execute(stmt, [
+        {
+            "user_id": user_id,
+            "day": day,
+            "activity_category": category,
+            "activity_name": activity,
+            "seconds": seconds,
+        }
+        for (user_id, day, category, activity), seconds in deltas.items()
+    ])
+    if sign < 0:
+        # Drop rows that no longer hold any time so the rollup stays small
+        connection.execute(
+            DailyTotal.__table__.delete().where(
+                DailyTotal.user_id.in_({key[0] for key in deltas}),
+                DailyTotal.day.in_({key[1] for key in deltas}),
+                db.func.abs(DailyTotal.seconds) < 0.001
+            )
+        )
+
+def rebuild_daily_totals():
+    """
+    Recomputes the whole daily rollup, and the longest_log of every user,
+    from the log table. Used to fill the rollup for databases created before
+    it existed, or after logs have been written around the ORM.
+    """
+    db.session.execute(DailyTotal.__table__.delete())
+    db.session.execute(User.__table__.update().values(longest_log=0))
+    columns = (Log.user_id, Log.activity_category, Log.activity_name, Log.start_time, Log.end_time)
+    result = db.session.execute(
+        db.select(*columns).where(Log.user_id.is_not(None)).execution_options(yield_per=10000)
+    )
+    connection = db.session.connection()
+    for rows in result.partitions():
+        apply_to_daily_totals(connection, [row._asdict() for row in rows])
+    db.session.commit()
+
+def earliest_reaching_start(user_id, moment):
+    """
+    SQL expression for the earliest start_time a log of the user can have
+    and still end after moment: moment minus the user's longest_log. It
+    bounds the start_time range probed on the (user_id, start_time) index.
+    user_id may be a value or a column the expression is correlated with.
+    """
+    longest = db.select(User.longest_log).where(User.username == user_id).scalar_subquery()
+    return db.func.datetime(moment, db.func.printf("-%f seconds", longest))
+
+def find_overlapping_logs():
+    """
+    Finds every log that overlaps an earlier log of the same user in one
+    sweep over the logs sorted by user and start time, which the
+    (user_id, start_time) index provides without a sort. Keeps only the log
+    that ends last so far, since any later log that overlaps an earlier one
+    overlaps that one too. Yields (user_id, rid, overlapped_rid) tuples.
+    """
+    result = db.session.execute(
+        db.select(Log.user_id, Log.rid, Log.start_time, Log.end_time)
+        .where(Log.user_id.is_not(None))
+        .order_by(Log.user_id, Log.start_time, Log.rid)
+        .execution_options(yield_per=10000)
+    )
+    user_id = latest_rid = latest_end = None
+    for row in result:
+        if row.user_id != user_id:
+            user_id, latest_rid, latest_end = row.user_id, row.rid, row.end_time
+            continue
+        if row.start_time < latest_end:
+            yield user_id, row.rid, latest_rid
+        if row.end_time > latest_end:
+            latest_rid, latest_end = row.rid, row.end_time
+
+def _fold_daily_totals(connection, *criteria):
+    """
+    Moves the rollup rows matching criteria into the activity-less rows of
+    their user and day, and deletes them. Run before activities are deleted:
+    the foreign key would set their activity to NULL, which can clash with
+    an activity-less row that already exists for the same day.
+    """
+    table = DailyTotal.__table__
+    stmt = insert(table).from_select(
+        ["user_id", "day", "activity_category", "activity_name", "seconds"],
+        db.select(table.c.user_id, table.c.day, db.null(), db.null(), table.c.seconds).where(*criteria)
+    )
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=DAILY_TOTAL_KEY,
+        set_={"seconds": table.c.seconds + stmt.excluded.seconds}
+    ))
+    connection.execute(table.delete().where(*criteria))
+
+@event.listens_for(Activity, "before_delete")
+def _fold_activity_daily_totals(mapper, connection, target):
+    _fold_daily_totals(
+        connection,
+        DailyTotal.activity_category == target.category_name,
+        DailyTotal.activity_name == target.name,
+    )
+
+@event.listens_for(Category, "before_delete")
+def _fold_category_daily_totals(mapper, connection, target):
+    # The database deletes the activities of the category without the ORM
+    _fold_daily_totals(connection, DailyTotal.activity_category == target.name)
+
+@event.listens_for(Log, "after_insert")
+def _add_log_to_daily_totals(mapper, connection, target):
+    apply_to_daily_totals(connection, [target])
+
+@event.listens_for(Log, "after_delete")
+def _remove_log_from_daily_totals(mapper, connection, target):
+    apply_to_daily_totals(connection, [target], sign=-1)
+
 def populate_db():
     # Populate the database with sample data
-    user1 = User(username="test1", password="password")
-    user2 = User(username="test2", password="anotherpassword")
+    passwords = current_app.extensions["passwords"]
+    user1 = User(username="test1", password=passwords.hash("password"))
+    user2 = User(username="test2", password=passwords.hash("anotherpassword"))
     
     category1 = Category(name="Work", description="Work-related activities")
     category2 = Category(name="Exercise", description="Exercising activities")
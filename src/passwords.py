@@ -0,0 +1,117 @@
+import base64
+import hashlib
+import os
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SCHEME = "scrypt"
+
+
+class HasherBusy(Exception):
+    """
+    Raised when the password hashing pool already has its limit of hashes
+    running or waiting.
+    """
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode()
+
+def _scrypt(password, salt, n, r, p):
+    # scrypt needs about 128 * r * (n + p) bytes; leave headroom over that
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p, dklen=32, maxmem=128 * r * (n + p + 2) + 2 ** 20
+    )
+
+def hash_password(password, n, r, p):
+    """
+    Hashes a password with scrypt and a random salt. The result records the
+    cost parameters, so hashes made with older settings still verify.
+    """
+    salt = os.urandom(16)
+    return "{}${}${}${}${}${}".format(SCHEME, n, r, p, _b64(salt), _b64(_scrypt(password, salt, n, r, p)))
+
+def verify_password(password, stored, n, r, p):
+    """
+    Checks a password against a stored hash. Returns (matches, outdated),
+    where outdated tells that the hash should be replaced by one with the
+    current cost parameters n, r and p. Passwords stored in plain text by
+    older versions still verify and are always outdated.
+    """
+    if not stored.startswith(SCHEME + "$"):
+        return secrets.compare_digest(password.encode(), stored.encode()), True
+    _, stored_n, stored_r, stored_p, salt, expected = stored.split("$")
+    stored_n, stored_r, stored_p = int(stored_n), int(stored_r), int(stored_p)
+    derived = _scrypt(password, base64.b64decode(salt), stored_n, stored_r, stored_p)
+    matches = secrets.compare_digest(derived, base64.b64decode(expected))
+    return matches, (stored_n, stored_r, stored_p) != (n, r, p)
+
+
+class PasswordHasher:
+    """
+    Runs password hashing on a pool of worker threads, so that a burst of
+    signups or logins uses at most that many cores and memory buffers while
+    the request threads stay free to serve everything else. At most limit
+    hashes may be running or waiting; beyond that HasherBusy is raised
+    instead of queueing without bound.
+    """
+
+    def __init__(self, n=2 ** 14, r=8, p=1, workers=2, limit=32):
+        self.n, self.r, self.p = n, r, p
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._dummy = None
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("Too many passwords are being hashed, try again shortly")
+        try:
+            with self._lock:
+                # Created on first use, so a prefork worker starts its own threads
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="hasher")
+                future = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self._run(hash_password, password, self.n, self.r, self.p)
+
+    def verify(self, password, stored):
+        """
+        Returns (matches, outdated), see verify_password. A stored of None,
+        for a user that does not exist, is checked against a dummy hash made
+        with the current cost, so that it takes as long as a real check and
+        the response time does not tell which usernames exist.
+        """
+        if stored is None:
+            self._run(verify_password, password, self._dummy_hash(), self.n, self.r, self.p)
+            return False, False
+        return self._run(verify_password, password, stored, self.n, self.r, self.p)
+
+    def _dummy_hash(self):
+        # Made on first use; two threads racing both make one, which is harmless
+        if self._dummy is None:
+            self._dummy = self._run(hash_password, secrets.token_urlsafe(16), self.n, self.r, self.p)
+        return self._dummy
+
+
+def init_passwords(app):
+    """
+    Sets up the password hasher of the app in app.extensions["passwords"]
+    from the PASSWORD_SCRYPT_* cost parameters and PASSWORD_HASH_WORKERS and
+    PASSWORD_HASH_LIMIT.
+    """
+    app.extensions["passwords"] = PasswordHasher(
+        n=app.config["PASSWORD_SCRYPT_N"],
+        r=app.config["PASSWORD_SCRYPT_R"],
+        p=app.config["PASSWORD_SCRYPT_P"],
+        workers=app.config["PASSWORD_HASH_WORKERS"],
+        limit=app.config["PASSWORD_HASH_LIMIT"],
+    )
@@ -0,0 +1,70 @@
+from functools import lru_cache
+
+from flask import current_app, request, url_for
+from werkzeug.routing.converters import NumberConverter
+
+from constants import *
+
+# Templates are built per endpoint and script root, the only part of a
+# relative URL that url_for can vary between requests
+_url_templates = {}
+
+
+class UrlTemplate:
+    """
+    Precomputed URL of one route. The route is built once with url_for using
+    marker values, and the result is split into its static text and the
+    route variables. Building a URL after that only runs the variables
+    through the route's converters, which gives the same result as url_for
+    without its endpoint lookup and rule matching on every call.
+    """
+
+    def __init__(self, endpoint):
+        rule = next(iter(current_app.url_map.iter_rules(endpoint)))
+        converters = rule._converters
+        markers = {}
+        for index, name in enumerate(sorted(rule.arguments)):
+            if isinstance(converters[name], NumberConverter):
+                markers[name] = 987654321000 + index
+            else:
+                markers[name] = "hlogmarker{}x".format(index)
+        url = url_for(endpoint, **markers)
+
+        self._parts = []
+        for name, marker in sorted(markers.items(), key=lambda m: url.index(str(m[1]))):
+            literal, url = url.split(str(marker), 1)
+            self._parts.append((literal, name, converters[name].to_url))
+        self._tail = url
+
+    def build(self, **values):
+        chunks = []
+        for literal, name, to_url in self._parts:
+            chunks.append(literal)
+            chunks.append(to_url(values[name]))
+        chunks.append(self._tail)
+        return "".join(chunks)
+
+
+def url_template(endpoint):
+    """
+    Returns the UrlTemplate of an endpoint, building it on first use.
+    """
+    key = (endpoint, request.script_root)
+    template = _url_templates.get(key)
+    if template is None:
+        template = _url_templates[key] = UrlTemplate(endpoint)
+    return template
+
+def build_url(endpoint, **values):
+    """
+    Drop-in replacement for url_for for routes whose variables are all given.
+    """
+    return url_template(endpoint).build(**values)
+
+@lru_cache(maxsize=None)
+def static_schema(model):
+    """
+    Returns the JSON schema of a model, built only once per process. The
+    schema dict is shared between responses, so it must not be modified.
+    """
+    return model.get_schema()
@@ -1,35 +1,235 @@
-import json
-from flask import Response, request, url_for
-from flask_restful import Resource, reqparse
-from models import db, TimeReport, User
-from datetime import datetime
-from utils import HourLoggerBuilder, create_error_response
+from flask import current_app, request, url_for
+from flask_restful import Resource
+from sqlalchemy import and_, func, select, union_all
+from models import db, earliest_reaching_start, DailyTotal, Log, TimeReport, User
+from utils import (
+    HourLoggerBuilder, create_compact_response, create_error_response, create_response, wants_compact,
+)
+from caching import cached, invalidate
+from auth import authorize, require_key, require_user
+from jobs import JobCancelled, QueueFull
+from rendering import build_url, url_template
+from validation import ValidationError, validate
 from constants import *
 
+
+def _clipped_seconds(window_start, window_end):
+    """
+    SQL expression for the number of seconds of a log that fall inside the
+    given window. Logs that cross a window edge are clipped to it.
+    """
+    return (
+        func.julianday(func.min(Log.end_time, window_end))
+        - func.julianday(func.max(Log.start_time, window_start))
+    ) * 86400
+
+def _build_totals(rows):
+    """
+    Folds (category, activity, seconds) rows into the totals object returned
+    in report bodies, with per-activity and per-category sums.
+    """
+    categories = {}
+    activities = []
+    total = 0
+    for category, activity, seconds in rows:
+        seconds = int(round(seconds or 0))
+        total += seconds
+        categories[category] = categories.get(category, 0) + seconds
+        activities.append({
+            "category": category,
+            "activity": activity,
+            "seconds": seconds,
+            "hours": round(seconds / 3600, 2),
+        })
+    return {
+        "seconds": total,
+        "hours": round(total / 3600, 2),
+        "categories": [
+            {"category": name, "seconds": seconds, "hours": round(seconds / 3600, 2)}
+            for name, seconds in categories.items()
+        ],
+        "activities": activities,
+    }
+
+def _edge_selects(window_start, window_end):
+    """
+    Select of the logged seconds inside a window that is shorter than a day,
+    negated, with one row per overlapping log. The longest log of the user
+    bounds the start_time range probed on the (user_id, start_time) index.
+    """
+    return select(
+        TimeReport.rid,
+        Log.activity_category,
+        Log.activity_name,
+        (-_clipped_seconds(window_start, window_end)).label("seconds"),
+    ).join_from(
+        TimeReport, Log, and_(
+            Log.user_id == TimeReport.user_id,
+            Log.start_time >= earliest_reaching_start(TimeReport.user_id, window_start),
+            Log.start_time < window_end,
+            Log.end_time > window_start,
+        )
+    )
+
+def report_totals(*criteria):
+    """
+    Computes the totals of the reports matching the given criteria with one
+    grouped query. The daily rollup gives the time of every day the window
+    touches, and the parts of the first and last day that fall outside the
+    window are subtracted using the logs of those two days only. Returns a
+    dict keyed by report rid; reports without any logged time are left out.
+    """
+    first_day_start = func.datetime(func.date(TimeReport.start_time))
+    last_day_end = func.datetime(func.date(TimeReport.end_time), "+1 day")
+    days = select(
+        TimeReport.rid,
+        DailyTotal.activity_category,
+        DailyTotal.activity_name,
+        DailyTotal.seconds,
+    ).join_from(
+        TimeReport, DailyTotal, and_(
+            DailyTotal.user_id == TimeReport.user_id,
+            DailyTotal.day >= func.date(TimeReport.start_time),
+            DailyTotal.day <= func.date(TimeReport.end_time),
+        )
+    )
+    head = _edge_selects(first_day_start, TimeReport.start_time)
+    tail = _edge_selects(TimeReport.end_time, last_day_end)
+    parts = union_all(
+        days.where(*criteria), head.where(*criteria), tail.where(*criteria)
+    ).subquery()
+    seconds = func.sum(parts.c.seconds)
+    stmt = select(
+        parts.c.rid,
+        parts.c.activity_category,
+        parts.c.activity_name,
+        seconds,
+    ).group_by(
+        parts.c.rid, parts.c.activity_category, parts.c.activity_name
+    ).having(
+        seconds >= 0.5
+    ).order_by(
+        parts.c.rid, parts.c.activity_category, parts.c.activity_name
+    )
+    rows = {}
+    for rid, category, activity, seconds in db.session.execute(stmt):
+        rows.setdefault(rid, []).append((category, activity, seconds))
+    return {rid: _build_totals(report_rows) for rid, report_rows in rows.items()}
+
+def _wants_async():
+    """
+    Tells whether the client asked for the report to be computed in the
+    background, with a Prefer: respond-async header or ?async=true.
+    """
+    prefer = request.headers.get("Prefer", "")
+    return "respond-async" in prefer or request.args.get("async") in ("1", "true")
+
+def _run_report_job(job, app, username, start_time, end_time):
+    """
+    Creates a report and computes its totals on a job thread. The report is
+    only committed if the job was not cancelled while the totals were being
+    computed. Returns the rid and the totals of the report.
+    """
+    with app.app_context():
+        try:
+            report = TimeReport(user_id=username, start_time=start_time, end_time=end_time)
+            db.session.add(report)
+            db.session.flush()
+            totals = report_totals(TimeReport.rid == report.rid).get(report.rid) or _build_totals([])
+            if job.cancel_requested:
+                db.session.rollback()
+                raise JobCancelled()
+            invalidate(f"reports:{username}")
+            db.session.commit()
+        except JobCancelled:
+            raise
+        except Exception:
+            db.session.rollback()
+            app.logger.exception("Report job %s failed", job.id)
+            raise
+        return {"rid": report.rid, "totals": totals}
+
+def _job_response(job, status_code=200):
+    """
+    Builds the representation of a report job. A finished job links to its
+    report, also in the Location header.
+    """
+    username, start_time, end_time = job.key
+    body = HourLoggerBuilder()
+    body.add_namespace("hlog", LINK_RELATIONS_URL)
+    body.add_control("self", url_for("reportjobresource", job_id=job.id))
+    body.add_control("profile", JOB_PROFILE)
+    body.add_control("user", url_for("userresource", username=username))
+    body["id"] = job.id
+    body["state"] = job.state
+    body["user_id"] = username
+    body["start_time"] = start_time.isoformat()
+    body["end_time"] = end_time.isoformat()
+    body["created"] = job.created.isoformat()
+    body["finished"] = job.finished.isoformat() if job.finished else None
+    headers = {}
+    if job.active:
+        body.add_control_cancel_job(job.id)
+    if job.state == "done":
+        location = url_for("reportresource", rid=job.result["rid"])
+        body.add_control("hlog:report", location)
+        body["report_id"] = job.result["rid"]
+        body["totals"] = job.result["totals"]
+        headers["Location"] = location
+    elif job.active:
+        headers["Location"] = url_for("reportjobresource", job_id=job.id)
+    if job.error:
+        body["error"] = job.error
+    return create_response(body, status_code, headers=headers)
+
+
+REPORT_COLUMNS = ("id", "user_id", "start_time", "end_time", "totals")
+
+
 class ReportListResource(Resource):
+    @require_user()
+    @cached("reports:{username}", "log-activities")
     def get(self, username):
-        """Retrieve all reports for a specific user."""
+        """Retrieve all reports for a specific user, or ?view=compact for plain rows."""
+        reports = TimeReport.query.filter_by(user_id=username).order_by(
+            TimeReport.start_time, TimeReport.rid
+        ).all()
+        totals = report_totals(TimeReport.user_id == username)
+        if wants_compact():
+            return create_compact_response(
+                url_for("reportlistresource", username=username, view="compact"),
+                REPORT_COLUMNS,
+                [
+                    [report.rid, report.user_id, report.start_time.isoformat(), report.end_time.isoformat(),
+                     totals.get(report.rid) or _build_totals([])]
+                    for report in reports
+                ],
+            )
+
         body = HourLoggerBuilder()
         body.add_namespace("hlog", LINK_RELATIONS_URL)
         body.add_control("self", url_for("reportlistresource", username=username))
         body.add_control_add_report(username)
         body["items"] = []
-        
-        reports = TimeReport.query.filter_by(user_id=username).all()
+        report_url = url_template("reportresource")
+        user_href = build_url("userresource", username=username)
         for report in reports:
-            item = HourLoggerBuilder()
-            item.add_control("self", url_for("reportresource", rid=report.rid))
-            item.add_control("profile", LOG_PROFILE)
-            item.add_control("user", url_for("userresource", username=username))
-            item["id"] = report.rid,
-            item["user_id"] = report.user_id,
-            item["start_time"] = report.start_time.isoformat()
-            item["end_time"] = report.end_time.isoformat()
+            body["items"].append({
+                "@controls": {
+                    "self": {"href": report_url.build(rid=report.rid)},
+                    "profile": {"href": LOG_PROFILE},
+                    "user": {"href": user_href},
+                },
+                "id": report.rid,
+                "user_id": report.user_id,
+                "start_time": report.start_time.isoformat(),
+                "end_time": report.end_time.isoformat(),
+                "totals": totals.get(report.rid) or _build_totals([]),
+            })
             
-            body["items"].append(item)
-            
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        return create_response(body)
 
+    @require_user()
     def post(self, username):
         """Create a new time report for the specified user."""
         if not request.json:
@@ -38,31 +238,42 @@ class ReportListResource(Resource):
                 "Requests must be JSON"
             )
             
-        parser = reqparse.RequestParser()
-        parser.add_argument("start_time", required=True, help="Start time is required")
-        parser.add_argument("end_time", required=True, help="End time is required")
-        data = parser.parse_args()
+        try:
+            data = validate(TimeReport, request.json)
+        except ValidationError as exc:
+            return {"message": exc.errors}, 400
 
         user = User.query.filter_by(username=username).first()
         if not user:
             return {"error": "User not found"}, 404
 
-        try:
-            start_time = datetime.fromisoformat(data["start_time"])
-            end_time = datetime.fromisoformat(data["end_time"])
-        except ValueError:
-            return {"error": "Invalid date format. Use ISO 8601 format (YYYY-MM-DDTHH:MM:SS)"}, 400
-
+        start_time = data["start_time"]
+        end_time = data["end_time"]
         if start_time >= end_time:
             return {"error": "Start time must be before end time"}, 400
 
+        if _wants_async():
+            try:
+                job, created = current_app.extensions["jobs"].submit(
+                    (username, start_time, end_time), _run_report_job,
+                    current_app._get_current_object(), username, start_time, end_time
+                )
+            except QueueFull as exc:
+                response = create_error_response(503, "Too many report jobs", str(exc))
+                response.headers["Retry-After"] = "5"
+                return response
+            return _job_response(job, 202)
+
         report = TimeReport(user_id=username, start_time=start_time, end_time=end_time)
         db.session.add(report)
+        invalidate(f"reports:{username}")
         db.session.commit()
         return {"message": "Report created successfully"}, 201
 
 
 class ReportResource(Resource):
+    @require_user(TimeReport)
+    @cached("report:{rid}", "log-activities")
     def get(self, rid):
         """Retrieve a specific report."""
         report = TimeReport.query.get(rid)
@@ -77,13 +288,15 @@ class ReportResource(Resource):
         body.add_control("user", url_for("userresource", username=report.user_id))
         body.add_control_delete_report(rid)
         
-        body["id"] = report.rid,
-        body["user_id"] = report.user_id,
+        body["id"] = report.rid
+        body["user_id"] = report.user_id
         body["start_time"] = report.start_time.isoformat()
         body["end_time"] = report.end_time.isoformat()
+        body["totals"] = report_totals(TimeReport.rid == rid).get(rid) or _build_totals([])
         
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        return create_response(body)
 
+    @require_user(TimeReport)
     def delete(self, rid):
         """Delete a report."""
         report = TimeReport.query.get(rid)
@@ -91,5 +304,30 @@ class ReportResource(Resource):
             return {"error": "Report not found"}, 404
 
         db.session.delete(report)
+        invalidate(f"reports:{report.user_id}", f"report:{rid}")
         db.session.commit()
         return {"message": "Report deleted"}, 200
+
+
+class ReportJobResource(Resource):
+    @require_key
+    def get(self, job_id):
+        """Poll a report job."""
+        job = current_app.extensions["jobs"].get(job_id)
+        if job is None:
+            return {"error": "Job not found"}, 404
+        authorize(job.key[0])
+        return _job_response(job)
+
+    @require_key
+    def delete(self, job_id):
+        """Cancel a report job that has not finished yet."""
+        jobs = current_app.extensions["jobs"]
+        job = jobs.get(job_id)
+        if job is None:
+            return {"error": "Job not found"}, 404
+        authorize(job.key[0])
+        jobs.cancel(job_id)
+        if not job.active and job.state != "cancelled":
+            return {"error": "Job has already finished"}, 409
+        return _job_response(job, 200 if job.state == "cancelled" else 202)
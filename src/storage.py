@@ -0,0 +1,104 @@
+import os
+import weakref
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# Storage profile of the API process. busy_timeout comes first so that the
+# switch to WAL, which needs a lock, waits for other connections instead of
+# failing. journal_mode and the pragmas after it only make sense for a file
+# database; an in-memory database silently keeps its "memory" journal.
+DEFAULT_SQLITE_PRAGMAS = {
+    "busy_timeout": 5000,
+    "foreign_keys": "ON",
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+}
+
+# Engines of the apps in this process, so a forked worker can drop the
+# connections it inherited from its parent
+_engines = weakref.WeakSet()
+
+
+def _dispose_inherited_pools():
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_dispose_inherited_pools)
+
+
+def engine_options(config):
+    """
+    Returns the SQLALCHEMY_ENGINE_OPTIONS of an app with the pool settings
+    of its worker process (DB_POOL_SIZE, DB_MAX_OVERFLOW and DB_POOL_TIMEOUT)
+    filled in. Options set explicitly win. An in-memory SQLite database
+    lives in a single static connection, which takes no pool settings.
+    """
+    options = dict(config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options
+    options.setdefault("pool_size", config["DB_POOL_SIZE"])
+    options.setdefault("max_overflow", config["DB_MAX_OVERFLOW"])
+    options.setdefault("pool_timeout", config["DB_POOL_TIMEOUT"])
+    return options
+
+def apply_pragmas(dbapi_connection, pragmas):
+    """
+    Runs PRAGMA name=value for every item of pragmas on a new DB-API
+    connection.
+    """
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute("PRAGMA {}={}".format(name, value))
+    cursor.close()
+
+def read_pragmas(dbapi_connection, names):
+    """
+    Returns the values SQLite actually uses for the given pragmas, which can
+    differ from the requested ones (e.g. journal_mode of a memory database).
+    """
+    cursor = dbapi_connection.cursor()
+    values = {}
+    for name in names:
+        row = cursor.execute("PRAGMA {}".format(name)).fetchone()
+        values[name] = row[0] if row else None
+    cursor.close()
+    return values
+
+def init_storage(app, db):
+    """
+    Applies the SQLITE_PRAGMAS profile of the app config to every connection
+    the app's engine opens. Pragmas are per connection in SQLite, so they
+    are set in a connect listener rather than once. The values SQLite
+    actually applied are logged when the first connection is opened; set
+    SQLITE_PRAGMAS to {} to use SQLite's defaults.
+
+    The engine only connects when it is first used, and a worker forked from
+    the process that created it discards the inherited pool, so prefork
+    workers never share connections.
+    """
+    pragmas = dict(app.config.get("SQLITE_PRAGMAS", DEFAULT_SQLITE_PRAGMAS))
+    with app.app_context():
+        engine = db.engine
+    _engines.add(engine)
+    if engine.dialect.name != "sqlite":
+        return
+
+    logged = []
+
+    @event.listens_for(engine, "connect")
+    def set_storage_profile(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, pragmas)
+        if not logged:
+            logged.append(True)
+            values = read_pragmas(dbapi_connection, pragmas)
+            app.logger.info(
+                "SQLite storage profile for %s: %s",
+                engine.url.database,
+                ", ".join("{}={}".format(name, value) for name, value in values.items()) or "defaults",
+            )
@@ -1,5 +1,136 @@
 import sys
 import os
+import re
+import threading
+import pytest
 
 # Get the absolute path of the `src/` directory
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+@pytest.fixture(scope="session")
+def app():
+    """
+    The API app on a temporary in-memory database. API keys are only
+    required by the tests in test_auth.py, which turn them on, and passwords
+    are hashed with a low scrypt cost to keep the tests fast.
+    """
+    from app import create_app
+    return create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+        "API_KEYS_REQUIRED": False,
+        "PASSWORD_SCRYPT_N": 2 ** 10,
+    })
+
+@pytest.fixture(autouse=True)
+def clear_response_cache(app):
+    """ Empties the response cache so that no test sees responses cached by another """
+    from caching import cache
+    with app.app_context():
+        cache.clear()
+
+@pytest.fixture
+def sample():
+    """ Returns a function that reads the value of one sample in a Prometheus text body """
+    def read(text, name, **labels):
+        wanted = ",".join('{}="{}"'.format(key, value) for key, value in labels.items())
+        match = re.search(r"^{}\{{{}\}} (\S+)$".format(re.escape(name), re.escape(wanted)), text, re.M)
+        return float(match.group(1)) if match else 0.0
+    return read
+
+
+class QueryCounter:
+    """
+    Counts the SQL statements each request of an app runs. While active, the
+    requests list holds a (method, route, statements) tuple per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.requests = []
+        self._local = threading.local()
+
+    def _statement(self, *args):
+        if getattr(self._local, "count", None) is not None:
+            self._local.count += 1
+
+    def _started(self, sender, **extra):
+        self._local.count = 0
+
+    def _finished(self, sender, response, **extra):
+        from flask import request
+        route = request.url_rule.rule if request.url_rule is not None else None
+        self.requests.append((request.method, route, self._local.count))
+        self._local.count = None
+
+    def __enter__(self):
+        from flask import request_finished, request_started
+        from sqlalchemy import event
+        from models import db
+        with self.app.app_context():
+            self._engine = db.engine
+        event.listen(self._engine, "before_cursor_execute", self._statement)
+        request_started.connect(self._started, self.app)
+        request_finished.connect(self._finished, self.app)
+        return self
+
+    def __exit__(self, *exc_info):
+        from flask import request_finished, request_started
+        from sqlalchemy import event
+        event.remove(self._engine, "before_cursor_execute", self._statement)
+        request_started.disconnect(self._started, self.app)
+        request_finished.disconnect(self._finished, self.app)
+
+# Most SQL statements a request to each route may run. Budgets are fixed
+# numbers, so a list that starts running a query per item blows its budget
+# in any test that lists more than a few items. Cached GETs read the versions
+# of their cache scopes and writes bump them, one statement each, so even a
+# cache hit runs one. Streamed exports query after the request has finished
+# and are not counted. With API keys on, a key that is not in the verified
+# key cache, or an id that does not exist, costs one more lookup.
+QUERY_BUDGETS = {
+    ("GET", "/categories/"): 2,
+    ("POST", "/categories/"): 2,
+    ("GET", "/categories/<string:name>"): 2,
+    ("PUT", "/categories/<string:name>"): 3,
+    ("DELETE", "/categories/<string:name>"): 5,
+    ("GET", "/categories/<string:category>/activities/"): 2,
+    ("POST", "/categories/<string:category>/activities/"): 5,
+    ("GET", "/categories/<string:category>/activities/<string:name>"): 2,
+    ("PUT", "/categories/<string:category>/activities/<string:name>"): 3,
+    ("DELETE", "/categories/<string:category>/activities/<string:name>"): 7,
+    ("GET", "/users/"): 2,
+    ("POST", "/users/"): 3,
+    ("GET", "/users/<string:username>"): 2,
+    ("PUT", "/users/<string:username>"): 3,
+    ("DELETE", "/users/<string:username>"): 7,
+    ("GET", "/users/<string:username>/logs/"): 2,
+    ("POST", "/users/<string:username>/logs/"): 9,
+    ("GET", "/logs/<int:rid>"): 2,
+    ("DELETE", "/logs/<int:rid>"): 6,
+    ("GET", "/users/<string:username>/reports/"): 3,
+    ("POST", "/users/<string:username>/reports/"): 3,
+    ("GET", "/reports/<int:rid>"): 3,
+    ("DELETE", "/reports/<int:rid>"): 3,
+    ("GET", "/users/<string:username>/analytics/"): 3,
+    ("GET", "/users/<string:username>/keys/"): 1,
+    ("POST", "/users/<string:username>/keys/"): 3,
+    ("DELETE", "/keys/<int:kid>"): 2,
+    ("GET", "/jobs/<string:job_id>"): 0,
+    ("DELETE", "/jobs/<string:job_id>"): 0,
+}
+
+@pytest.fixture(autouse=True)
+def query_counter(app):
+    """
+    Counts the SQL statements of every request a test makes and fails the
+    test if any request ran more than the budget of its route.
+    """
+    with QueryCounter(app) as counter:
+        yield counter
+    over = [
+        "{} {} ran {} statements, budget {}".format(method, route, count, QUERY_BUDGETS[(method, route)])
+        for method, route, count in counter.requests
+        if (method, route) in QUERY_BUDGETS and count > QUERY_BUDGETS[(method, route)]
+    ]
+    assert not over, "Query budget exceeded: " + "; ".join(over)
@@ -0,0 +1,138 @@
+import random
+import pytest
+import analytics
+from datetime import datetime
+from models import db, Activity, Category, Log, User
+
+@pytest.fixture
+def client(app):
+    """ Sets up a test client and a temporary in-memory database """
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username="test_user", password="1234"))
+        db.session.add(Category(name="Work", description="Work stuff"))
+        db.session.add(Category(name="Free", description="Free time"))
+        db.session.add(Activity(name="Coding", category_name="Work"))
+        db.session.add(Activity(name="Gym", category_name="Free"))
+        db.session.commit()
+    yield app.test_client()
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def restore_engine():
+    yield
+    analytics.set_engine("auto")
+
+def _add_log(category, activity, start_time, end_time):
+    db.session.add(Log(
+        user_id="test_user",
+        activity_category=category,
+        activity_name=activity,
+        start_time=datetime.fromisoformat(start_time),
+        end_time=datetime.fromisoformat(end_time)
+    ))
+
+def _intervals(count, seed=1):
+    rng = random.Random(seed)
+    starts = [rng.randrange(1_700_000_000, 1_720_000_000) for _ in range(count)]
+    ends = [start + rng.randrange(1, 24 * 3600) for start in starts]
+    categories = [rng.choice(["Work", "Free", "Study"]) for _ in range(count)]
+    return starts, ends, categories
+
+@pytest.mark.parametrize("name", sorted(analytics.ENGINES))
+def test_engines_agree(name, restore_engine):
+    """ Tests that every available engine buckets random intervals like the reference """
+    starts, ends, categories = _intervals(500)
+    lo, hi = 1_705_000_000, 1_715_000_000
+    analytics.set_engine(name)
+    result = analytics.time_use(starts, ends, categories, lo, hi)
+    assert result == analytics._python_time_use(starts, ends, categories, lo, hi)
+    heatmap, names, trends = result
+    assert names == ["Free", "Study", "Work"]
+    assert len(trends[0]) == analytics.week_count(lo, hi)
+    assert sum(map(sum, heatmap)) == sum(map(sum, trends)) == sum(
+        max(0, min(end, hi) - max(start, lo)) for start, end in zip(starts, ends)
+    )
+
+@pytest.mark.parametrize("name", sorted(analytics.ENGINES))
+def test_engines_empty(name, restore_engine):
+    """ Tests that an empty window gives zero matrices """
+    analytics.set_engine(name)
+    heatmap, names, trends = analytics.time_use([], [], [], 0, 0)
+    assert heatmap == [[0] * 24 for _ in range(7)]
+    assert names == [] and trends == []
+
+@pytest.mark.parametrize("name", sorted(analytics.ENGINES))
+def test_engines_missing_category(name, restore_engine):
+    """ Tests that intervals without a category are counted as uncategorized """
+    analytics.set_engine(name)
+    heatmap, names, trends = analytics.time_use([0, 3600], [3600, 7200], ["Work", None], 0, 7200)
+    assert names == ["Work", analytics.UNCATEGORIZED]
+    assert trends == [[3600], [3600]]
+
+def test_unknown_engine(restore_engine):
+    """ Tests that asking for an engine that is not available fails loudly """
+    with pytest.raises(ValueError):
+        analytics.set_engine("does-not-exist")
+
+def test_analytics(app, client):
+    """ Tests the heatmap and weekly trends of a user, with a log crossing midnight and a week """
+    with app.app_context():
+        # Wednesday
+        _add_log("Work", "Coding", "2024-04-10T09:30:00", "2024-04-10T11:00:00")
+        # Sunday night into Monday of the next week
+        _add_log("Free", "Gym", "2024-04-14T23:00:00", "2024-04-15T01:00:00")
+        db.session.commit()
+    response = client.get("/users/test_user/analytics/")
+    assert response.status_code == 200
+    body = response.json
+    heatmap = body["heatmap"]["seconds"]
+    assert heatmap[2][9] == 1800 and heatmap[2][10] == 3600
+    assert heatmap[6][23] == 3600 and heatmap[0][0] == 3600
+    assert sum(map(sum, heatmap)) == 5400 + 7200
+    trends = body["trends"]
+    assert trends["weeks"] == ["2024-04-08", "2024-04-15"]
+    assert trends["categories"] == ["Free", "Work"]
+    assert trends["seconds"] == [[3600, 3600], [5400, 0]]
+    assert trends["total"] == [9000, 3600]
+    assert trends["change"] == [0, -5400]
+
+def test_analytics_deleted_activity(app, client):
+    """ Tests that logs whose activity was deleted show up as uncategorized """
+    with app.app_context():
+        _add_log("Work", "Coding", "2024-04-10T09:30:00", "2024-04-10T11:00:00")
+        _add_log("Free", "Gym", "2024-04-11T09:00:00", "2024-04-11T10:00:00")
+        db.session.commit()
+        db.session.delete(db.session.get(Activity, ("Gym", "Free")))
+        db.session.commit()
+        assert Log.query.filter(Log.activity_category.is_(None)).count() == 1
+    response = client.get("/users/test_user/analytics/")
+    assert response.status_code == 200
+    trends = response.json["trends"]
+    assert trends["categories"] == ["Work", "uncategorized"]
+    assert trends["seconds"] == [[5400], [3600]]
+
+def test_analytics_window(app, client):
+    """ Tests that the from, to and category parameters clip and select the logs """
+    with app.app_context():
+        _add_log("Work", "Coding", "2024-04-10T09:30:00", "2024-04-10T11:00:00")
+        _add_log("Free", "Gym", "2024-04-14T23:00:00", "2024-04-15T01:00:00")
+        db.session.commit()
+    body = client.get("/users/test_user/analytics/?from=2024-04-10T10:00:00&to=2024-04-15T00:00:00").json
+    assert body["trends"]["weeks"] == ["2024-04-08"]
+    assert body["trends"]["total"] == [2 * 3600]
+    body = client.get("/users/test_user/analytics/?category=Work").json
+    assert body["trends"]["categories"] == ["Work"]
+    assert sum(map(sum, body["heatmap"]["seconds"])) == 5400
+
+def test_analytics_errors(client):
+    """ Tests bad windows, unknown users and a user without logs """
+    assert client.get("/users/test_user/analytics/?from=yesterday").status_code == 400
+    assert client.get("/users/test_user/analytics/?from=2024-04-10T00:00:00+02:00").status_code == 400
+    assert client.get("/users/test_user/analytics/?from=2024-04-11&to=2024-04-10").status_code == 400
+    assert client.get("/users/nobody/analytics/").status_code == 404
+    body = client.get("/users/test_user/analytics/").json
+    assert body["trends"]["weeks"] == []
+    assert sum(map(sum, body["heatmap"]["seconds"])) == 0
@@ -0,0 +1,141 @@
+import pytest
+from auth import KeyCache, authenticate
+from models import db, ApiKey, Log, User
+from constants import API_KEY_HEADER
+from datetime import datetime
+
+@pytest.fixture
+def client(app, monkeypatch):
+    """ Sets up a test client with API keys required and two users """
+    monkeypatch.setitem(app.config, "API_KEYS_REQUIRED", True)
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username="alice", password="secret-a"))
+        db.session.add(User(username="bob", password="secret-b"))
+        db.session.commit()
+    app.extensions["api_keys"].clear()
+    yield app.test_client()
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+    app.extensions["api_keys"].clear()
+
+def _key(client, username, password):
+    response = client.post(f"/users/{username}/keys/", json={"password": password})
+    assert response.status_code == 201
+    return response.json
+
+def _admin_key(app):
+    """ Stores an admin key and verifies it once, as its first request would """
+    key = ApiKey.generate()
+    with app.app_context():
+        db.session.add(ApiKey(key=ApiKey.key_hash(key), admin=True))
+        db.session.commit()
+    with app.test_request_context(headers={API_KEY_HEADER: key}):
+        assert authenticate() == (None, True)
+    return {API_KEY_HEADER: key}
+
+def test_key_required(client):
+    """ Tests that protected resources refuse requests without a valid key """
+    assert client.get("/users/alice").status_code == 401
+    assert client.get("/categories/").status_code == 401
+    assert client.get("/users/alice", headers={API_KEY_HEADER: "hl_wrong"}).status_code == 403
+    # Signing up needs no key
+    assert client.post("/users/", json={"username": "carol", "password": "pw"}).status_code == 201
+
+def test_user_key(client):
+    """ Tests that a user key opens the user's own resources only """
+    created = _key(client, "alice", "secret-a")
+    assert created["key"].startswith("hl_")
+    headers = {API_KEY_HEADER: created["key"]}
+    assert client.get("/users/alice", headers=headers).status_code == 200
+    assert client.get("/users/alice/logs/", headers=headers).status_code == 200
+    assert client.get("/categories/", headers=headers).status_code == 200
+    assert client.get("/users/bob", headers=headers).status_code == 403
+    assert client.get("/users/bob/reports/", headers=headers).status_code == 403
+    assert client.get("/users/", headers=headers).status_code == 403
+    assert client.post("/categories/", json={"name": "Work"}, headers=headers).status_code == 403
+    # The stored key is a hash, not the key itself
+    items = client.get("/users/alice/keys/", headers=headers).json["items"]
+    assert [item["id"] for item in items] == [created["id"]]
+    assert "key" not in items[0]
+
+def test_key_wrong_password(client):
+    """ Tests that keys are only handed out for the right password """
+    assert client.post("/users/alice/keys/", json={"password": "secret-b"}).status_code == 401
+    assert client.post("/users/nobody/keys/", json={"password": "x"}).status_code == 401
+    assert client.post("/users/alice/keys/").status_code == 401
+
+def test_owner_of_log(app, client):
+    """ Tests that logs addressed by id need the key of their owner """
+    with app.app_context():
+        log = Log(user_id="bob", start_time=datetime(2024, 4, 10, 8), end_time=datetime(2024, 4, 10, 9))
+        db.session.add(log)
+        db.session.commit()
+        rid = log.rid
+    alice = {API_KEY_HEADER: _key(client, "alice", "secret-a")["key"]}
+    bob = {API_KEY_HEADER: _key(client, "bob", "secret-b")["key"]}
+    assert client.get(f"/logs/{rid}", headers=alice).status_code == 403
+    assert client.delete(f"/logs/{rid}", headers=alice).status_code == 403
+    assert client.delete(f"/logs/{rid}", headers=bob).status_code == 200
+    assert client.delete("/logs/999", headers=alice).status_code == 404
+    assert client.delete("/logs/999").status_code == 401
+
+def test_admin_key(app, client):
+    """ Tests that an admin key opens every resource """
+    headers = _admin_key(app)
+    assert client.get("/users/", headers=headers).status_code == 200
+    assert client.get("/users/bob", headers=headers).status_code == 200
+    assert client.post("/categories/", json={"name": "Work"}, headers=headers).status_code == 201
+
+def test_revoke_key(client):
+    """ Tests that a revoked key stops working at once, although it was cached """
+    created = _key(client, "alice", "secret-a")
+    headers = {API_KEY_HEADER: created["key"]}
+    other = {API_KEY_HEADER: _key(client, "bob", "secret-b")["key"]}
+    assert client.delete(f"/keys/{created['id']}", headers=other).status_code == 403
+    assert client.get("/users/alice", headers=headers).status_code == 200
+    assert client.delete(f"/keys/{created['id']}", headers=headers).status_code == 200
+    assert client.get("/users/alice", headers=headers).status_code == 403
+
+def test_delete_user_revokes_keys(client):
+    """ Tests that deleting a user deletes its keys """
+    headers = {API_KEY_HEADER: _key(client, "alice", "secret-a")["key"]}
+    assert client.delete("/users/alice", headers=headers).status_code == 200
+    assert client.get("/users/alice", headers=headers).status_code == 403
+
+def test_verified_key_cache(app, client):
+    """ Tests that a verified key is looked up in the database once """
+    key = _key(client, "alice", "secret-a")["key"]
+    app.extensions["api_keys"].clear()
+    statements = []
+    from sqlalchemy import event
+    with app.app_context():
+        engine = db.engine
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        for _ in range(3):
+            with app.test_request_context(headers={API_KEY_HEADER: key}):
+                assert authenticate() == ("alice", False)
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert len(statements) == 1
+
+def test_key_cache_bounds(monkeypatch):
+    """ Tests that the key cache evicts the least recently used key and expires keys """
+    import auth
+    now = [1000.0]
+    monkeypatch.setattr(auth, "monotonic", lambda: now[0])
+    keys = KeyCache(size=2, ttl=60)
+    keys.put("a", "alice", False)
+    keys.put("b", "bob", False)
+    assert keys.get("a") == ("alice", False)
+    keys.put("c", None, True)
+    assert keys.get("b") is None
+    assert keys.get("a") == ("alice", False)
+    now[0] += 61
+    assert keys.get("a") is None
+    keys.put("d", "alice", False)
+    keys.discard_user("alice")
+    assert keys.get("d") is None
@@ -0,0 +1,162 @@
+import pytest
+from models import db, User, Category, Activity
+from app import create_app
+from caching import LRUCache, stats
+
+@pytest.fixture
+def workers(tmp_path):
+    """ Two apps on one database file, each with its own response cache, like two worker processes """
+    config = {
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(tmp_path / "workers.db"),
+        "API_KEYS_REQUIRED": False,
+    }
+    apps = [create_app(config), create_app(config)]
+    with apps[0].app_context():
+        db.create_all()
+        db.session.add(User(username="test_user", password="1234"))
+        db.session.add(Category(name="Exercise", description="Workout activities"))
+        db.session.add(Activity(name="Yoga", category_name="Exercise", description="Morning yoga"))
+        db.session.commit()
+    return [app.test_client() for app in apps]
+
+@pytest.fixture
+def client(app):
+    """ Sets up a test client and a temporary in-memory database """
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username="test_user", password="1234"))
+        db.session.add(Category(name="Exercise", description="Workout activities"))
+        db.session.add(Activity(name="Yoga", category_name="Exercise", description="Morning yoga"))
+        db.session.commit()
+    yield app.test_client()
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+def _post_log(client, start_time, end_time):
+    return client.post("/users/test_user/logs/", json={
+        "activity_category": "Exercise",
+        "activity_name": "Yoga",
+        "start_time": start_time,
+        "end_time": end_time
+    })
+
+def test_lru_evicts_least_recently_used():
+    """ Tests that the LRU backend drops the entry that was used longest ago """
+    lru = LRUCache(threshold=2)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+    assert lru.get("b") is None
+    assert lru.get("a") == 1
+    assert lru.get("c") == 3
+
+def test_repeated_get_is_cache_hit(client):
+    """ Tests that an unchanged collection is served from the cache """
+    hits = stats["hits"]
+    first = client.get("/categories/")
+    second = client.get("/categories/")
+    assert stats["hits"] == hits + 1
+    assert first.data == second.data
+    assert second.mimetype == first.mimetype
+
+def test_query_string_is_part_of_key(client):
+    """ Tests that different pages of the same collection are cached separately """
+    _post_log(client, "2024-02-10T08:00:00", "2024-02-10T09:00:00")
+    _post_log(client, "2024-02-11T08:00:00", "2024-02-11T09:00:00")
+    first = client.get("/users/test_user/logs/?limit=1")
+    second = client.get(first.json["@controls"]["next"]["href"])
+    assert first.json["items"] != second.json["items"]
+
+def test_new_log_invalidates_lists_and_overlapping_reports(client):
+    """ Tests that creating a log evicts the log list and the reports it overlaps, but nothing else """
+    client.post("/users/test_user/reports/", json={
+        "start_time": "2024-02-10T00:00:00",
+        "end_time": "2024-02-11T00:00:00"
+    })
+    client.post("/users/test_user/reports/", json={
+        "start_time": "2024-03-10T00:00:00",
+        "end_time": "2024-03-11T00:00:00"
+    })
+    reports = client.get("/users/test_user/reports/").json["items"]
+    overlapping, other = [item["@controls"]["self"]["href"] for item in reports]
+    assert client.get("/users/test_user/logs/").json["items"] == []
+    assert client.get(overlapping).json["totals"]["seconds"] == 0
+    client.get(other)
+
+    _post_log(client, "2024-02-10T08:00:00", "2024-02-10T09:00:00")
+    assert len(client.get("/users/test_user/logs/").json["items"]) == 1
+    assert client.get(overlapping).json["totals"]["seconds"] == 3600
+    assert client.get("/users/test_user/reports/").json["items"][0]["totals"]["seconds"] == 3600
+    hits = stats["hits"]
+    client.get(other)
+    assert stats["hits"] == hits + 1
+
+def test_delete_invalidates_item(client):
+    """ Tests that a deleted user is not served from the cache """
+    assert client.get("/users/test_user").status_code == 200
+    client.delete("/users/test_user")
+    assert client.get("/users/test_user").status_code == 404
+    assert client.get("/users/").json["items"] == []
+
+def test_conditional_get(client):
+    """ Tests that a matching If-None-Match gets 304 until the collection changes """
+    response = client.get("/users/test_user/logs/")
+    etag = response.headers["ETag"]
+    assert etag
+
+    response = client.get("/users/test_user/logs/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+
+    _post_log(client, "2024-02-10T08:00:00", "2024-02-10T09:00:00")
+    response = client.get("/users/test_user/logs/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(response.json["items"]) == 1
+
+def test_etag_on_every_resource(client):
+    """ Tests that every GET resource answers a conditional request with 304 """
+    _post_log(client, "2024-02-10T08:00:00", "2024-02-10T09:00:00")
+    client.post("/users/test_user/reports/", json={
+        "start_time": "2024-02-10T00:00:00",
+        "end_time": "2024-02-11T00:00:00"
+    })
+    log_href = client.get("/users/test_user/logs/").json["items"][0]["@controls"]["self"]["href"]
+    report_href = client.get("/users/test_user/reports/").json["items"][0]["@controls"]["self"]["href"]
+    for href in [
+        "/categories/", "/categories/Exercise",
+        "/categories/Exercise/activities/", "/categories/Exercise/activities/Yoga",
+        "/users/", "/users/test_user",
+        "/users/test_user/logs/", log_href,
+        "/users/test_user/reports/", report_href,
+    ]:
+        etag = client.get(href).headers["ETag"]
+        response = client.get(href, headers={"If-None-Match": etag})
+        assert response.status_code == 304, href
+
+def test_etag_shared_between_workers(workers):
+    """ Tests that a write through one worker changes the ETag another worker checks against """
+    first, second = workers
+    etag = second.get("/users/test_user/logs/").headers["ETag"]
+    assert second.get("/users/test_user/logs/", headers={"If-None-Match": etag}).status_code == 304
+
+    assert _post_log(first, "2024-02-10T08:00:00", "2024-02-10T09:00:00").status_code == 201
+    response = second.get("/users/test_user/logs/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(response.json["items"]) == 1
+
+def test_cached_body_shared_between_workers(workers):
+    """ Tests that a worker does not serve a body it cached before another worker changed the data """
+    first, second = workers
+    assert second.get("/users/test_user/logs/").json["items"] == []
+    hits = stats["hits"]
+    assert second.get("/users/test_user/logs/").json["items"] == []
+    assert stats["hits"] == hits + 1
+
+    _post_log(first, "2024-02-10T08:00:00", "2024-02-10T09:00:00")
+    assert len(second.get("/users/test_user/logs/").json["items"]) == 1
@@ -1,12 +1,9 @@
 import pytest
 from models import db, Category
-from app import app
 
 @pytest.fixture
-def client():
+def client(app):
     """ Sets up a test client and a temporary in-memory database """
-    app.config["TESTING"] = True
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
     with app.app_context():
         db.create_all()
     yield app.test_client()
@@ -0,0 +1,114 @@
+import gzip
+import json
+import zlib
+import pytest
+from models import db, User, Activity, Category
+
+LOGS = "/users/test_user/logs/"
+
+@pytest.fixture
+def client(app):
+    """ Sets up a test client and a temporary in-memory database """
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username="test_user", password="1234"))
+        db.session.add(Category(name="Exercise", description="Workout activities"))
+        db.session.add(Activity(name="Yoga", category_name="Exercise", description="Morning yoga"))
+        db.session.commit()
+    yield app.test_client()
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+def _add_logs(client, count):
+    response = client.post(LOGS, json=[{
+        "activity_category": "Exercise",
+        "activity_name": "Yoga",
+        "start_time": f"2024-03-{10 + i}T08:00:00",
+        "end_time": f"2024-03-{10 + i}T09:30:00"
+    } for i in range(count)])
+    assert response.status_code == 201
+
+def test_gzip_response(client):
+    """ Tests that a large Mason body is gzipped when the client accepts it """
+    _add_logs(client, 10)
+    plain = client.get(LOGS)
+    assert "Content-Encoding" not in plain.headers
+    assert len(plain.data) >= 1024
+
+    response = client.get(LOGS, headers={"Accept-Encoding": "gzip, deflate"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert len(response.data) < len(plain.data)
+    assert json.loads(gzip.decompress(response.data)) == plain.json
+
+def test_deflate_response(client):
+    """ Tests that deflate is used when it is the only coding accepted """
+    _add_logs(client, 10)
+    plain = client.get(LOGS)
+    response = client.get(LOGS, headers={"Accept-Encoding": "deflate"})
+    assert response.headers["Content-Encoding"] == "deflate"
+    assert json.loads(zlib.decompress(response.data)) == plain.json
+
+    response = client.get(LOGS, headers={"Accept-Encoding": "br"})
+    assert "Content-Encoding" not in response.headers
+
+def test_small_response_not_compressed(client):
+    """ Tests that bodies below COMPRESS_MIN_SIZE are sent as they are """
+    response = client.get("/users/test_user", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert len(response.data) < 1024
+    assert "Content-Encoding" not in response.headers
+    assert response.json["username"] == "test_user"
+
+def test_streamed_export_compressed(client):
+    """ Tests that an NDJSON export is compressed while it is streamed """
+    _add_logs(client, 3)
+    response = client.get(LOGS, headers={"Accept": "application/x-ndjson", "Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.headers["Content-Encoding"] == "gzip"
+    rows = [json.loads(line) for line in gzip.decompress(response.data).decode().splitlines()]
+    assert len(rows) == 3
+
+def test_compressed_etag(client):
+    """ Tests that a compressed response has a weak ETag that still gets 304 """
+    _add_logs(client, 10)
+    response = client.get(LOGS, headers={"Accept-Encoding": "gzip"})
+    etag = response.headers["ETag"]
+    assert etag.startswith("W/")
+    response = client.get(LOGS, headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 304
+
+def test_compression_metrics(client, sample):
+    """ Tests that the metrics record both the sent and the uncompressed sizes """
+    _add_logs(client, 10)
+    route = "/users/<string:username>/logs/"
+    before = client.get("/metrics").get_data(as_text=True)
+    plain = client.get(LOGS)
+    response = client.get(LOGS, headers={"Accept-Encoding": "gzip"})
+    after = client.get("/metrics").get_data(as_text=True)
+
+    sent = sample(after, "hourlogger_response_bytes_total", method="GET", route=route) - \
+        sample(before, "hourlogger_response_bytes_total", method="GET", route=route)
+    uncompressed = sample(after, "hourlogger_response_uncompressed_bytes_total", method="GET", route=route) - \
+        sample(before, "hourlogger_response_uncompressed_bytes_total", method="GET", route=route)
+    assert sent == len(plain.data) + len(response.data)
+    assert uncompressed == 2 * len(plain.data)
+
+def test_streamed_export_metrics(client, sample):
+    """ Tests that streamed bodies are counted once they have been sent """
+    _add_logs(client, 3)
+    route = "/users/<string:username>/logs/"
+    before = client.get("/metrics").get_data(as_text=True)
+    plain = client.get(LOGS, headers={"Accept": "application/x-ndjson"}).data
+    packed = client.get(LOGS, headers={"Accept": "application/x-ndjson", "Accept-Encoding": "gzip"}).data
+    after = client.get("/metrics").get_data(as_text=True)
+
+    sent = sample(after, "hourlogger_response_bytes_total", method="GET", route=route) - \
+        sample(before, "hourlogger_response_bytes_total", method="GET", route=route)
+    uncompressed = sample(after, "hourlogger_response_uncompressed_bytes_total", method="GET", route=route) - \
+        sample(before, "hourlogger_response_uncompressed_bytes_total", method="GET", route=route)
+    assert sent == len(plain) + len(packed)
+    assert uncompressed == 2 * len(plain)
@@ -0,0 +1,184 @@
+import os
+import sys
+from datetime import datetime
+import pytest
+from sqlalchemy import text
+
+from models import db, DailyTotal, Log, TimeReport, User
+from models import rebuild_daily_totals
+from app import create_app
+
+# create_db.py lives in the repository root, next to src/
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from create_db import generate_db, hash_plaintext_passwords, upgrade_db
+
+# The tables of a database made before the rollup, indexes and API keys
+BASELINE_SCHEMA = [
+    """CREATE TABLE user (
+        username VARCHAR(32) NOT NULL,
+        password VARCHAR(32) NOT NULL,
+        PRIMARY KEY (username),
+        UNIQUE (username)
+    )""",
+    """CREATE TABLE category (
+        name VARCHAR(32) NOT NULL,
+        description VARCHAR(128),
+        PRIMARY KEY (name),
+        UNIQUE (name)
+    )""",
+    """CREATE TABLE activity (
+        name VARCHAR(32) NOT NULL,
+        category_name VARCHAR(32) NOT NULL,
+        description VARCHAR(128),
+        PRIMARY KEY (name, category_name),
+        FOREIGN KEY(category_name) REFERENCES category (name) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE time_report (
+        rid INTEGER NOT NULL,
+        user_id VARCHAR(32) NOT NULL,
+        start_time DATETIME NOT NULL,
+        end_time DATETIME NOT NULL,
+        PRIMARY KEY (rid),
+        UNIQUE (rid),
+        FOREIGN KEY(user_id) REFERENCES user (username) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE log (
+        rid INTEGER NOT NULL,
+        user_id VARCHAR(32),
+        activity_name VARCHAR(32),
+        activity_category VARCHAR(32),
+        start_time DATETIME NOT NULL,
+        end_time DATETIME NOT NULL,
+        comments VARCHAR(128),
+        PRIMARY KEY (rid),
+        FOREIGN KEY(activity_name, activity_category) REFERENCES activity (name, category_name) ON DELETE SET NULL,
+        UNIQUE (rid),
+        FOREIGN KEY(user_id) REFERENCES user (username) ON DELETE SET NULL
+    )""",
+]
+
+@pytest.fixture
+def file_app(tmp_path):
+    """ An app on an empty database file, with a low scrypt cost """
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(tmp_path / "upgrade.db"),
+        "PASSWORD_SCRYPT_N": 2 ** 10,
+    })
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+def _index_names():
+    return set(db.session.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+
+def _rollup():
+    return sorted(
+        (row.user_id, str(row.day), row.activity_category, row.activity_name, row.seconds)
+        for row in DailyTotal.query.all()
+    )
+
+def _seed_baseline():
+    for statement in BASELINE_SCHEMA:
+        db.session.execute(text(statement))
+    db.session.execute(text("INSERT INTO user VALUES ('alice', 'plain-password')"))
+    db.session.execute(text("INSERT INTO category VALUES ('Work', NULL)"))
+    db.session.execute(text("INSERT INTO activity VALUES ('Coding', 'Work', NULL)"))
+    db.session.execute(text(
+        "INSERT INTO log (user_id, activity_name, activity_category, start_time, end_time) VALUES "
+        "('alice', 'Coding', 'Work', '2024-02-07 10:00:00.000000', '2024-02-07 12:00:00.000000'), "
+        "('alice', 'Coding', 'Work', '2024-02-08 20:00:00.000000', '2024-02-10 02:00:00.000000')"
+    ))
+    db.session.commit()
+
+def test_upgrade_baseline_database(file_app):
+    """
+    Tests that upgrading a database from before the rollup adds every table,
+    index and column, fills the rollup and hashes the passwords, and that a
+    second upgrade changes nothing
+    """
+    _seed_baseline()
+    upgrade_db()
+
+    expected = {index.name for table in db.metadata.sorted_tables for index in table.indexes}
+    assert expected <= _index_names()
+    rollup = _rollup()
+    assert sum(row[4] for row in rollup) == (2 + 30) * 3600
+    user = db.session.get(User, "alice")
+    assert user.longest_log == 30 * 3600
+    assert user.password.startswith("scrypt$")
+
+    upgrade_db()
+    db.session.expire_all()
+    assert _rollup() == rollup
+    assert db.session.get(User, "alice").longest_log == 30 * 3600
+
+def test_upgrade_replaces_old_rollup_key(file_app):
+    """ Tests that a rollup made under the old unique key is rebuilt under the new one """
+    _seed_baseline()
+    upgrade_db()
+    rollup = _rollup()
+    db.session.execute(text("DROP INDEX ix_daily_total_slot"))
+    db.session.execute(text(
+        "CREATE UNIQUE INDEX ix_daily_total_key ON daily_total (user_id, day, activity_category, activity_name)"
+    ))
+    # Activity-less rows that the old key let pile up
+    db.session.execute(text(
+        "INSERT INTO daily_total (user_id, day, seconds) VALUES ('alice', '2024-02-07', 60), ('alice', '2024-02-07', 60)"
+    ))
+    db.session.commit()
+
+    upgrade_db()
+    indexes = _index_names()
+    assert "ix_daily_total_key" not in indexes
+    assert "ix_daily_total_slot" in indexes
+    assert _rollup() == rollup
+
+def test_upgrade_cluster_logs(file_app):
+    """ Tests that --cluster-logs builds the covering log index, also over an existing one """
+    _seed_baseline()
+    upgrade_db(cluster_logs=True)
+    upgrade_db(cluster_logs=True)
+    columns = [row[2] for row in db.session.execute(text("PRAGMA index_info(ix_log_user_start_cluster)"))]
+    assert columns == [
+        "user_id", "start_time", "rid", "end_time", "activity_category", "activity_name", "comments"
+    ]
+
+def test_hash_plaintext_passwords(file_app):
+    """ Tests that only the passwords stored in plain text are hashed """
+    db.create_all()
+    passwords = file_app.extensions["passwords"]
+    hashed = passwords.hash("secret")
+    db.session.add(User(username="old", password="plain-password"))
+    db.session.add(User(username="new", password=hashed))
+    db.session.commit()
+
+    assert hash_plaintext_passwords() == 1
+    db.session.expire_all()
+    assert db.session.get(User, "new").password == hashed
+    assert passwords.verify("plain-password", db.session.get(User, "old").password) == (True, False)
+    assert hash_plaintext_passwords() == 0
+
+def test_generate_db(file_app):
+    """
+    Tests that the synthetic dataset is the same for the same seed, however
+    it is chunked, and that its rollup matches the logs
+    """
+    def _logs():
+        return [
+            (log.rid, log.user_id, log.activity_name, log.start_time, log.end_time, log.comments)
+            for log in Log.query.order_by(Log.rid)
+        ]
+
+    written = generate_db(users=3, days=21, seed=5, chunk_size=40)
+    logs = _logs()
+    assert written == len(logs) > 0
+    assert {log[1] for log in logs} == {"user00001", "user00002", "user00003"}
+    assert TimeReport.query.count() == 3 * 3
+    rollup = _rollup()
+    rebuild_daily_totals()
+    assert _rollup() == rollup
+
+    assert generate_db(users=3, days=21, seed=5, chunk_size=10000) == written
+    db.session.expire_all()
+    assert _logs() == logs
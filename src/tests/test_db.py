@@ -4,11 +4,13 @@ import tempfile
 import time
 from datetime import datetime
 from sqlalchemy.engine import Engine
-from sqlalchemy import event
+from sqlalchemy import event, text
 from sqlalchemy.exc import IntegrityError, StatementError
 
-from models import User, Log, Activity, Category, TimeReport
-from models import app, db
+from models import User, Log, Activity, Category, TimeReport, DailyTotal
+from models import rebuild_daily_totals, find_overlapping_logs
+from models import db
+from app import create_app
 
 @event.listens_for(Engine, "connect")
 def set_sqlite_pragma(dbapi_connection, connection_record):
@@ -21,8 +23,7 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
 @pytest.fixture
 def db_handle():
     db_fd, db_fname = tempfile.mkstemp()
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + db_fname
-    app.config["TESTING"] = True
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname})
     
     ctx = app.app_context()
     ctx.push()
@@ -302,4 +303,100 @@ def test_timereport_columns(db_handle):
     timereport.end_time = time.time()
     db_handle.session.add(timereport)
     with pytest.raises(StatementError):
-        db_handle.session.commit()
\ No newline at end of file
+        db_handle.session.commit()
+
+
+def _query_plan(db_handle, query):
+    statement = query.statement.compile(
+        dialect=db_handle.engine.dialect,
+        compile_kwargs={"literal_binds": True}
+    )
+    rows = db_handle.session.execute(text("EXPLAIN QUERY PLAN " + str(statement)))
+    return " ".join(row[-1] for row in rows)
+
+def test_list_queries_use_indexes(db_handle):
+    """
+    Tests that the per-user log and report list queries are answered through
+    the composite (user_id, start_time, rid) indexes instead of table scans.
+    """
+    
+    plan = _query_plan(db_handle, Log.query.filter_by(user_id="test1").order_by(Log.start_time, Log.rid))
+    assert "ix_log_user_start" in plan
+    assert "TEMP B-TREE" not in plan
+    
+    plan = _query_plan(db_handle, Log.query.filter(
+        Log.user_id == "test1",
+        Log.start_time < datetime(2024, 2, 8),
+        Log.end_time > datetime(2024, 2, 7)
+    ))
+    assert "ix_log_user_start" in plan
+    
+    plan = _query_plan(db_handle, TimeReport.query.filter_by(user_id="test1").order_by(TimeReport.start_time, TimeReport.rid))
+    assert "ix_time_report_user_start" in plan
+    assert "TEMP B-TREE" not in plan
+    
+    plan = _query_plan(db_handle, Activity.query.filter_by(category_name="Work"))
+    assert "ix_activity_category_name" in plan
+
+    # The overlap probe is a range on start_time, bounded on both sides
+    plan = _query_plan(db_handle, Log.query.filter(
+        Log.user_id == "test1",
+        Log.start_time > datetime(2024, 2, 6),
+        Log.start_time < datetime(2024, 2, 8),
+    ).order_by(Log.start_time, Log.rid))
+    assert "ix_log_user_start (user_id=? AND start_time>? AND start_time<?)" in plan
+    assert "TEMP B-TREE" not in plan
+    
+def test_rebuild_daily_totals(db_handle):
+    """
+    Tests that rebuilding the daily rollup from the logs gives the same rows
+    as maintaining it incrementally.
+    """
+    
+    user = _get_user()
+    activity = _get_activity()
+    activity.category = _get_category()
+    db_handle.session.add(user)
+    db_handle.session.add(activity)
+    for day in range(1, 4):
+        log = _get_log()
+        log.start_time = datetime(2024, 2, day, 20, 0)
+        log.end_time = datetime(2024, 2, day + 1, 2, 0)
+        db_handle.session.add(log)
+    db_handle.session.commit()
+    
+    def _rows():
+        return sorted(
+            (str(row.day), row.activity_name, row.seconds)
+            for row in DailyTotal.query.all()
+        )
+    
+    incremental = _rows()
+    assert len(incremental) == 4
+    assert sum(row[2] for row in incremental) == 3 * 6 * 3600
+    rebuild_daily_totals()
+    assert _rows() == incremental
+
+def test_find_overlapping_logs(db_handle):
+    """
+    Tests that the sweep finds each log that overlaps an earlier log of the
+    same user, including one that is contained in a long earlier log
+    """
+    db_handle.session.add(User(username="a", password="1234"))
+    db_handle.session.add(User(username="b", password="1234"))
+    db_handle.session.commit()
+
+    def add(user, start, end):
+        log = Log(user_id=user, start_time=datetime(2024, 3, 10, start), end_time=datetime(2024, 3, 10, end))
+        db_handle.session.add(log)
+        db_handle.session.flush()
+        return log.rid
+
+    long_log = add("a", 8, 16)
+    add("a", 16, 17)
+    inner = add("a", 9, 10)
+    inner_later = add("a", 12, 13)
+    add("b", 9, 10)
+    db_handle.session.commit()
+
+    assert sorted(find_overlapping_logs()) == [("a", inner, long_log), ("a", inner_later, long_log)]
@@ -0,0 +1,27 @@
+import json
+import pytest
+import encoding
+
+@pytest.fixture
+def restore_encoder():
+    yield
+    encoding.set_encoder("auto")
+
+@pytest.mark.parametrize("name", sorted(encoding.ENCODERS))
+def test_encoders_agree(name, restore_encoder):
+    """ Tests that every available encoder gives bytes that decode to the same document """
+    body = {"items": [{"id": 1, "name": "Työ", "hours": 1.5, "comments": None}], "@controls": {}}
+    encoding.set_encoder(name)
+    data = encoding.dumps(body)
+    assert isinstance(data, bytes)
+    assert json.loads(data) == body
+
+def test_auto_falls_back_to_stdlib(monkeypatch, restore_encoder):
+    """ Tests that auto uses the standard library when no fast encoder is installed """
+    monkeypatch.setattr(encoding, "ENCODERS", {"stdlib": encoding._stdlib_dumps})
+    assert encoding.set_encoder("auto") == "stdlib"
+
+def test_unknown_encoder(restore_encoder):
+    """ Tests that asking for an encoder that is not available fails loudly """
+    with pytest.raises(ValueError):
+        encoding.set_encoder("does-not-exist")
@@ -0,0 +1,88 @@
+import threading
+import pytest
+from jobs import JobCancelled, JobQueue, QueueFull
+
+def _blocked(job, release):
+    release.wait(5)
+    if job.cancel_requested:
+        raise JobCancelled()
+    return "result"
+
+def test_job_runs():
+    """ Tests that a job runs on the pool and keeps its result """
+    queue = JobQueue(workers=1)
+    job, created = queue.submit("key", lambda job, value: value * 2, 21)
+    job.future.result(timeout=5)
+    assert created
+    assert job.state == "done"
+    assert job.result == 42
+    assert queue.get(job.id) is job
+    queue.shutdown()
+
+def test_job_failure():
+    """ Tests that an exception raised by a job marks it failed """
+    def fail(job):
+        raise RuntimeError("boom")
+    queue = JobQueue(workers=1)
+    job, _ = queue.submit("key", fail)
+    job.future.result(timeout=5)
+    assert job.state == "failed"
+    assert job.error == "boom"
+    queue.shutdown()
+
+def test_job_deduplication():
+    """ Tests that submitting the key of an active job returns that job """
+    queue = JobQueue(workers=1)
+    release = threading.Event()
+    job, created = queue.submit("key", _blocked, release)
+    again, created_again = queue.submit("key", _blocked, release)
+    assert created and not created_again
+    assert again is job
+    release.set()
+    job.future.result(timeout=5)
+    # Finished jobs do not absorb new submissions
+    later, created_later = queue.submit("key", _blocked, release)
+    assert created_later and later is not job
+    later.future.result(timeout=5)
+    queue.shutdown()
+
+def test_job_limit():
+    """ Tests that a full queue refuses new jobs until a job finishes """
+    queue = JobQueue(workers=1, limit=2)
+    release = threading.Event()
+    first, _ = queue.submit("a", _blocked, release)
+    queue.submit("b", _blocked, release)
+    with pytest.raises(QueueFull):
+        queue.submit("c", _blocked, release)
+    release.set()
+    first.future.result(timeout=5)
+    queue.get(first.id)
+    queue.shutdown()
+
+def test_job_cancel():
+    """ Tests cancelling a queued job and a running one """
+    queue = JobQueue(workers=1)
+    release = threading.Event()
+    running, _ = queue.submit("a", _blocked, release)
+    queued, _ = queue.submit("b", _blocked, release)
+    assert queue.cancel(queued.id).state == "cancelled"
+    assert queue.cancel(running.id) is running
+    assert running.cancel_requested
+    release.set()
+    running.future.result(timeout=5)
+    assert running.state == "cancelled"
+    assert queue.cancel("missing") is None
+    assert queue.counts()["cancelled"] == 2
+    queue.shutdown()
+
+def test_job_history():
+    """ Tests that only the last finished jobs are kept """
+    queue = JobQueue(workers=1, history=2)
+    jobs = []
+    for key in range(3):
+        job, _ = queue.submit(key, lambda job: None)
+        job.future.result(timeout=5)
+        jobs.append(job)
+    assert queue.get(jobs[0].id) is None
+    assert queue.get(jobs[2].id) is jobs[2]
+    queue.shutdown()
@@ -1,13 +1,11 @@
+import json
 import pytest
-from models import db, Log, User, Activity, Category
-from app import app
+from models import db, DailyTotal, Log, User, Activity, Category
 from datetime import datetime
 
 @pytest.fixture
-def client():
+def client(app):
     """ Sets up a test client and a temporary in-memory database """
-    app.config["TESTING"] = True
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
     with app.app_context():
         db.create_all()
         db.session.add(User(username="test_user", password="1234"))
@@ -30,6 +28,17 @@ def test_create_log(client):
     })
     assert response.status_code == 201
 
+def test_create_log_with_unknown_activity(client):
+    """ Tests logging an activity that does not exist (should return 404, not trip the foreign key) """
+    response = client.post("/users/test_user/logs/", json={
+        "activity_category": "Exercise",
+        "activity_name": "Pilates",
+        "start_time": "2024-02-10T08:00:00",
+        "end_time": "2024-02-10T09:00:00"
+    })
+    assert response.status_code == 404
+    assert response.json["error"] == "Activity does not exist"
+
 def test_create_log_with_invalid_user(client):
     """ Tests trying to log an activity for a non-existent user (should fail) """
     response = client.post("/users/invalid_user/logs/", json={
@@ -64,7 +73,7 @@ def test_get_empty_logs(client):
     assert "items" in response.json
     assert isinstance(response.json["items"], list)
 
-def test_get_single_log(client):
+def test_get_single_log(app, client):
     """ Test retrieving a single, already existing log entry """
     client.post("/users/test_user/logs/", json={
         "activity_category": "Exercise",
@@ -77,7 +86,23 @@ def test_get_single_log(client):
     response = client.get(f"/logs/{log_id}")
     assert response.status_code == 200
     
-def test_delete_log(client):
+def test_get_log_of_deleted_activity(app, client):
+    """ Test that a log whose activity was deleted is shown without an activity control """
+    client.post("/users/test_user/logs/", json={
+        "activity_category": "Exercise",
+        "activity_name": "Yoga",
+        "start_time": "2024-02-10T10:00:00",
+        "end_time": "2024-02-10T11:00:00"
+    })
+    client.delete("/categories/Exercise/activities/Yoga")
+    with app.app_context():
+        log_id = Log.query.first().rid
+    response = client.get(f"/logs/{log_id}")
+    assert response.status_code == 200
+    assert response.json["activity_name"] is None
+    assert "activity" not in response.json["@controls"]
+
+def test_delete_log(app, client):
     """ Test deleting an existing log """
     client.post("/users/test_user/logs/", json={
         "activity_category": "Exercise",
@@ -109,3 +134,430 @@ def test_create_log_invalid_time_format(client):
         "end_time": "worse-time"
     })
     assert response.status_code == 400
+
+def _create_logs(client, count):
+    for i in range(count):
+        client.post("/users/test_user/logs/", json={
+            "activity_category": "Exercise",
+            "activity_name": "Yoga",
+            "start_time": f"2024-02-{10 + i}T08:00:00",
+            "end_time": f"2024-02-{10 + i}T09:00:00"
+        })
+
+def test_get_logs_paginated(client):
+    """ Test walking the log list forward and back with keyset cursors """
+    _create_logs(client, 5)
+    response = client.get("/users/test_user/logs/?limit=2")
+    assert response.status_code == 200
+    first_page = [item["start_time"] for item in response.json["items"]]
+    assert first_page == ["2024-02-10T08:00:00", "2024-02-11T08:00:00"]
+    assert "prev" not in response.json["@controls"]
+
+    seen = list(first_page)
+    next_href = response.json["@controls"]["next"]["href"]
+    while next_href:
+        response = client.get(next_href)
+        assert response.status_code == 200
+        seen += [item["start_time"] for item in response.json["items"]]
+        next_href = response.json["@controls"].get("next", {}).get("href")
+    assert seen == [f"2024-02-{10 + i}T08:00:00" for i in range(5)]
+
+    prev_href = response.json["@controls"]["prev"]["href"]
+    response = client.get(prev_href)
+    assert [item["start_time"] for item in response.json["items"]] == [
+        "2024-02-12T08:00:00", "2024-02-13T08:00:00"
+    ]
+    assert "prev" in response.json["@controls"]
+    assert "next" in response.json["@controls"]
+
+def test_get_logs_invalid_paging(client):
+    """ Test that a bad limit or cursor is rejected (should return 400) """
+    assert client.get("/users/test_user/logs/?limit=0").status_code == 400
+    assert client.get("/users/test_user/logs/?limit=abc").status_code == 400
+    assert client.get("/users/test_user/logs/?cursor=garbage").status_code == 400
+
+def test_log_updates_daily_totals(app, client):
+    """ Test that creating and deleting a log crossing midnight keeps the daily rollup in sync """
+    client.post("/users/test_user/logs/", json={
+        "activity_category": "Exercise",
+        "activity_name": "Yoga",
+        "start_time": "2024-02-10T23:00:00",
+        "end_time": "2024-02-11T01:30:00"
+    })
+    with app.app_context():
+        totals = {str(row.day): row.seconds for row in DailyTotal.query.order_by(DailyTotal.day)}
+        log_id = Log.query.first().rid
+    assert totals == {"2024-02-10": 3600, "2024-02-11": 5400}
+
+    client.delete(f"/logs/{log_id}")
+    with app.app_context():
+        assert DailyTotal.query.count() == 0
+
+def test_daily_totals_of_deleted_activities(app, client):
+    """ Test that time of deleted activities stays in one rollup row per day that logs can be taken from """
+    with app.app_context():
+        db.session.add(Activity(name="Running", category_name="Exercise"))
+        db.session.commit()
+    client.post("/users/test_user/logs/", json=_batch(1) + [{
+        "activity_category": "Exercise",
+        "activity_name": "Running",
+        "start_time": "2024-03-10T10:00:00",
+        "end_time": "2024-03-10T11:00:00"
+    }])
+    client.delete("/categories/Exercise/activities/Running")
+    client.delete("/categories/Exercise")
+    with app.app_context():
+        rows = DailyTotal.query.all()
+        assert [(row.activity_category, row.activity_name, row.seconds) for row in rows] == [(None, None, 5400 + 3600)]
+        log_ids = [log.rid for log in Log.query]
+
+    client.delete(f"/logs/{log_ids[0]}")
+    with app.app_context():
+        assert [row.seconds for row in DailyTotal.query] == [3600]
+    client.delete(f"/logs/{log_ids[1]}")
+    with app.app_context():
+        assert DailyTotal.query.count() == 0
+
+def test_create_log_with_time_zone(client):
+    """ Test that a log with an aware timestamp is a 400, not a failed comparison with naive days """
+    response = client.post("/users/test_user/logs/", json={
+        "activity_category": "Exercise",
+        "activity_name": "Yoga",
+        "start_time": "2024-02-10T08:00:00+02:00",
+        "end_time": "2024-02-10T09:00:00+02:00"
+    })
+    assert response.status_code == 400
+    assert set(response.json["message"]) == {"start_time", "end_time"}
+    assert client.get("/users/test_user/logs/?from=2024-02-10T08:00:00Z").status_code == 400
+
+def test_create_long_log(app, client):
+    """ Test that a log spanning several days is accepted and found by overlap checks """
+    response = client.post("/users/test_user/logs/", json={
+        "activity_category": "Exercise",
+        "activity_name": "Yoga",
+        "start_time": "2024-02-10T08:00:00",
+        "end_time": "2024-02-13T09:00:00"
+    })
+    assert response.status_code == 201
+    with app.app_context():
+        assert db.session.get(User, "test_user").longest_log == (3 * 24 + 1) * 3600
+    response = client.post("/users/test_user/logs/?overlap=reject", json={
+        "activity_category": "Exercise",
+        "activity_name": "Yoga",
+        "start_time": "2024-02-13T08:00:00",
+        "end_time": "2024-02-13T10:00:00"
+    })
+    assert response.status_code == 409
+
+def _batch(count):
+    return [{
+        "activity_category": "Exercise",
+        "activity_name": "Yoga",
+        "start_time": f"2024-03-{10 + i}T08:00:00",
+        "end_time": f"2024-03-{10 + i}T09:30:00"
+    } for i in range(count)]
+
+def test_create_log_batch(app, client):
+    """ Test creating several logs at once from a JSON array """
+    response = client.post("/users/test_user/logs/", json=_batch(3))
+    assert response.status_code == 201
+    assert response.json["created"] == 3
+    assert [result["status"] for result in response.json["results"]] == [201] * 3
+    assert client.get(response.json["results"][0]["href"]).status_code == 200
+    with app.app_context():
+        assert Log.query.count() == 3
+        assert sum(row.seconds for row in DailyTotal.query) == 3 * 5400
+
+def test_create_log_batch_ndjson(client):
+    """ Test creating several logs at once from an NDJSON body """
+    body = "\n".join(json.dumps(item) for item in _batch(2)) + "\n"
+    response = client.post("/users/test_user/logs/", data=body, content_type="application/x-ndjson")
+    assert response.status_code == 201
+    assert len(client.get("/users/test_user/logs/").json["items"]) == 2
+
+def test_create_log_batch_atomic(app, client):
+    """ Test that one invalid log rejects the whole batch by default """
+    items = _batch(3)
+    items[1]["end_time"] = "bad-time"
+    response = client.post("/users/test_user/logs/", json=items)
+    assert response.status_code == 400
+    assert [result["status"] for result in response.json["results"]] == [424, 400, 424]
+    with app.app_context():
+        assert Log.query.count() == 0
+
+def test_create_log_batch_ids(client):
+    """ Test that every result of a batch links to the log created from its own item """
+    items = _batch(5)
+    items = [items[3], items[0], items[4], items[1], items[2]]
+    items.append(dict(items[0]))
+    response = client.post("/users/test_user/logs/", json=items)
+    assert response.status_code == 201
+    results = response.json["results"]
+    assert len({result["id"] for result in results}) == len(items)
+    for item, result in zip(items, results):
+        assert client.get(result["href"]).json["start_time"] == item["start_time"]
+
+def test_create_log_batch_partial(app, client):
+    """ Test that partial mode creates the valid logs and reports the invalid ones """
+    items = _batch(3)
+    del items[2]["activity_name"]
+    response = client.post("/users/test_user/logs/?mode=partial", json=items)
+    assert response.status_code == 200
+    assert response.json["created"] == 2
+    assert response.json["results"][2]["error"] == "activity_name is required"
+    with app.app_context():
+        assert Log.query.count() == 2
+
+def test_create_log_batch_unknown_activity(app, client):
+    """ Test that a log of an unknown activity is rejected on its own in partial mode """
+    items = _batch(3)
+    items[1]["activity_name"] = "Pilates"
+    response = client.post("/users/test_user/logs/?mode=partial", json=items)
+    assert response.status_code == 200
+    assert response.json["created"] == 2
+    assert [result["status"] for result in response.json["results"]] == [201, 404, 201]
+    assert response.json["results"][1]["error"] == "Activity does not exist"
+
+    response = client.post("/users/test_user/logs/", json=items)
+    assert response.status_code == 400
+    assert [result["status"] for result in response.json["results"]] == [424, 404, 424]
+    with app.app_context():
+        assert Log.query.count() == 2
+
+def test_create_log_batch_empty(client):
+    """ Test that an empty batch is a bad request, not an unsupported media type """
+    response = client.post("/users/test_user/logs/", json=[])
+    assert response.status_code == 400
+    assert "at least one log" in response.json["@error"]["@messages"][0]
+
+def test_create_log_batch_too_large(app, client):
+    """ Test that a batch over the configured limit is rejected (should return 413) """
+    app.config["LOG_BATCH_LIMIT"] = 2
+    try:
+        response = client.post("/users/test_user/logs/", json=_batch(3))
+    finally:
+        app.config["LOG_BATCH_LIMIT"] = 1000
+    assert response.status_code == 413
+
+def _log(start_time, end_time):
+    return {
+        "activity_category": "Exercise",
+        "activity_name": "Yoga",
+        "start_time": start_time,
+        "end_time": end_time
+    }
+
+def test_overlapping_log_allowed_by_default(client):
+    """ Test that overlapping logs are accepted unless overlap checks are asked for """
+    client.post("/users/test_user/logs/", json=_log("2024-03-10T08:00:00", "2024-03-10T10:00:00"))
+    response = client.post("/users/test_user/logs/", json=_log("2024-03-10T09:00:00", "2024-03-10T11:00:00"))
+    assert response.status_code == 201
+    assert "overlaps" not in response.json
+
+def test_overlapping_log_rejected(app, client):
+    """ Test that reject mode refuses a log overlapping an existing one (should return 409) """
+    first = client.post("/users/test_user/logs/", json=_log("2024-03-10T08:00:00", "2024-03-10T10:00:00"))
+    assert first.status_code == 201
+    response = client.post(
+        "/users/test_user/logs/?overlap=reject",
+        json=_log("2024-03-10T09:00:00", "2024-03-10T11:00:00")
+    )
+    assert response.status_code == 409
+    with app.app_context():
+        rid = Log.query.one().rid
+    assert response.json["overlaps"] == [rid]
+    # Touching logs do not overlap
+    response = client.post(
+        "/users/test_user/logs/?overlap=reject",
+        json=_log("2024-03-10T10:00:00", "2024-03-10T11:00:00")
+    )
+    assert response.status_code == 201
+
+def test_overlapping_log_flagged(app, client):
+    """ Test that flag mode creates the log and lists the logs it overlaps, using the config """
+    client.post("/users/test_user/logs/", json=_log("2024-03-09T20:00:00", "2024-03-10T09:00:00"))
+    app.config["LOG_OVERLAP_MODE"] = "flag"
+    try:
+        response = client.post("/users/test_user/logs/", json=_log("2024-03-10T08:00:00", "2024-03-10T08:30:00"))
+    finally:
+        app.config["LOG_OVERLAP_MODE"] = "allow"
+    assert response.status_code == 201
+    assert len(response.json["overlaps"]) == 1
+    with app.app_context():
+        assert Log.query.count() == 2
+
+def test_invalid_overlap_mode(client):
+    """ Test that an unknown overlap mode is rejected (should return 400) """
+    response = client.post(
+        "/users/test_user/logs/?overlap=sometimes",
+        json=_log("2024-03-10T08:00:00", "2024-03-10T10:00:00")
+    )
+    assert response.status_code == 400
+
+def test_overlapping_batch(app, client):
+    """ Test that a batch checks its logs against existing logs and each other """
+    client.post("/users/test_user/logs/", json=_log("2024-03-10T08:00:00", "2024-03-10T10:00:00"))
+    items = [
+        _log("2024-03-10T09:00:00", "2024-03-10T09:30:00"),
+        _log("2024-03-11T08:00:00", "2024-03-11T10:00:00"),
+        _log("2024-03-11T09:00:00", "2024-03-11T11:00:00"),
+        _log("2024-03-12T08:00:00", "2024-03-12T10:00:00"),
+    ]
+    response = client.post("/users/test_user/logs/?overlap=reject&mode=partial", json=items)
+    assert response.status_code == 200
+    assert response.json["created"] == 1
+    results = response.json["results"]
+    assert [result["status"] for result in results] == [409, 409, 409, 201]
+    assert len(results[0]["overlaps"]) == 1
+    assert results[1]["overlapping_items"] == [2]
+    assert results[2]["overlapping_items"] == [1]
+
+    response = client.post("/users/test_user/logs/?overlap=reject", json=items[:2])
+    assert response.status_code == 400
+    assert [result["status"] for result in response.json["results"]] == [409, 424]
+    with app.app_context():
+        assert Log.query.count() == 2
+
+def _add_filter_logs(app):
+    with app.app_context():
+        db.session.add(Category(name="Work"))
+        db.session.add(Activity(name="Coding", category_name="Work"))
+        db.session.commit()
+    for day in range(10, 17):
+        for category, activity, hour in (("Exercise", "Yoga", 7), ("Work", "Coding", 9)):
+            client_item = {
+                "activity_category": category,
+                "activity_name": activity,
+                "start_time": f"2024-03-{day}T{hour:02}:00:00",
+                "end_time": f"2024-03-{day}T{hour + 1:02}:00:00"
+            }
+            yield client_item
+
+def test_filter_logs(app, client):
+    """ Test narrowing the log list down by time window, category and activity """
+    client.post("/users/test_user/logs/", json=list(_add_filter_logs(app)))
+    response = client.get("/users/test_user/logs/?from=2024-03-11T00:00:00&to=2024-03-14T00:00:00&category=Work")
+    assert response.status_code == 200
+    items = response.json["items"]
+    assert [item["start_time"] for item in items] == [
+        "2024-03-11T09:00:00", "2024-03-12T09:00:00", "2024-03-13T09:00:00"
+    ]
+    assert all(item["activity_name"] == "Coding" for item in items)
+    assert "category=Work" in response.json["@controls"]["self"]["href"]
+
+    response = client.get("/users/test_user/logs/?activity=Yoga")
+    assert len(response.json["items"]) == 7
+
+    template = response.json["@controls"]["hlog:filter-logs"]
+    assert template["isHrefTemplate"] is True
+    assert template["href"] == "/users/test_user/logs/{?from,to,category,activity,limit}"
+    assert set(template["schema"]["properties"]) == {"from", "to", "category", "activity", "limit"}
+
+def test_filter_logs_paging(app, client):
+    """ Test that paging controls keep the filters of the request """
+    client.post("/users/test_user/logs/", json=list(_add_filter_logs(app)))
+    url = "/users/test_user/logs/?category=Work&from=2024-03-11T00:00:00&limit=2"
+    seen = []
+    while url:
+        body = client.get(url).json
+        seen += [item["start_time"] for item in body["items"]]
+        url = body["@controls"].get("next", {}).get("href")
+        if url:
+            assert "category=Work" in url and "from=2024-03-11" in url
+    assert seen == [f"2024-03-{day}T09:00:00" for day in range(11, 17)]
+
+def test_filter_logs_export(app, client):
+    """ Test that an NDJSON export applies the same filters """
+    client.post("/users/test_user/logs/", json=list(_add_filter_logs(app)))
+    response = client.get("/users/test_user/logs/?to=2024-03-12T00:00:00", headers={"Accept": "application/x-ndjson"})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(lines) == 4
+
+def test_self_link_ignores_unknown_parameters(client):
+    """ Test that only the list's own parameters are carried over to the self link """
+    client.post("/users/test_user/logs/", json=_batch(3))
+    response = client.get("/users/test_user/logs/?username=other&_external=1&_anchor=top&limit=2&category=Exercise")
+    assert response.status_code == 200
+    href = response.json["@controls"]["self"]["href"]
+    assert href.startswith("/users/test_user/logs/?")
+    assert "limit=2" in href and "category=Exercise" in href
+    assert "#" not in href and "username" not in href and "_external" not in href
+
+def test_filter_logs_invalid(client):
+    """ Test that a malformed time filter is rejected (should return 400) """
+    assert client.get("/users/test_user/logs/?from=yesterday").status_code == 400
+
+def test_get_logs_compact(client):
+    """ Test the compact view of the log list and that its paging keeps the view """
+    client.post("/users/test_user/logs/", json=_batch(3))
+    response = client.get("/users/test_user/logs/?view=compact&limit=2")
+    assert response.status_code == 200
+    body = response.json
+    assert body["columns"] == [
+        "id", "user_id", "activity_category", "activity_name", "start_time", "end_time", "comments"
+    ]
+    assert body["rows"][0][1:] == ["test_user", "Exercise", "Yoga", "2024-03-10T08:00:00", "2024-03-10T09:30:00", None]
+    assert len(body["rows"]) == 2
+    assert "items" not in body
+    assert "hlog:add-log" not in body["@controls"]
+
+    response = client.get(body["@controls"]["next"]["href"])
+    assert len(response.json["rows"]) == 1
+    assert response.json["rows"][0][4] == "2024-03-12T08:00:00"
+    assert "prev" in response.json["@controls"]
+
+def test_get_logs_compact_profile(client):
+    """ Test asking for the compact view with a profile in the Accept header """
+    client.post("/users/test_user/logs/", json=_batch(2))
+    accept = 'application/vnd.mason+json; profile="/profiles/compact/"'
+    response = client.get("/users/test_user/logs/", headers={"Accept": accept})
+    assert len(response.json["rows"]) == 2
+    assert response.json["@controls"]["profile"]["href"] == "/profiles/compact/"
+
+    response = client.get("/users/test_user/logs/")
+    assert len(response.json["items"]) == 2
+
+def test_export_logs_ndjson(client):
+    """ Test streaming the full log history as NDJSON """
+    client.post("/users/test_user/logs/", json=_batch(3))
+    response = client.get("/users/test_user/logs/?limit=1", headers={"Accept": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [row["start_time"] for row in rows] == [f"2024-03-{10 + i}T08:00:00" for i in range(3)]
+    assert rows[0]["activity_category"] == "Exercise"
+
+def test_export_logs_csv(client):
+    """ Test streaming the full log history as CSV, and that the Mason view is unaffected """
+    client.post("/users/test_user/logs/", json=_batch(2))
+    response = client.get("/users/test_user/logs/", headers={"Accept": "text/csv"})
+    assert response.status_code == 200
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0] == "id,user_id,activity_category,activity_name,start_time,end_time,comments"
+    assert len(lines) == 3
+    assert lines[1].endswith(",2024-03-10T08:00:00,2024-03-10T09:30:00,")
+
+    response = client.get("/users/test_user/logs/")
+    assert response.mimetype == "application/vnd.mason+json"
+    assert len(response.json["items"]) == 2
+
+def test_create_log_wrong_types(client):
+    """ Test that each invalid field of a log is reported separately (should return 400) """
+    response = client.post("/users/test_user/logs/", json={
+        "activity_category": ["Exercise"],
+        "activity_name": "Yoga",
+        "start_time": "2024-02-10T08:00:00"
+    })
+    assert response.status_code == 400
+    assert set(response.json["message"]) == {"activity_category", "end_time"}
+
+def test_log_fields_are_scalars(client):
+    """ Test that ids are plain values, not one-element lists """
+    _create_logs(client, 1)
+    item = client.get("/users/test_user/logs/").json["items"][0]
+    assert isinstance(item["id"], int)
+    assert item["user_id"] == "test_user"
+    response = client.get(item["@controls"]["self"]["href"])
+    assert response.json["id"] == item["id"]
+    assert response.json["user_id"] == "test_user"
@@ -0,0 +1,84 @@
+import threading
+import pytest
+from sqlalchemy.exc import OperationalError
+from models import db, User
+import metrics
+from metrics import snapshot
+
+@pytest.fixture
+def client(app):
+    """ Sets up a test client and a temporary in-memory database """
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username="test_user", password="1234"))
+        db.session.commit()
+    yield app.test_client()
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+def test_metrics_endpoint(client, sample):
+    """ Tests that requests show up in the /metrics text with their SQL statements """
+    before = client.get("/metrics").get_data(as_text=True)
+    client.get("/users/test_user")
+    client.get("/users/nobody")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    after = response.get_data(as_text=True)
+    route = "/users/<string:username>"
+    for status in ("200", "404"):
+        assert sample(after, "hourlogger_requests_total", method="GET", route=route, status=status) == \
+            sample(before, "hourlogger_requests_total", method="GET", route=route, status=status) + 1
+    assert sample(after, "hourlogger_sql_statements_total", method="GET", route=route) >= \
+        sample(before, "hourlogger_sql_statements_total", method="GET", route=route) + 2
+    assert sample(after, "hourlogger_request_duration_seconds_count", method="GET", route=route) == \
+        sample(before, "hourlogger_request_duration_seconds_count", method="GET", route=route) + 2
+    assert sample(after, "hourlogger_request_duration_seconds_bucket", method="GET", route=route, le="+Inf") == \
+        sample(after, "hourlogger_request_duration_seconds_count", method="GET", route=route)
+    assert sample(after, "hourlogger_response_bytes_total", method="GET", route=route) > \
+        sample(before, "hourlogger_response_bytes_total", method="GET", route=route)
+    assert 'hourlogger_cache_requests_total{outcome="hits"}' in after
+
+def test_metrics_from_other_threads(app, client):
+    """ Tests that requests handled by other threads are added up """
+    key = ("GET", "/users/")
+    before = snapshot().get(key)
+    before = before.requests if before else 0
+
+    def request():
+        app.test_client().get("/users/")
+
+    threads = [threading.Thread(target=request) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert snapshot()[key].requests == before + 3
+
+def test_metrics_of_finished_threads(app, client):
+    """ Tests that the shard of a thread that has ended is folded into the totals instead of kept """
+    key = ("GET", "/users/")
+    before = snapshot().get(key)
+    before = before.requests if before else 0
+    shards = len(metrics._shards)
+
+    def request():
+        app.test_client().get("/users/")
+
+    for _ in range(20):
+        thread = threading.Thread(target=request)
+        thread.start()
+        thread.join()
+    assert len(metrics._shards) <= shards
+    assert snapshot()[key].requests == before + 20
+
+def test_failed_statements_leave_nothing_on_connection(app, client):
+    """ Tests that statements that fail do not leave timing state on the pooled connection """
+    with app.app_context():
+        connection = db.session.connection()
+        before = repr(connection.info)
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                connection.exec_driver_sql("SELECT * FROM no_such_table")
+        assert repr(connection.info) == before
@@ -0,0 +1,93 @@
+import threading
+import pytest
+import passwords
+from models import db, User
+from passwords import HasherBusy, PasswordHasher, hash_password, verify_password
+
+@pytest.fixture
+def client(app):
+    """ Sets up a test client and a temporary in-memory database """
+    with app.app_context():
+        db.create_all()
+    yield app.test_client()
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+def _stored(app, username):
+    with app.app_context():
+        return db.session.get(User, username).password
+
+def test_hash_and_verify():
+    """ Tests that hashes are salted, verify, and tell when their cost is outdated """
+    stored = hash_password("secret", 2 ** 10, 8, 1)
+    assert stored.startswith("scrypt$1024$8$1$")
+    assert stored != hash_password("secret", 2 ** 10, 8, 1)
+    assert verify_password("secret", stored, 2 ** 10, 8, 1) == (True, False)
+    assert verify_password("wrong", stored, 2 ** 10, 8, 1) == (False, False)
+    assert verify_password("secret", stored, 2 ** 11, 8, 1) == (True, True)
+
+def test_verify_plaintext():
+    """ Tests that passwords stored in plain text still verify and are outdated """
+    assert verify_password("secret", "secret", 2 ** 10, 8, 1) == (True, True)
+    assert verify_password("wrong", "secret", 2 ** 10, 8, 1) == (False, True)
+
+def test_hasher_limit():
+    """ Tests that the hasher refuses work beyond its limit instead of queueing it """
+    hasher = PasswordHasher(n=2 ** 10, workers=1, limit=1)
+    assert hasher.verify("secret", hasher.hash("secret")) == (True, False)
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+    thread = threading.Thread(target=hasher._run, args=(block,))
+    thread.start()
+    started.wait(5)
+    with pytest.raises(HasherBusy):
+        hasher.hash("secret")
+    release.set()
+    thread.join()
+    assert hasher.hash("secret").startswith("scrypt$")
+
+def test_signup_stores_hash(app, client):
+    """ Tests that new users and changed passwords are stored hashed """
+    assert client.post("/users/", json={"username": "alice", "password": "secret"}).status_code == 201
+    stored = _stored(app, "alice")
+    assert stored.startswith("scrypt$") and "secret" not in stored
+    assert client.put("/users/alice", json={"password": "changed"}).status_code == 200
+    assert verify_password("changed", _stored(app, "alice"), 2 ** 10, 8, 1)[0]
+
+def test_login_upgrades_hash(app, client, monkeypatch):
+    """ Tests that logging in rehashes plain text passwords and hashes with an old cost """
+    with app.app_context():
+        db.session.add(User(username="alice", password="secret"))
+        db.session.commit()
+    assert client.post("/users/alice/keys/", json={"password": "wrong"}).status_code == 401
+    assert _stored(app, "alice") == "secret"
+    assert client.post("/users/alice/keys/", json={"password": "secret"}).status_code == 201
+    assert _stored(app, "alice").startswith("scrypt$1024$")
+
+    monkeypatch.setattr(app.extensions["passwords"], "n", 2 ** 11)
+    assert client.post("/users/alice/keys/", json={"password": "secret"}).status_code == 201
+    assert _stored(app, "alice").startswith("scrypt$2048$")
+
+def test_login_unknown_user(app, client, monkeypatch):
+    """ Tests that logging in as an unknown user costs a full hash check, so timing does not reveal usernames """
+    checked = []
+    verify = passwords.verify_password
+    monkeypatch.setattr(passwords, "verify_password", lambda password, stored, *cost: (
+        checked.append(stored) or verify(password, stored, *cost)
+    ))
+    assert client.post("/users/nobody/keys/", json={"password": "secret"}).status_code == 401
+    assert len(checked) == 1 and checked[0].startswith("scrypt$1024$")
+
+def test_signup_busy(app, client, monkeypatch):
+    """ Tests that signups are refused with 503 while the hashing pool is full """
+    hasher = PasswordHasher(n=2 ** 10, limit=1)
+    hasher._slots.acquire()
+    monkeypatch.setitem(app.extensions, "passwords", hasher)
+    response = client.post("/users/", json={"username": "alice", "password": "secret"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
@@ -0,0 +1,67 @@
+import pytest
+from datetime import datetime, timedelta
+from models import db, Activity, Category, Log, TimeReport, User
+from caching import cache
+from conftest import QUERY_BUDGETS
+
+LIST_ROUTES = [
+    ("/categories/", "/categories/"),
+    ("/categories/<string:category>/activities/", "/categories/Exercise/activities/"),
+    ("/users/", "/users/"),
+    ("/users/<string:username>/logs/", "/users/test_user/logs/"),
+    ("/users/<string:username>/reports/", "/users/test_user/reports/"),
+]
+
+@pytest.fixture
+def client(app):
+    """ Sets up a test client and a temporary in-memory database """
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username="test_user", password="1234"))
+        db.session.add(Category(name="Exercise", description="Workout activities"))
+        db.session.commit()
+    yield app.test_client()
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+def _grow(app, count):
+    """ Adds users, categories, activities, logs and reports until there are count of each """
+    start = datetime(2024, 3, 1, 8, 0)
+    with app.app_context():
+        for i in range(User.query.count(), count):
+            db.session.add(User(username=f"user{i}", password="1234"))
+        for i in range(Category.query.count(), count):
+            db.session.add(Category(name=f"Category {i}"))
+        for i in range(Activity.query.count(), count):
+            db.session.add(Activity(name=f"Activity {i}", category_name="Exercise"))
+        db.session.flush()
+        for i in range(Log.query.count(), count):
+            db.session.add(Log(
+                user_id="test_user", activity_category="Exercise", activity_name=f"Activity {i}",
+                start_time=start + timedelta(days=i), end_time=start + timedelta(days=i, hours=1)
+            ))
+        for i in range(TimeReport.query.count(), count):
+            db.session.add(TimeReport(
+                user_id="test_user", start_time=start + timedelta(weeks=i), end_time=start + timedelta(weeks=i + 1)
+            ))
+        db.session.commit()
+
+def _statements(app, client, query_counter, path):
+    """ Returns how many statements a GET of path runs when it is not served from the cache """
+    with app.app_context():
+        cache.clear()
+    response = client.get(path)
+    assert response.status_code == 200
+    return query_counter.requests[-1][2]
+
+@pytest.mark.parametrize("route, path", LIST_ROUTES)
+def test_list_queries_do_not_grow_with_items(app, client, query_counter, route, path):
+    """ Tests that listing 30 items runs as many statements as listing 3 """
+    _grow(app, 3)
+    few = _statements(app, client, query_counter, path)
+    _grow(app, 30)
+    many = _statements(app, client, query_counter, path)
+    assert len(client.get(path).json["items"]) >= 30
+    assert many == few
+    assert many <= QUERY_BUDGETS[("GET", route)]
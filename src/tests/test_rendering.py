@@ -0,0 +1,30 @@
+import pytest
+from flask import url_for
+from rendering import build_url, static_schema
+from models import Log
+
+@pytest.mark.parametrize("endpoint, values", [
+    ("categorylistresource", {}),
+    ("userresource", {"username": "test_user"}),
+    ("userresource", {"username": "with space/and ä"}),
+    ("activityresource", {"category": "Work & play", "name": "100%"}),
+    ("loglistresource", {"username": "käyttäjä"}),
+    ("logresource", {"rid": 42}),
+    ("reportresource", {"rid": 7}),
+])
+def test_build_url_matches_url_for(app, endpoint, values):
+    """ Tests that URLs built from templates are identical to url_for """
+    with app.test_request_context():
+        assert build_url(endpoint, **values) == url_for(endpoint, **values)
+
+def test_build_url_script_root(app):
+    """ Tests that templates follow the script root the app is mounted under """
+    with app.test_request_context(base_url="http://localhost/api/"):
+        assert build_url("logresource", rid=3) == url_for("logresource", rid=3) == "/api/logs/3"
+    with app.test_request_context():
+        assert build_url("logresource", rid=3) == "/logs/3"
+
+def test_static_schema_is_shared():
+    """ Tests that a model's schema is only built once """
+    assert static_schema(Log) is static_schema(Log)
+    assert static_schema(Log) == Log.get_schema()
@@ -1,13 +1,12 @@
+import threading
+from concurrent.futures import wait
 import pytest
-from models import db, TimeReport, User
-from app import app
+from models import db, Activity, Category, Log, TimeReport, User
 from datetime import datetime
 
 @pytest.fixture
-def client():
+def client(app):
     """ Sets up a test client and a temporary in-memory database """
-    app.config["TESTING"] = True
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
     with app.app_context():
         db.create_all()
         db.session.add(User(username="test_user", password="1234"))
@@ -51,7 +50,7 @@ def test_get_nonexistent_time_report(client):
     response = client.get("/reports/999")
     assert response.status_code == 404
 
-def test_delete_time_report(client):
+def test_delete_time_report(app, client):
     """ Test deleting an existing time report """
     client.post("/users/test_user/reports/", json={
         "start_time": "2024-02-10T08:00:00",
@@ -99,7 +98,7 @@ def test_get_all_reports_for_user(client):
     assert isinstance(response.json["items"], list)
     assert len(response.json["items"]) == 2
 
-def test_get_single_report(client):
+def test_get_single_report(app, client):
     """ Test retrieving a specific time report with full Mason structure """
     client.post("/users/test_user/reports/", json={
         "start_time": "2024-04-10T09:00:00",
@@ -111,6 +110,187 @@ def test_get_single_report(client):
     response = client.get(f"/reports/{rid}")
     assert response.status_code == 200
     assert "@controls" in response.json
-    assert response.json["user_id"] == ["test_user"]
+    assert response.json["user_id"] == "test_user"
     assert "start_time" in response.json
     assert "end_time" in response.json
+
+def _add_log(activity_category, activity_name, start_time, end_time):
+    db.session.add(Log(
+        user_id="test_user",
+        activity_category=activity_category,
+        activity_name=activity_name,
+        start_time=datetime.fromisoformat(start_time),
+        end_time=datetime.fromisoformat(end_time)
+    ))
+
+def test_report_totals(app, client):
+    """ Test that report totals are grouped per activity and category and clipped to the window """
+    with app.app_context():
+        db.session.add(Category(name="Work", description="Work stuff"))
+        db.session.add(Activity(name="Coding", category_name="Work"))
+        db.session.add(Activity(name="Meeting", category_name="Work"))
+        # Crosses the window start, only 1h of it counts
+        _add_log("Work", "Coding", "2024-04-10T07:00:00", "2024-04-10T09:00:00")
+        _add_log("Work", "Coding", "2024-04-10T10:00:00", "2024-04-10T11:30:00")
+        # Crosses the window end, only 30min of it counts
+        _add_log("Work", "Meeting", "2024-04-10T15:30:00", "2024-04-10T17:00:00")
+        # Outside the window entirely
+        _add_log("Work", "Meeting", "2024-04-11T08:00:00", "2024-04-11T09:00:00")
+        db.session.commit()
+    client.post("/users/test_user/reports/", json={
+        "start_time": "2024-04-10T08:00:00",
+        "end_time": "2024-04-10T16:00:00"
+    })
+    with app.app_context():
+        rid = TimeReport.query.first().rid
+
+    totals = client.get(f"/reports/{rid}").json["totals"]
+    assert totals["seconds"] == 3 * 3600
+    assert totals["categories"] == [{"category": "Work", "seconds": 3 * 3600, "hours": 3.0}]
+    assert totals["activities"] == [
+        {"category": "Work", "activity": "Coding", "seconds": 9000, "hours": 2.5},
+        {"category": "Work", "activity": "Meeting", "seconds": 1800, "hours": 0.5},
+    ]
+
+    items = client.get("/users/test_user/reports/").json["items"]
+    assert items[0]["totals"] == totals
+
+    compact = client.get("/users/test_user/reports/?view=compact").json
+    assert compact["columns"] == ["id", "user_id", "start_time", "end_time", "totals"]
+    assert compact["rows"] == [[rid, "test_user", "2024-04-10T08:00:00", "2024-04-10T16:00:00", totals]]
+
+    response = client.get("/users/test_user/reports/?view=compact&username=x&_external=1&_anchor=top")
+    assert response.status_code == 200
+    assert response.json["@controls"]["self"]["href"] == "/users/test_user/reports/?view=compact"
+
+def test_report_totals_empty(client):
+    """ Test that a report window without logs has zero totals """
+    client.post("/users/test_user/reports/", json={
+        "start_time": "2024-04-10T08:00:00",
+        "end_time": "2024-04-10T16:00:00"
+    })
+    items = client.get("/users/test_user/reports/").json["items"]
+    assert items[0]["totals"]["seconds"] == 0
+    assert items[0]["totals"]["activities"] == []
+
+def test_report_totals_multiple_days(app, client):
+    """ Test report totals over several days, with logs crossing midnight and the window edges """
+    with app.app_context():
+        db.session.add(Category(name="Work", description="Work stuff"))
+        db.session.add(Activity(name="Coding", category_name="Work"))
+        _add_log("Work", "Coding", "2024-04-09T22:00:00", "2024-04-10T02:00:00")
+        _add_log("Work", "Coding", "2024-04-10T23:00:00", "2024-04-11T01:00:00")
+        _add_log("Work", "Coding", "2024-04-12T10:00:00", "2024-04-12T14:00:00")
+        db.session.commit()
+    client.post("/users/test_user/reports/", json={
+        "start_time": "2024-04-10T01:00:00",
+        "end_time": "2024-04-12T12:00:00"
+    })
+    with app.app_context():
+        rid = TimeReport.query.first().rid
+
+    totals = client.get(f"/reports/{rid}").json["totals"]
+    assert totals["seconds"] == (1 + 2 + 2) * 3600
+
+def test_report_totals_long_log(app, client):
+    """ Test that a log starting days before a short window is still clipped into it """
+    with app.app_context():
+        db.session.add(Category(name="Work", description="Work stuff"))
+        db.session.add(Activity(name="Coding", category_name="Work"))
+        _add_log("Work", "Coding", "2024-04-07T08:00:00", "2024-04-10T12:00:00")
+        db.session.commit()
+    client.post("/users/test_user/reports/", json={
+        "start_time": "2024-04-10T09:00:00",
+        "end_time": "2024-04-10T10:00:00"
+    })
+    with app.app_context():
+        rid = TimeReport.query.first().rid
+
+    assert client.get(f"/reports/{rid}").json["totals"]["seconds"] == 3600
+
+def _wait(app, job_id):
+    wait([app.extensions["jobs"].get(job_id).future], timeout=5)
+
+def test_create_report_async(app, client):
+    """ Tests that an async report request returns a job that links to the finished report """
+    with app.app_context():
+        db.session.add(Category(name="Work", description="Work stuff"))
+        db.session.add(Activity(name="Coding", category_name="Work"))
+        _add_log("Work", "Coding", "2024-04-10T09:00:00", "2024-04-10T11:00:00")
+        db.session.commit()
+    response = client.post("/users/test_user/reports/", json={
+        "start_time": "2024-04-10T08:00:00",
+        "end_time": "2024-04-10T16:00:00"
+    }, headers={"Prefer": "respond-async"})
+    assert response.status_code == 202
+    job = response.json
+    assert job["state"] in ("queued", "running", "done")
+    assert "@controls" in job
+    _wait(app, job["id"])
+
+    response = client.get(f"/jobs/{job['id']}")
+    assert response.status_code == 200
+    assert response.json["state"] == "done"
+    assert response.json["totals"]["seconds"] == 2 * 3600
+    location = response.headers["Location"]
+    assert location == response.json["@controls"]["hlog:report"]["href"]
+    report = client.get(location)
+    assert report.status_code == 200
+    assert report.json["totals"] == response.json["totals"]
+    assert len(client.get("/users/test_user/reports/").json["items"]) == 1
+
+def test_create_report_async_deduplicated(app, client, monkeypatch):
+    """ Tests that requesting the window of a pending job returns that job """
+    import report_api
+    release = threading.Event()
+    run = report_api._run_report_job
+    monkeypatch.setattr(report_api, "_run_report_job", lambda *args: release.wait(5) and run(*args))
+    window = {"start_time": "2024-04-10T08:00:00", "end_time": "2024-04-10T16:00:00"}
+    first = client.post("/users/test_user/reports/?async=true", json=window)
+    second = client.post("/users/test_user/reports/?async=true", json=window)
+    assert first.status_code == second.status_code == 202
+    assert first.json["id"] == second.json["id"]
+    release.set()
+    _wait(app, first.json["id"])
+    with app.app_context():
+        assert TimeReport.query.count() == 1
+
+def test_cancel_report_job(app, client, monkeypatch):
+    """ Tests that a cancelled job does not create its report """
+    import report_api
+    release = threading.Event()
+    run = report_api._run_report_job
+    monkeypatch.setattr(report_api, "_run_report_job", lambda *args: release.wait(5) and run(*args))
+    job = client.post("/users/test_user/reports/?async=true", json={
+        "start_time": "2024-04-10T08:00:00",
+        "end_time": "2024-04-10T16:00:00"
+    }).json
+    response = client.delete(f"/jobs/{job['id']}")
+    assert response.status_code in (200, 202)
+    release.set()
+    _wait(app, job["id"])
+    assert client.get(f"/jobs/{job['id']}").json["state"] == "cancelled"
+    assert client.delete(f"/jobs/{job['id']}").status_code == 200
+    with app.app_context():
+        assert TimeReport.query.count() == 0
+
+def test_report_job_limit(app, client, monkeypatch):
+    """ Tests that async requests are refused with 503 while the job queue is full """
+    monkeypatch.setattr(app.extensions["jobs"], "limit", 0)
+    response = client.post("/users/test_user/reports/", json={
+        "start_time": "2024-04-10T08:00:00",
+        "end_time": "2024-04-10T16:00:00"
+    }, headers={"Prefer": "respond-async"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+
+def test_finished_report_job(app, client):
+    """ Tests that a finished job cannot be cancelled and that unknown jobs are 404 """
+    job = client.post("/users/test_user/reports/?async=true", json={
+        "start_time": "2024-04-10T08:00:00",
+        "end_time": "2024-04-10T16:00:00"
+    }).json
+    _wait(app, job["id"])
+    assert client.delete(f"/jobs/{job['id']}").status_code == 409
+    assert client.get("/jobs/missing").status_code == 404
+    assert client.delete("/jobs/missing").status_code == 404
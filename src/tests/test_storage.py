@@ -0,0 +1,78 @@
+import sqlite3
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Log
+from app import create_app
+from storage import DEFAULT_SQLITE_PRAGMAS, apply_pragmas, engine_options, read_pragmas
+
+@pytest.fixture
+def file_app(tmp_path):
+    """ An app on a database file, which unlike the in-memory one gets a pool """
+    return create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(tmp_path / "storage.db"),
+        "DB_POOL_SIZE": 3,
+    })
+
+def test_app_connections_use_storage_profile(file_app):
+    """ Tests that every connection of the served app gets the storage profile """
+    with file_app.app_context():
+        connection = db.engine.raw_connection()
+        try:
+            values = read_pragmas(connection, DEFAULT_SQLITE_PRAGMAS)
+        finally:
+            connection.close()
+    assert values["foreign_keys"] == 1
+    assert values["journal_mode"] == "wal"
+    assert values["synchronous"] == 1
+    assert values["busy_timeout"] == 5000
+    assert values["temp_store"] == 2
+    assert values["cache_size"] == DEFAULT_SQLITE_PRAGMAS["cache_size"]
+
+def test_storage_profile_logged_as_applied(caplog):
+    """ Tests that the startup log shows the pragma values SQLite applied, not the requested ones """
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"})
+    with caplog.at_level("INFO", logger=app.logger.name):
+        with app.app_context():
+            db.session.execute(db.text("SELECT 1"))
+            db.session.remove()
+    messages = [record.getMessage() for record in caplog.records if "storage profile" in record.getMessage()]
+    assert len(messages) == 1
+    assert "journal_mode=memory" in messages[0]
+    assert "journal_mode=wal" not in messages[0]
+
+def test_app_enforces_foreign_keys(app):
+    """ Tests that the served app rejects a log of a user that does not exist """
+    with app.app_context():
+        db.create_all()
+        with pytest.raises(IntegrityError):
+            db.session.execute(Log.__table__.insert().values(
+                user_id="nobody-here", start_time=db.func.now(), end_time=db.func.now()
+            ))
+        db.session.rollback()
+
+def test_apply_pragmas(tmp_path):
+    """ Tests that the profile switches a file database to WAL """
+    connection = sqlite3.connect(str(tmp_path / "profile.db"))
+    apply_pragmas(connection, DEFAULT_SQLITE_PRAGMAS)
+    values = read_pragmas(connection, ["journal_mode", "synchronous", "mmap_size"])
+    connection.close()
+    assert values == {"journal_mode": "wal", "synchronous": 1, "mmap_size": DEFAULT_SQLITE_PRAGMAS["mmap_size"]}
+
+def test_worker_pool_settings(file_app):
+    """ Tests that the pool settings of the config reach the engine """
+    with file_app.app_context():
+        assert db.engine.pool.size() == 3
+        assert db.engine.pool.timeout() == 30
+
+def test_memory_database_has_no_pool_settings():
+    """ Tests that an in-memory database keeps its single static connection """
+    config = {"SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:", "DB_POOL_SIZE": 3}
+    assert engine_options(config) == {}
+
+def test_startup_timings(app):
+    """ Tests that the factory records how long importing and starting took """
+    timings = app.extensions["startup_timings"]
+    assert timings["import_seconds"] > 0
+    assert timings["startup_seconds"] > 0
@@ -1,12 +1,9 @@
 import pytest
 from models import db, User, Category, Activity
-from app import app
 
 @pytest.fixture
-def client():
+def client(app):
     """ Sets up a test client and a temporary in-memory database """
-    app.config["TESTING"] = True
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
     with app.app_context():
         db.create_all()
         db.session.add(Category(name="Hobby", description="Fun stuff"))
@@ -65,6 +62,22 @@ def test_get_all_users(client):
     assert "items" in response.json
     assert len(response.json["items"]) >= 2
 
+def test_get_users_compact(client):
+    """ Test the compact view of the user list: plain rows without controls """
+    client.post("/users/", json={"username": "user1", "password": "pass1"})
+    client.post("/users/", json={"username": "user2", "password": "pass2"})
+
+    response = client.get("/users/?view=compact")
+    assert response.status_code == 200
+    assert response.json["columns"] == ["username"]
+    assert sorted(response.json["rows"]) == [["user1"], ["user2"]]
+    assert "items" not in response.json
+    assert set(response.json["@controls"]) == {"self", "profile"}
+
+    response = client.get("/users/?view=compact&username=x&_external=1&_anchor=top")
+    assert response.status_code == 200
+    assert response.json["@controls"]["self"]["href"] == "/users/?view=compact"
+
 def test_delete_user_with_logs(client):
     """ Tests deleting a user with logs (logs should be set to NULL) """
     client.post("/users/", json={"username": "test_user", "password": "1234"})
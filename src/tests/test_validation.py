@@ -0,0 +1,47 @@
+import pytest
+from datetime import datetime
+from models import Log, User, TimeReport
+from validation import ValidationError, validate, validator_for
+
+def test_validator_is_compiled_once():
+    """ Tests that validators are cached per model and required fields """
+    assert validator_for(Log) is validator_for(Log)
+    assert validator_for(User) is not validator_for(User, required=["password"])
+
+def test_datetime_fields_are_parsed():
+    """ Tests that date-time fields come back as datetime objects """
+    data = validate(TimeReport, {"start_time": "2024-02-10T08:00:00", "end_time": "2024-02-10T16:30:00"})
+    assert data["start_time"] == datetime(2024, 2, 10, 8, 0)
+    assert data["end_time"] == datetime(2024, 2, 10, 16, 30)
+
+def test_errors_per_field():
+    """ Tests that every invalid field gets its own message """
+    with pytest.raises(ValidationError) as exc:
+        validate(Log, {
+            "activity_category": 5,
+            "start_time": "bad-time",
+            "end_time": "2024-02-10T09:00:00"
+        })
+    errors = exc.value.errors
+    assert set(errors) == {"activity_category", "activity_name", "start_time"}
+    assert errors["activity_name"] == "activity_name is required"
+    assert "not of type 'string'" in errors["activity_category"]
+    assert "Invalid date format" in errors["start_time"]
+
+def test_datetime_with_offset_rejected():
+    """ Tests that timestamps with a time zone are refused instead of failing later against naive times """
+    with pytest.raises(ValidationError) as exc:
+        validate(TimeReport, {"start_time": "2024-02-10T08:00:00+02:00", "end_time": "2024-02-10T16:30:00"})
+    assert set(exc.value.errors) == {"start_time"}
+
+def test_body_must_be_object():
+    """ Tests that a body that is not a JSON object is rejected as a whole """
+    with pytest.raises(ValidationError) as exc:
+        validate(User, "username")
+    assert list(exc.value.errors) == ["body"]
+
+def test_required_override():
+    """ Tests that edit validators only require the given fields """
+    assert validate(User, {"password": "secret"}, required=["password"]) == {"password": "secret"}
+    with pytest.raises(ValidationError):
+        validate(User, {"password": "secret"})
@@ -1,13 +1,34 @@
-import json
-from flask import Response, request, url_for
-from flask_restful import Resource, reqparse
-from models import db, User
-from utils import HourLoggerBuilder, create_error_response
+from flask import current_app, request, url_for
+from flask_restful import Resource
+from sqlalchemy import select
+from models import db, Log, TimeReport, User
+from utils import (
+    HourLoggerBuilder, create_compact_response, create_error_response, create_response, wants_compact,
+)
+from caching import cached, invalidate
+from auth import require_admin, require_user
+from rendering import build_url, url_template
+from validation import ValidationError, validate
+from passwords import HasherBusy
 from constants import *
 
+def _busy_response(exc):
+    response = create_error_response(503, "Too many password changes", str(exc))
+    response.headers["Retry-After"] = "1"
+    return response
+
 class UserListResource(Resource):
+    @require_admin
+    @cached("users")
     def get(self):
-        """Retrieve all users."""
+        """Retrieve all users, or ?view=compact for plain rows."""
+        if wants_compact():
+            usernames = db.session.execute(select(User.username)).scalars()
+            return create_compact_response(
+                url_for("userlistresource", view="compact"), ("username",),
+                [[username] for username in usernames],
+            )
+
         body = HourLoggerBuilder()
         body.add_namespace("hlog", LINK_RELATIONS_URL)
         body.add_control("self", url_for("userlistresource"))
@@ -15,17 +36,23 @@ class UserListResource(Resource):
         body["items"] = []
         
         users = User.query.all()
+        user_url = url_template("userresource")
+        logs_url = url_template("loglistresource")
+        reports_url = url_template("reportlistresource")
+        categories_href = build_url("categorylistresource")
         for user in users:
-            item = HourLoggerBuilder()
-            item.add_control("self", url_for("userresource", username=user.username))
-            item.add_control("profile", USER_PROFILE)
-            item.add_control("categories-all", url_for("categorylistresource"))
-            item.add_control("logs-by", url_for("loglistresource", username=user.username))
-            item.add_control("reports-by", url_for("reportlistresource", username=user.username))
-            item["username"] = user.username
-            body["items"].append(item)
+            body["items"].append({
+                "@controls": {
+                    "self": {"href": user_url.build(username=user.username)},
+                    "profile": {"href": USER_PROFILE},
+                    "categories-all": {"href": categories_href},
+                    "logs-by": {"href": logs_url.build(username=user.username)},
+                    "reports-by": {"href": reports_url.build(username=user.username)},
+                },
+                "username": user.username,
+            })
             
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        return create_response(body)
 
     def post(self):
         """Create a new user."""
@@ -35,21 +62,28 @@ class UserListResource(Resource):
                 "Requests must be JSON"
             )
         
-        parser = reqparse.RequestParser()
-        parser.add_argument("username", required=True, help="Username is required")
-        parser.add_argument("password", required=True, help="Password is required")
-        data = parser.parse_args()
+        try:
+            data = validate(User, request.json)
+        except ValidationError as exc:
+            return {"message": exc.errors}, 400
 
         if User.query.filter_by(username=data["username"]).first():
             return {"error": "User already exists"}, 409
 
-        user = User(username=data["username"], password=data["password"])
+        try:
+            password = current_app.extensions["passwords"].hash(data["password"])
+        except HasherBusy as exc:
+            return _busy_response(exc)
+        user = User(username=data["username"], password=password)
         db.session.add(user)
+        invalidate("users")
         db.session.commit()
         return {"message": "User created successfully"}, 201
 
 
 class UserResource(Resource):
+    @require_user()
+    @cached("user:{username}")
     def get(self, username):
         """Retrieve a user by username."""
         user = User.query.filter_by(username=username).first()
@@ -64,13 +98,16 @@ class UserResource(Resource):
         body.add_control("categories-all", url_for("categorylistresource"))
         body.add_control("logs-by", url_for("loglistresource", username=username))
         body.add_control("reports-by", url_for("reportlistresource", username=username))
+        body.add_control("analytics-of", url_for("analyticsresource", username=username))
+        body.add_control("keys-of", url_for("apikeylistresource", username=username))
         body.add_control_delete_user(username)
         body.add_control_modify_user(username)
             
         body["username"] = user.username
         
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        return create_response(body)
 
+    @require_user()
     def put(self, username):
         """Update a user's password."""
         if not request.json:
@@ -83,20 +120,33 @@ class UserResource(Resource):
         if not user:
             return {"error": "User not found"}, 404
 
-        parser = reqparse.RequestParser()
-        parser.add_argument("password", required=True, help="New password is required")
-        data = parser.parse_args()
+        try:
+            data = validate(User, request.json, required=["password"])
+        except ValidationError as exc:
+            return {"message": exc.errors}, 400
 
-        user.password = data["password"]
+        try:
+            user.password = current_app.extensions["passwords"].hash(data["password"])
+        except HasherBusy as exc:
+            return _busy_response(exc)
+        invalidate(f"user:{username}")
         db.session.commit()
         return {"message": "User password updated"}, 200
 
+    @require_user()
     def delete(self, username):
         """Delete a user."""
         user = User.query.filter_by(username=username).first()
         if not user:
             return {"error": "User not found"}, 404
 
+        # The user's logs are unlinked and their reports deleted along with it
+        scopes = ["users", f"user:{username}", f"logs:{username}", f"reports:{username}"]
+        scopes += [f"log:{rid}" for rid, in db.session.query(Log.rid).filter_by(user_id=username)]
+        scopes += [f"report:{rid}" for rid, in db.session.query(TimeReport.rid).filter_by(user_id=username)]
         db.session.delete(user)
+        invalidate(*scopes)
         db.session.commit()
+        # The user's API keys are deleted with it
+        current_app.extensions["api_keys"].discard_user(username)
         return {"message": "User deleted"}, 200
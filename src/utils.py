@@ -1,11 +1,14 @@
-import json
-import secrets
-from flask import Response, request, url_for
-from werkzeug.exceptions import Forbidden, NotFound
+import base64
+from datetime import datetime
+from flask import Response, request
+from werkzeug.exceptions import NotFound
+from werkzeug.http import parse_options_header
 from werkzeug.routing import BaseConverter
 
 from constants import *
 from models import *
+from encoding import dumps
+from rendering import build_url, static_schema
 
 class MasonBuilder(dict):
     """
@@ -77,7 +80,7 @@ class HourLoggerBuilder(MasonBuilder):
     def add_control_delete_category(self, name):
         self.add_control(
             "hlog:delete-category",
-            url_for("categoryresource", name=name),
+            build_url("categoryresource", name=name),
             method="DELETE",
             title="Delete this category"
         )
@@ -85,7 +88,7 @@ class HourLoggerBuilder(MasonBuilder):
     def add_control_delete_activity(self, name, category):
         self.add_control(
             "hlog:delete-activity",
-            url_for("activityresource", name=name, category=category),
+            build_url("activityresource", name=name, category=category),
             method="DELETE",
             title="Delete this activity"
         )
@@ -93,7 +96,7 @@ class HourLoggerBuilder(MasonBuilder):
     def add_control_delete_user(self, username):
         self.add_control(
             "hlog:delete-user",
-            url_for("userresource", username=username),
+            build_url("userresource", username=username),
             method="DELETE",
             title="Delete user"
         )
@@ -101,7 +104,7 @@ class HourLoggerBuilder(MasonBuilder):
     def add_control_delete_log(self, rid):
         self.add_control(
             "hlog:delete-log",
-            url_for("logresource", rid=rid),
+            build_url("logresource", rid=rid),
             method="DELETE",
             title="Delete log with certain rid"
         )
@@ -109,91 +112,141 @@ class HourLoggerBuilder(MasonBuilder):
     def add_control_delete_report(self, rid):
         self.add_control(
             "hlog:delete-report",
-            url_for("reportresource", rid=rid),
+            build_url("reportresource", rid=rid),
             method="DELETE",
             title="Delete report with certain rid"
         )
 
+    def add_control_cancel_job(self, job_id):
+        self.add_control(
+            "hlog:cancel-job",
+            build_url("reportjobresource", job_id=job_id),
+            method="DELETE",
+            title="Cancel this report job"
+        )
+
     def add_control_add_category(self):
         self.add_control(
             "hlog:add-category",
-            url_for("categorylistresource"),
+            build_url("categorylistresource"),
             method="POST",
             encoding="json",
             title="Add a new category",
-            schema=Category.get_schema()
+            schema=static_schema(Category)
         )
 
     def add_control_add_activity(self, category):
         self.add_control(
             "hlog:add-activity",
-            url_for("activitylistresource", category=category),
+            build_url("activitylistresource", category=category),
             method="POST",
             encoding="json",
             title="Add a new activity for this category",
-            schema=Activity.get_schema()
+            schema=static_schema(Activity)
         )
         
     def add_control_add_user(self):
         self.add_control(
             "hlog:add-user",
-            url_for("userlistresource"),
+            build_url("userlistresource"),
             method="POST",
             encoding="json",
             title="Add a new user",
-            schema=User.get_schema()
+            schema=static_schema(User)
         )
     
     def add_control_add_log(self, username):
         self.add_control(
             "hlog:add-log",
-            url_for("loglistresource", username=username),
+            build_url("loglistresource", username=username),
             method="POST",
             encoding="json",
             title="Add a new log for this user",
-            schema=Log.get_schema()
+            schema=static_schema(Log)
         )
     
     def add_control_add_report(self, username):
         self.add_control(
             "hlog:add-report",
-            url_for("reportlistresource", username=username),
+            build_url("reportlistresource", username=username),
             method="POST",
             encoding="json",
             title="Add a new report for this user",
-            schema=TimeReport.get_schema()
+            schema=static_schema(TimeReport)
         )
 
     def add_control_modify_category(self, name):
         self.add_control(
             "hlog:edit-category",
-            url_for("categoryresource", name=name),
+            build_url("categoryresource", name=name),
             method="PUT",
             encoding="json",
             title="Edit this category",
-            schema=Category.get_schema()
+            schema=static_schema(Category)
         )
         
     def add_control_modify_activity(self, name, category):
         self.add_control(
             "hlog:edit-activity",
-            url_for("activityresource", name=name, category=category),
+            build_url("activityresource", name=name, category=category),
             method="PUT",
             encoding="json",
             title="Edit activity from category",
-            schema=Activity.get_schema()
+            schema=static_schema(Activity)
         )
         
     def add_control_modify_user(self, username):
         self.add_control(
             "hlog:edit-user",
-            url_for("userresource", username=username),
+            build_url("userresource", username=username),
             method="PUT",
             encoding="json",
             title="Edit this user",
-            schema=User.get_schema()
+            schema=static_schema(User)
+        )
+
+    def add_control_filter_logs(self, username):
+        self.add_control(
+            "hlog:filter-logs",
+            build_url("loglistresource", username=username) + "{?from,to,category,activity,limit}",
+            isHrefTemplate=True,
+            title="Filter the logs of this user",
+            schema=self._log_filter_schema()
         )
 
+    @staticmethod
+    def _log_filter_schema():
+        schema = {
+            "type": "object",
+            "properties": {},
+            "required": []
+        }
+        props = schema["properties"]
+        props["from"] = {
+            "description": "Only logs that start at or after this time",
+            "type": "string",
+            "format": "date-time"
+        }
+        props["to"] = {
+            "description": "Only logs that start before this time",
+            "type": "string",
+            "format": "date-time"
+        }
+        props["category"] = {
+            "description": "Only logs of activities in this category",
+            "type": "string"
+        }
+        props["activity"] = {
+            "description": "Only logs of activities with this name",
+            "type": "string"
+        }
+        props["limit"] = {
+            "description": "Number of logs per page",
+            "type": "integer",
+            "default": LOG_PAGE_SIZE
+        }
+        return schema
+
     """
     def add_control_get_measurements(self, sensor):
         base_uri = url_for("api.measurementcollection", sensor=sensor)
@@ -226,29 +279,66 @@ def create_error_response(status_code, title, message=None):
     body = MasonBuilder(resource_url=resource_url)
     body.add_error(title, message)
     body.add_control("profile", href=ERROR_PROFILE)
-    return Response(json.dumps(body), status_code, mimetype=MASON)
+    return create_response(body, status_code)
 
-def page_key(*args, **kwargs):
-    start = request.args.get("start", 0)
-    return request.path + f"[start_{start}]"
-    
-def require_admin(func):
-    def wrapper(*args, **kwargs):
-        key_hash = ApiKey.key_hash(request.headers.get("Sensorhub-Api-Key", "").strip())
-        db_key = ApiKey.query.filter_by(admin=True).first()
-        if secrets.compare_digest(key_hash, db_key.key):
-            return func(*args, **kwargs)
-        raise Forbidden
-    return wrapper
-
-def require_sensor_key(func):
-    def wrapper(self, sensor, *args, **kwargs):
-        key_hash = ApiKey.key_hash(request.headers.get("Sensorhub-Api-Key").strip())
-        db_key = ApiKey.query.filter_by(sensor=sensor).first()
-        if db_key is not None and secrets.compare_digest(key_hash, db_key.key):
-            return func(*args, **kwargs)
-        raise Forbidden
-    return wrapper
+def create_response(body, status_code=200, mimetype=MASON, headers=None):
+    """
+    Builds the response of every resource. The body is encoded with the
+    JSON encoder selected with encoding.set_encoder straight into bytes.
+    """
+    return Response(dumps(body), status_code, headers=headers, mimetype=mimetype)
+
+def wants_compact():
+    """
+    Tells whether the request asks for the compact view of a collection,
+    either with ?view=compact or with the compact profile as a parameter of
+    the Mason media type in Accept.
+    """
+    if request.args.get("view") == "compact":
+        return True
+    for value, quality in request.accept_mimetypes:
+        mimetype, options = parse_options_header(value)
+        if mimetype == MASON and quality and options.get("profile") == COMPACT_PROFILE:
+            return True
+    return False
+
+def create_compact_response(self_href, columns, rows, **links):
+    """
+    Builds the compact view of a collection: the column names once and
+    every item as a plain row of values, without per-item controls or
+    schemas. links are extra controls such as the next and prev pages.
+    """
+    controls = {"self": {"href": self_href}, "profile": {"href": COMPACT_PROFILE}}
+    for rel, href in links.items():
+        controls[rel] = {"href": href}
+    return create_response({"@controls": controls, "columns": list(columns), "rows": rows})
+
+def encode_cursor(direction, start_time, rid):
+    """
+    Encodes a keyset position into an opaque cursor string. The position is
+    the (start_time, rid) pair of the row the page continues from, and the
+    direction tells whether the rows after ("next") or before ("prev") it are
+    wanted.
+    """
+    raw = "{}|{}|{}".format(direction, start_time.isoformat(), rid)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor created by encode_cursor. Returns a tuple of
+    (direction, (start_time, rid)). Raises ValueError if the cursor has been
+    tampered with or is otherwise malformed.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        direction, start_time, rid = raw.split("|")
+        key = (datetime.fromisoformat(start_time), int(rid))
+    except (TypeError, UnicodeDecodeError, ValueError) as exc:
+        raise ValueError("Malformed cursor") from exc
+    if direction not in ("next", "prev"):
+        raise ValueError("Malformed cursor")
+    return direction, key
 
 
 class SensorConverter(BaseConverter):
@@ -0,0 +1,111 @@
+from datetime import datetime
+
+from jsonschema import Draft7Validator
+
+from models import *
+
+_validators = {}
+
+
+class ValidationError(ValueError):
+    """
+    Raised when a request body does not match its schema. The errors
+    attribute maps each offending field to a message, in the same shape as
+    the "message" of a Flask-RESTful reqparse error.
+    """
+
+    def __init__(self, errors):
+        super().__init__("; ".join(errors.values()))
+        self.errors = errors
+
+
+def parse_datetime(value):
+    """
+    Parses a naive ISO 8601 timestamp. Timestamps with a UTC offset raise
+    ValueError like malformed ones: the API stores naive times, and an aware
+    datetime cannot be compared with them.
+    """
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        raise ValueError("Timestamps must not have a time zone offset")
+    return moment
+
+
+class RequestValidator:
+    """
+    Validates request bodies against a model schema with a jsonschema
+    validator that is compiled only once. Fields with the date-time format
+    are not checked by jsonschema but parsed with parse_datetime, which is
+    both much faster and accepts only the naive ISO 8601 timestamps the API
+    uses. validate returns a copy of the body with those fields already
+    converted to datetime objects.
+    """
+
+    def __init__(self, schema):
+        self._datetime_fields = [
+            name for name, prop in schema.get("properties", {}).items()
+            if prop.get("format") == "date-time"
+        ]
+        Draft7Validator.check_schema(schema)
+        self._validator = Draft7Validator(schema)
+
+    def validate(self, data):
+        errors = {}
+        for error in self._validator.iter_errors(data):
+            if error.validator == "required":
+                for name in error.validator_value:
+                    if name not in error.instance:
+                        errors.setdefault(name, "{} is required".format(name))
+            elif error.path:
+                name = str(error.path[0])
+                errors.setdefault(name, "{}: {}".format(name, error.message))
+            else:
+                errors.setdefault("body", error.message)
+        if "body" in errors:
+            raise ValidationError(errors)
+
+        data = dict(data)
+        for name in self._datetime_fields:
+            if name in errors or data.get(name) is None:
+                continue
+            try:
+                data[name] = parse_datetime(data[name])
+            except ValueError:
+                errors[name] = "{}: Invalid date format. Use ISO 8601 format without a time zone (YYYY-MM-DDTHH:MM:SS)".format(name)
+        if errors:
+            raise ValidationError(errors)
+        return data
+
+
+def validator_for(model, required=None):
+    """
+    Returns the cached validator of a model's schema. Edit requests that only
+    need some of the fields pass them as required, which replaces the list
+    of required fields of the schema.
+    """
+    key = (model, tuple(required) if required is not None else None)
+    validator = _validators.get(key)
+    if validator is None:
+        schema = dict(model.get_schema())
+        if required is not None:
+            schema["required"] = list(required)
+        validator = _validators[key] = RequestValidator(schema)
+    return validator
+
+def validate(model, data, required=None):
+    """
+    Validates a request body against a model's schema. Returns the body with
+    date-time fields parsed, or raises ValidationError.
+    """
+    return validator_for(model, required).validate(data)
+
+def compile_validators():
+    """
+    Compiles the validators of every model up front, so that no request pays
+    for it. Called once when the app starts.
+    """
+    for model in (User, Category, Activity, Log, TimeReport):
+        validator_for(model)
+    validator_for(User, required=["password"])
+    validator_for(Category, required=[])
+    validator_for(Activity, required=[])